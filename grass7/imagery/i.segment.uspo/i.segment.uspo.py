@@ -282,6 +282,12 @@
 #% guisection: Mean Shift
 #%end
 #
+#%flag
+#% key: n
+#% label: Compute criteria with GRASS modules instead of in memory
+#% description: Uses r.stats.zonal, r.univar and r.neighborhoodmatrix for each segmentation instead of reading the rasters into memory (for regions too large to fit into memory)
+#%end
+#
 #%rules
 #% required: thresholds,threshold_start
 #% excludes: thresholds,threshold_start,threshold_stop,threshold_step
@@ -301,7 +307,14 @@ import os
 import atexit
 from multiprocessing import Process, Queue, current_process
 
+import numpy
+
 # check requirements
+# scipy is only required for the in-memory criteria
+try:
+    from scipy.sparse import coo_matrix
+except ImportError:
+    coo_matrix = None
 
 # for python 3 compatibility
 try:
@@ -358,23 +371,7 @@ def rg_hier_worker(parms, thresholds, minsize_queue, result_queue):
             for mapname, threshold, minsize in map_list:
                 mapinfo = gscript.raster_info(mapname)
                 if mapinfo['max'] > mapinfo['min']:
-                    variance_per_raster = []
-                    autocor_per_raster = []
-                    neighbordict = get_nb_matrix(mapname)
-                    for raster in parms['rasters']:
-                        # there seems to be some trouble in ms windows with qualified
-                        # map names
-                        raster = raster.split('@')[0]
-                        var = get_variance(mapname, raster)
-                        variance_per_raster.append(var)
-                        autocor = get_autocorrelation(mapname, raster,
-                                                      neighbordict, parms['indicator'])
-                        autocor_per_raster.append(autocor)
-
-                    mean_lv = sum(variance_per_raster) / \
-                        len(variance_per_raster)
-                    mean_autocor = sum(autocor_per_raster) / \
-                        len(autocor_per_raster)
+                    mean_lv, mean_autocor = get_criteria(parms, mapname, True)
                     result_queue.put([mapname, mean_lv, mean_autocor,
                                       threshold, minsize])
                 else:
@@ -400,22 +397,7 @@ def rg_nonhier_worker(parms, parameter_queue, result_queue):
             mapname = rg_non_hierarchical_seg(parms, threshold, minsize)
             mapinfo = gscript.raster_info(mapname)
             if mapinfo['max'] > mapinfo['min']:
-                variance_per_raster = []
-                autocor_per_raster = []
-                neighbordict = get_nb_matrix(mapname)
-                for raster in parms['rasters']:
-                    # there seems to be some trouble in ms windows with qualified
-                    # map names
-                    raster = raster.split('@')[0]
-                    var = get_variance(mapname, raster)
-                    variance_per_raster.append(var)
-                    autocor = get_autocorrelation(mapname, raster,
-                                                  neighbordict, parms['indicator'])
-                    autocor_per_raster.append(autocor)
-
-                mean_lv = sum(variance_per_raster) / len(variance_per_raster)
-                mean_autocor = sum(autocor_per_raster) / \
-                    len(autocor_per_raster)
+                mean_lv, mean_autocor = get_criteria(parms, mapname, True)
                 result_queue.put(
                     [mapname, mean_lv, mean_autocor, threshold, minsize])
             else:
@@ -505,24 +487,7 @@ def ms_worker(parms, parameter_queue, result_queue):
     try:
         for threshold, hr, radius, minsize in iter(parameter_queue.get, 'STOP'):
             mapname = ms_seg(parms, threshold, hr, radius, minsize)
-            variance_per_raster = []
-            autocor_per_raster = []
-            neighbordict = get_nb_matrix(mapname)
-            for raster in parms['rasters']:
-                var = get_variance(mapname, raster)
-                variance_per_raster.append(var)
-                autocor = get_autocorrelation(mapname, raster,
-                                              neighbordict, parms['indicator'])
-                autocor_per_raster.append(autocor)
-
-            if len(variance_per_raster) > 0:
-                mean_lv = sum(variance_per_raster) / len(variance_per_raster)
-            else:
-                mean_lv = 999999
-            if len(autocor_per_raster) > 0:
-                mean_autocor = sum(autocor_per_raster) / len(autocor_per_raster)
-            else:
-                mean_autocor = 0
+            mean_lv, mean_autocor = get_criteria(parms, mapname, False)
             result_queue.put([mapname, mean_lv, mean_autocor, threshold, hr,
                               radius, minsize])
 
@@ -665,7 +630,7 @@ def get_autocorrelation(mapname, raster, neighbordict, indicator):
         for neighbor in neighbors:
             neighbor_value = means[neighbor] - global_mean
             sum_products += region_value * neighbor_value
-            sum_squared_differences = (means[region] - means[neighbor]) ** 2
+            sum_squared_differences += (means[region] - means[neighbor]) ** 2
 
     if indicator == 'morans':
         autocor = ((float(N) / total_nb_neighbors) *
@@ -677,6 +642,149 @@ def get_autocorrelation(mapname, raster, neighbordict, indicator):
     return autocor
 
 
+def get_criteria(parms, mapname, strip_mapset):
+    """ Calculate the mean intra-segment variance and the mean spatial
+    autocorrelation over all rasters for a segmentation """
+
+    variance_per_raster = []
+    autocor_per_raster = []
+    if parms['in_memory']:
+        segments = read_segments(mapname)
+        adjacency = get_adjacency(segments)
+        for band in parms['bands']:
+            var, autocor = get_criteria_array(segments, adjacency, band,
+                                              parms['indicator'])
+            variance_per_raster.append(var)
+            autocor_per_raster.append(autocor)
+    else:
+        neighbordict = get_nb_matrix(mapname)
+        for raster in parms['rasters']:
+            if strip_mapset:
+                # there seems to be some trouble in ms windows with qualified
+                # map names
+                raster = raster.split('@')[0]
+            var = get_variance(mapname, raster)
+            variance_per_raster.append(var)
+            autocor = get_autocorrelation(mapname, raster,
+                                          neighbordict, parms['indicator'])
+            autocor_per_raster.append(autocor)
+
+    if len(variance_per_raster) > 0:
+        mean_lv = sum(variance_per_raster) / len(variance_per_raster)
+    else:
+        mean_lv = 999999
+    if len(autocor_per_raster) > 0:
+        mean_autocor = sum(autocor_per_raster) / len(autocor_per_raster)
+    else:
+        mean_autocor = 0
+
+    return mean_lv, mean_autocor
+
+
+def read_bands(rasters):
+    """ Read the rasters of the current region into arrays, null cells are
+    set to NaN """
+
+    from grass.script import array as garray
+
+    bands = []
+    for raster in rasters:
+        band = garray.array()
+        band.read(raster, null='nan')
+        bands.append(numpy.asarray(band))
+
+    return bands
+
+
+def read_segments(mapname):
+    """ Read a segmentation map into an integer array, null cells are set
+    to 0 """
+
+    from grass.script import array as garray
+
+    segments = garray.array(dtype=numpy.int32)
+    segments.read(mapname, null=0)
+
+    return numpy.asarray(segments)
+
+
+def get_adjacency(segments):
+    """ Create a binary, symmetric sparse adjacency matrix of the segments
+    from the comparison of the segment array with its shifted copies (4
+    neighbors) """
+
+    pairs = []
+    for first, second in [(segments[:, :-1], segments[:, 1:]),
+                          (segments[:-1, :], segments[1:, :])]:
+        border = (first != second) & (first > 0) & (second > 0)
+        pairs.append((first[border], second[border]))
+    rows = numpy.concatenate([p[0] for p in pairs] + [p[1] for p in pairs])
+    cols = numpy.concatenate([p[1] for p in pairs] + [p[0] for p in pairs])
+    size = int(segments.max()) + 1
+    adjacency = coo_matrix((numpy.ones(len(rows)), (rows, cols)),
+                           shape=(size, size)).tocsr()
+    # segments touching along several cells are neighbors only once
+    adjacency.data[:] = 1
+
+    return adjacency
+
+
+def get_criteria_array(segments, adjacency, band, indicator):
+    """ Calculate the intra-segment variance and either Moran's I or Geary's
+    C for values of the given band array
+
+    The variance is the mean of the per-segment variances weighted by the
+    number of cells of each segment, like the mean of the r.stats.zonal
+    variance map computed by get_variance(). The autocorrelation is computed
+    from the segment means as in get_autocorrelation(). """
+
+    size = adjacency.shape[0]
+    in_segment = segments > 0
+    valid = in_segment & ~numpy.isnan(band)
+    ids = segments[valid]
+    values = band[valid]
+
+    cells = numpy.bincount(segments[in_segment], minlength=size)
+    count = numpy.bincount(ids, minlength=size)
+    sums = numpy.bincount(ids, weights=values, minlength=size)
+    sums_sq = numpy.bincount(ids, weights=values ** 2, minlength=size)
+
+    present = count > 0
+    means = numpy.zeros(size)
+    means[present] = sums[present] / count[present]
+    variances = numpy.zeros(size)
+    variances[present] = sums_sq[present] / count[present] - \
+        means[present] ** 2
+    variances = numpy.maximum(variances, 0)
+    var = numpy.sum(cells[present] * variances[present]) / \
+        float(numpy.sum(cells[present]))
+
+    global_mean = numpy.nanmean(band)
+    mean_diffs = numpy.where(present, means - global_mean, 0)
+    sum_sq_mean_diffs = numpy.sum(mean_diffs ** 2)
+
+    # only segments with values take part
+    weights = adjacency.multiply(present[:, numpy.newaxis]).multiply(
+        present[numpy.newaxis, :]).tocsr()
+    # the masked pairs are kept as explicit zeros and must not be counted
+    weights.eliminate_zeros()
+    weights = weights.tocoo()
+    total_nb_neighbors = weights.nnz
+    N = numpy.count_nonzero(present)
+
+    if indicator == 'morans':
+        sum_products = mean_diffs.dot(weights.dot(mean_diffs))
+        autocor = ((float(N) / total_nb_neighbors) *
+                   (float(sum_products) / sum_sq_mean_diffs))
+    elif indicator == 'geary':
+        sum_squared_differences = numpy.sum(
+            (means[weights.row] - means[weights.col]) ** 2)
+        autocor = (float(N - 1) / (2 * total_nb_neighbors)) * \
+            (float(sum_squared_differences) / sum_sq_mean_diffs)
+
+    return var, autocor
+
+
 def normalize_criteria(crit_list, direction):
     """ Normalize the optimization criteria """
 
@@ -741,9 +849,15 @@ def main():
         message += "INFO: Note that this leads to less optimal parallization."
         gscript.info(message)
 
-    check_progs()
-
     parms = {}
+    parms['in_memory'] = not flags['n']
+    if parms['in_memory']:
+        if coo_matrix is None:
+            gscript.fatal(_("Cannot import scipy (https://scipy.org/) library."
+                            " Please install it or use the -n flag."))
+    else:
+        check_progs()
+
     group = options['group']
     parms['group'] = group
     method = options['segmentation_method']
@@ -852,6 +966,11 @@ def main():
                             region=region,
                             quiet=True)
 
+        # Read the rasters once per region, the worker processes inherit
+        # the arrays
+        if parms['in_memory']:
+            parms['bands'] = read_bands(rasters)
+
         # Launch segmentation and optimization calculation in parallel processes
         processes_list = []
         result_queue = Queue()
@@ -71,6 +71,15 @@
 #% description: Name of directory into which Sentinel metadata json dumps are saved
 #% required: no
 #%end
+#%option
+#% key: nprocs
+#% type: integer
+#% required: no
+#% multiple: no
+#% label: Number of processes
+#% description: Number of zip files extracted and raster files imported in parallel
+#% answer: 1
+#%end
 #%flag
 #% key: r
 #% description: Reproject raster data using r.import if needed
@@ -119,15 +128,28 @@ import glob
 import shutil
 import io
 import json
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 from zipfile import ZipFile
 
 import grass.script as gs
 from grass.exceptions import CalledModuleError
 
+def _import_worker(job):
+    # run in a worker process, see SentinelImporter.import_products()
+    filename, module, args = job
+    return filename, SentinelImporter._import_file(filename, module, args)
+
+def _check_worker(filename):
+    return filename, SentinelImporter._check_projection(filename)
+
 class SentinelImporter(object):
-    def __init__(self, input_dir, unzip_dir):
+    def __init__(self, input_dir, unzip_dir, nprocs=1):
         # list of directories to cleanup
         self._dir_list = []
+        # files of the extracted SAFE directories, see _safe_files()
+        self._safe_index = {}
+        self.nprocs = nprocs
 
         # check if input dir exists
         self.input_dir = input_dir
@@ -176,32 +198,67 @@ class SentinelImporter(object):
         return file_list
     """
 
-    def _unzip(self, force=False):
-        # extract all zip files from input directory
+    def _unzip(self, filter_p, force=False):
+        # extract the members of the zip files from input directory whose
+        # file name matches the filter, the other members are skipped
         if options['pattern_file']:
             filter_f = '*' + options['pattern_file'] + '*.zip'
         else:
             filter_f = '*.zip'
 
         input_files = glob.glob(os.path.join(self.input_dir, filter_f))
-        filter_s = filter_f.replace('.zip', '.SAFE')
-        unziped_files = glob.glob(os.path.join(self.unzip_dir, filter_s), recursive=False)
-        if len(unziped_files) > 0:
-            unziped_files = [os.path.basename(safe) for safe in unziped_files]
-        for filepath in input_files:
-            safe = os.path.basename(filepath.replace('.zip', '.SAFE'))
-            if safe not in unziped_files or force:
-                gs.message('Reading <{}>...'.format(filepath))
+        pattern = re.compile(filter_p)
+        jobs = [(filepath, pattern, force) for filepath in input_files]
+        if self.nprocs > 1 and len(jobs) > 1:
+            # decompression releases the GIL, threads are enough
+            pool = ThreadPool(self.nprocs)
+            results = pool.map(self._unzip_file, jobs)
+            pool.close()
+            pool.join()
+        else:
+            results = [self._unzip_file(job) for job in jobs]
+
+        for safe_dir, new_safe, extracted in results:
+            if new_safe and safe_dir not in self._dir_list:
+                self._dir_list.append(safe_dir)
+            if safe_dir in self._safe_index:
+                index = self._safe_index[safe_dir]
+                index.extend(f for f in extracted if f not in index)
+
+    def _unzip_file(self, job):
+        filepath, pattern, force = job
+        safe = os.path.basename(filepath.replace('.zip', '.SAFE'))
+        safe_dir = os.path.join(self.unzip_dir, safe)
+        new_safe = not os.path.exists(safe_dir)
+        extracted = []
+        with ZipFile(filepath) as fd:
+            members = [m for m in fd.namelist()
+                       if pattern.match(os.path.basename(m))]
+            for member in members:
+                target = os.path.join(self.unzip_dir, member)
+                if os.path.exists(target) and not force:
+                    continue
+                if not extracted:
+                    gs.message('Reading <{}>...'.format(filepath))
+                fd.extract(member, path=self.unzip_dir)
+                extracted.append(os.path.normpath(target))
 
-                with ZipFile(filepath) as fd:
-                    fd.extractall(path=self.unzip_dir)
+        return safe_dir, new_safe, extracted
 
-                self._dir_list.append(os.path.join(self.unzip_dir, safe))
+    def _safe_files(self, safe):
+        # list of the files of a SAFE directory, walked only once
+        if safe not in self._safe_index:
+            files = []
+            for rec in os.walk(safe):
+                for f in rec[-1]:
+                    files.append(os.path.normpath(os.path.join(rec[0], f)))
+            self._safe_index[safe] = files
 
+        return self._safe_index[safe]
 
     def _filter(self, filter_p, force_unzip=False):
         # unzip archives before filtering
-        self._unzip(force=force_unzip)
+        self._unzip(filter_p, force=force_unzip)
 
         if options['pattern_file']:
             filter_f = '*' + options['pattern_file'] + '*.SAFE'
@@ -215,20 +272,14 @@ class SentinelImporter(object):
             gs.fatal(_('Nothing found to import. Please check input and pattern_file options.'))
 
         for safe in safes:
-            for rec in os.walk(safe):
-                if not rec[-1]:
-                    continue
-
-                match = filter(pattern.match, rec[-1])
-                if match is None:
-                    continue
-
-                for f in match:
-                    files.append(os.path.join(rec[0], f))
+            for f in self._safe_files(safe):
+                if pattern.match(os.path.basename(f)):
+                    files.append(f)
 
         return files
 
-    def import_products(self, reproject=False, link=False, override=False):
+    def import_products(self, reproject=False, link=False, override=False,
+                        metadata=False):
         args = {}
         if link:
             module = 'r.external'
@@ -249,15 +300,34 @@ class SentinelImporter(object):
                     else:
                         args['flags'] = 'r'
 
-        for f in self.files:
-            if not override and (link or (not link and not reproject)):
-                if not self._check_projection(f):
+        if self.nprocs > 1:
+            pool = Pool(self.nprocs)
+            imap = pool.imap_unordered
+        else:
+            pool = None
+            imap = map
+
+        if not override and (link or (not link and not reproject)):
+            for f, ok in imap(_check_worker, self.files):
+                if not ok:
                     gs.fatal(_('Projection of dataset does not appear to match current location. '
                                'Force reprojecting dataset by -r flag.'))
 
-            self._import_file(f, module, args)
+        if metadata:
+            ip_meta = self._read_metadata()
+        # metadata of each map is written as soon as the map is imported,
+        # while the other files are still being imported
+        jobs = [(f, module, args) for f in self.files]
+        for f, ok in imap(_import_worker, jobs):
+            if ok and metadata:
+                self._write_map_metadata(f, ip_meta)
+
+        if pool:
+            pool.close()
+            pool.join()
 
-    def _check_projection(self, filename):
+    @staticmethod
+    def _check_projection(filename):
         try:
             with open(os.devnull) as null:
                 gs.run_command('r.in.gdal', flags='j',
@@ -267,7 +337,8 @@ class SentinelImporter(object):
 
         return True
 
-    def _raster_resolution(self, filename):
+    @staticmethod
+    def _raster_resolution(filename):
         try:
             from osgeo import gdal
         except ImportError as e:
@@ -280,7 +351,8 @@ class SentinelImporter(object):
 
         return ret
 
-    def _raster_epsg(self, filename):
+    @staticmethod
+    def _raster_epsg(filename):
         try:
             from osgeo import gdal, osr
         except ImportError as e:
@@ -299,11 +371,13 @@ class SentinelImporter(object):
     def _map_name(filename):
         return os.path.splitext(os.path.basename(filename))[0]
 
-    def _import_file(self, filename, module, args):
-        mapname = self._map_name(filename)
+    @staticmethod
+    def _import_file(filename, module, args):
+        mapname = SentinelImporter._map_name(filename)
         gs.message(_('Processing <{}>...').format(mapname))
         if module == 'r.import':
-            args['resolution_value'] = self._raster_resolution(filename)
+            args = dict(args)
+            args['resolution_value'] = SentinelImporter._raster_resolution(filename)
         try:
             gs.run_command(module, input=filename, output=mapname, **args)
             if gs.raster_info(mapname)['datatype'] in ('FCELL', 'DCELL'):
@@ -315,7 +389,9 @@ class SentinelImporter(object):
                 gs.del_temp_region()
             gs.raster_history(mapname)
         except CalledModuleError as e:
-            pass # error already printed
+            return False # error already printed
+
+        return True
 
     def import_cloud_masks(self, override):
         from osgeo import ogr
@@ -429,8 +505,7 @@ class SentinelImporter(object):
     def _ip_from_path(path):
         return os.path.basename(path[:path.find('.SAFE')])
 
-    def write_metadata(self):
-        gs.message(_("Writing metadata to maps..."))
+    def _read_metadata(self):
         ip_meta = {}
         for mtd_file in self._filter("MTD_TL.xml"):
             ip = self._ip_from_path(mtd_file)
@@ -439,51 +514,60 @@ class SentinelImporter(object):
         if not ip_meta:
             gs.warning(_("Unable to determine timestamps. No metadata file found"))
 
-        for img_file in self.files:
-            map_name = self._map_name(img_file)
-            ip = self._ip_from_path(img_file)
-            meta = ip_meta[ip]
-            if meta:
-                bn = map_name.split('_')[2].lstrip('B').rstrip('A')
-                if bn.isnumeric():
-                    bn = int(bn)
-                else:
-                    continue
+        return ip_meta
 
-                timestamp = meta['timestamp']
-                timestamp_str = timestamp.strftime("%-d %b %Y %H:%M:%S.%f")
-                descr_list = []
-                for dkey in meta.keys():
-                    if dkey != 'timestamp':
-                        if 'TH_ANGLE_' in dkey:
-                            if dkey.endswith('TH_ANGLE_{}'.format(bn)):
-                                descr_list.append('{}={}'.format(dkey, meta[dkey]))
-                        else:
+    def write_metadata(self):
+        gs.message(_("Writing metadata to maps..."))
+        ip_meta = self._read_metadata()
+
+        for img_file in self.files:
+            self._write_map_metadata(img_file, ip_meta)
+
+    def _write_map_metadata(self, img_file, ip_meta):
+        map_name = self._map_name(img_file)
+        ip = self._ip_from_path(img_file)
+        meta = ip_meta[ip]
+        if meta:
+            bn = map_name.split('_')[2].lstrip('B').rstrip('A')
+            if bn.isnumeric():
+                bn = int(bn)
+            else:
+                return
+
+            timestamp = meta['timestamp']
+            timestamp_str = timestamp.strftime("%-d %b %Y %H:%M:%S.%f")
+            descr_list = []
+            for dkey in meta.keys():
+                if dkey != 'timestamp':
+                    if 'TH_ANGLE_' in dkey:
+                        if dkey.endswith('TH_ANGLE_{}'.format(bn)):
                             descr_list.append('{}={}'.format(dkey, meta[dkey]))
-                descr = '\n'.join(descr_list)
-                bands = gs.read_command('g.list', type='raster', mapset='.',
-                                        pattern='{}*'.format(map_name)).rstrip('\n').split('\n')
-
-                descr_dict = {dl.split('=')[0]: dl.split('=')[1] for dl in descr_list}
-                env = gs.gisenv()
-                json_standard_folder = os.path.join(env['GISDBASE'], env['LOCATION_NAME'], env['MAPSET'], 'cell_misc')
-                if flags['j'] and not os.path.isdir(json_standard_folder):
-                    os.makedirs(json_standard_folder)
-                for band in bands:
-                    gs.run_command('r.support', map=map_name, source1=ip,
-                                   source2=img_file, history=descr)
-                    gs.run_command('r.timestamp', map=map_name, date=timestamp_str)
-                    if flags['j']:
-                        metadatajson = os.path.join(
-                            json_standard_folder, map_name, "description.json")
-                    elif options['metadata']:
-                        metadatajson = os.path.join(
-                            options['metadata'], map_name, "description.json")
-                    if flags['j'] or options['metadata']:
-                        if not os.path.isdir(os.path.dirname(metadatajson)):
-                            os.makedirs(os.path.dirname(metadatajson))
-                        with open(metadatajson, 'w') as outfile:
-                            json.dump(descr_dict, outfile)
+                    else:
+                        descr_list.append('{}={}'.format(dkey, meta[dkey]))
+            descr = '\n'.join(descr_list)
+            bands = gs.read_command('g.list', type='raster', mapset='.',
+                                    pattern='{}*'.format(map_name)).rstrip('\n').split('\n')
+
+            descr_dict = {dl.split('=')[0]: dl.split('=')[1] for dl in descr_list}
+            env = gs.gisenv()
+            json_standard_folder = os.path.join(env['GISDBASE'], env['LOCATION_NAME'], env['MAPSET'], 'cell_misc')
+            if flags['j'] and not os.path.isdir(json_standard_folder):
+                os.makedirs(json_standard_folder)
+            for band in bands:
+                gs.run_command('r.support', map=map_name, source1=ip,
+                               source2=img_file, history=descr)
+                gs.run_command('r.timestamp', map=map_name, date=timestamp_str)
+                if flags['j']:
+                    metadatajson = os.path.join(
+                        json_standard_folder, map_name, "description.json")
+                elif options['metadata']:
+                    metadatajson = os.path.join(
+                        options['metadata'], map_name, "description.json")
+                if flags['j'] or options['metadata']:
+                    if not os.path.isdir(os.path.dirname(metadatajson)):
+                        os.makedirs(os.path.dirname(metadatajson))
+                    with open(metadatajson, 'w') as outfile:
+                        json.dump(descr_dict, outfile)
 
     def create_register_file(self, filename):
         gs.message(_("Creating register file <{}>...").format(filename))
@@ -528,7 +612,8 @@ class SentinelImporter(object):
                     ))
                 fd.write(os.linesep)
 def main():
-    importer = SentinelImporter(options['input'], options['unzip_dir'])
+    importer = SentinelImporter(options['input'], options['unzip_dir'],
+                                int(options['nprocs']))
 
     importer.filter(options['pattern'])
     if len(importer.files) < 1:
@@ -541,8 +626,9 @@ def main():
         importer.print_products()
         return 0
 
-    importer.import_products(flags['r'], flags['l'], flags['o'])
-    importer.write_metadata()
+    gs.message(_("Importing raster maps and writing metadata..."))
+    importer.import_products(flags['r'], flags['l'], flags['o'],
+                             metadata=True)
 
     if flags['c']:
         # import cloud mask if requested
@@ -149,6 +149,10 @@
 #% key: c
 #% description: Compute only the cloud mask
 #%end
+#%flag
+#% key: p
+#% description: Estimate clouds height on a coarse resolution pyramid level first
+#%end
 
 #%rules
 #% collective: blue,green,red,nir,nir8a,swir11,swir12
@@ -165,7 +169,6 @@ import math
 import os
 import sys
 import shutil
-import subprocess
 import re
 import glob
 import time
@@ -177,6 +180,75 @@ import numpy
 import grass.script as gscript
 
 
+# factor between the resolution of the pyramid level and of the masks
+PYRAMID_FACTOR = 4
+# number of best shifts of the pyramid level checked on the masks
+PYRAMID_CANDIDATES = 3
+
+
+def read_mask(mapname):
+    """Read a raster mask into a boolean array, null cells are False"""
+    from grass.script import array as garray
+
+    mask = garray.array(dtype=numpy.int32)
+    mask.read(mapname, null=0)
+    return numpy.asarray(mask) != 0
+
+
+def downsample_mask(mask, factor):
+    """Return a coarser mask, a cell is set if any of the cells it covers
+    is set"""
+    rows = -(-mask.shape[0] // factor) * factor
+    cols = -(-mask.shape[1] // factor) * factor
+    padded = numpy.zeros((rows, cols), dtype=bool)
+    padded[:mask.shape[0], :mask.shape[1]] = mask
+    return padded.reshape(rows // factor, factor,
+                          cols // factor, factor).any(axis=3).any(axis=1)
+
+
+def overlap_count(cloud, shadow, drow, dcol):
+    """Count the cells of the shadow mask covered by the cloud mask shifted
+    by drow rows and dcol columns"""
+    rows, cols = cloud.shape
+    if abs(drow) >= rows or abs(dcol) >= cols:
+        return 0
+    shifted = cloud[max(0, -drow):rows - max(0, drow),
+                    max(0, -dcol):cols - max(0, dcol)]
+    covered = shadow[max(0, drow):rows - max(0, -drow),
+                     max(0, dcol):cols - max(0, -dcol)]
+    return int(numpy.count_nonzero(shifted & covered))
+
+
+def overlap_areas(cloud, shadow, dE, dN, ewres, nsres, pyramid=False):
+    """Compute the area of the overlap between the shadow mask and the
+    cloud mask shifted by each (dE, dN) shift in map units
+
+    With pyramid, all the shifts are first scored on masks with a coarser
+    resolution and only the best ones are scored on the masks, the others
+    get an area of 0.
+    """
+    def offsets(factor):
+        return [(int(round(-n / (nsres * factor))),
+                 int(round(e / (ewres * factor)))) for e, n in zip(dE, dN)]
+
+    candidates = range(len(dE))
+    if pyramid:
+        coarse = offsets(PYRAMID_FACTOR)
+        cloud_coarse = downsample_mask(cloud, PYRAMID_FACTOR)
+        shadow_coarse = downsample_mask(shadow, PYRAMID_FACTOR)
+        counts = [overlap_count(cloud_coarse, shadow_coarse, drow, dcol)
+                  for drow, dcol in coarse]
+        # stable sort keeps the lowest heights first for equal counts
+        candidates = sorted(sorted(candidates, key=lambda i: -counts[i])
+                            [:PYRAMID_CANDIDATES])
+    fine = offsets(1)
+    areas = [0.0] * len(dE)
+    for i in candidates:
+        drow, dcol = fine[i]
+        areas[i] = overlap_count(cloud, shadow, drow, dcol) * ewres * nsres
+    return areas
+
+
 def main ():
 
 
@@ -196,7 +268,8 @@ def main ():
     tmp["delcat"] = "delcat_" + processid
     tmp["addcat"] = "addcat_" + processid
     tmp["cl_shift"] = "cl_shift_" + processid
-    tmp["overlay"] = "overlay_" + processid
+    tmp["cloud_r"] = "cloud_r_" + processid
+    tmp["shadow_r"] = "shadow_r_" + processid
 
     # Check temporary map names are not existing maps
     for key, value in tmp.items():
@@ -574,7 +647,6 @@ def main ():
                 HH = []
                 dE = []
                 dN = []
-                AA = []
                 while H <= 4000:
                     z_deg_to_rad = math.radians(z)
                     tan_Z = math.tan(z_deg_to_rad)
@@ -590,30 +662,24 @@ def main ():
                     HH.append(H)
                     H = H + dH
 
-                    gscript.run_command('v.transform',
-                        input=cloud_mask,
-                        output=tmp["cl_shift"],
-                        xshift=E_shift,
-                        yshift=N_shift,
-                        overwrite=True,
-                        quiet=True, stderr=subprocess.DEVNULL)
-                    gscript.run_command('v.overlay',
-                        ainput=tmp["addcat"],
-                        binput=tmp["cl_shift"],
-                        operator='and',
-                        output=tmp["overlay"],
-                        overwrite=True,
-                        quiet=True, stderr=subprocess.DEVNULL)
-                    gscript.run_command('v.db.addcolumn',
-                        map=tmp["overlay"],
-                        columns='area double')
-                    area = gscript.read_command('v.to.db',
-                        map=tmp["overlay"],
-                        option='area',
-                        columns='area',
-                        flags='c')
-                    area2 = gscript.parse_key_val(area, sep='|')
-                    AA.append(float(area2['total area']))
+                # Rasterize the cleaned masks once and compute the overlapping
+                # area of every shift from the arrays
+                gscript.run_command('v.to.rast',
+                    input=cloud_mask,
+                    output=tmp["cloud_r"],
+                    use='val',
+                    quiet=True)
+                gscript.run_command('v.to.rast',
+                    input=tmp["addcat"],
+                    output=tmp["shadow_r"],
+                    use='val',
+                    quiet=True)
+                cloud_array = read_mask(tmp["cloud_r"])
+                shadow_array = read_mask(tmp["shadow_r"])
+                region = gscript.region()
+                AA = overlap_areas(cloud_array, shadow_array, dE, dN,
+                                   region['ewres'], region['nsres'],
+                                   flags["p"])
 
                 # Find the maximum overlapping area between clouds and shadows
                 index_maxAA = numpy.argmax(AA)
@@ -9,7 +9,7 @@ COPYRIGHT:    (C) 2015 by Michael Lustenberger and the GRASS Development Team
               for details.
 """
 
-import error, world, ant
+import error, world, ant, colony
 
 #from grass.script import core as grass
 from sys import maxsize
@@ -88,6 +88,9 @@ class Anthill(world.World):
         self.decisionbase = "standard"
         self.evaluationbase = "standard"
         self.numberofpaths = 0
+        ## let an array based colony do the work instead of Ant objects
+        self.vectorized = False
+        self.colony = None
 
     def bear(self):
         """
@@ -110,6 +113,8 @@ class Anthill(world.World):
         """
         Let the agents do their job. The actual main loop in such a world.
         """
+        if self.vectorized:
+            return self.letcolonydance(rounds)
         while rounds > 0:
 #            grass.info(len(self.agents))
             if len(self.agents) <= self.maxants:
@@ -123,6 +128,24 @@ class Anthill(world.World):
             # count down
             rounds -= 1
 
+    def letcolonydance(self, rounds):
+        """
+        Same as letantsdance(), but all the ants of a round are processed
+        at once by an array based colony (see colony.Colony).
+        """
+        if self.colony is None:
+            self.colony = colony.Colony(self)
+        while rounds > 0:
+            if self.colony.getlivingcount() <= self.maxants:
+                # as there is still space on the pg, produce another ant
+                self.colony.bear()
+            # let all the ants take action
+            self.colony.work()
+            # let the pheromone evaporate
+            self.volatilize()
+            # count down
+            rounds -= 1
+
     def getpheromone(self, position):
         """
         Return the pheromone value at a certain position
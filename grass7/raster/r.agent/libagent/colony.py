@@ -0,0 +1,286 @@
+"""
+MODULE:       r.agent.*
+AUTHOR(S):    michael lustenberger inofix.ch
+PURPOSE:      library file for the r.agent.* suite
+COPYRIGHT:    (C) 2015 by Michael Lustenberger and the GRASS Development Team
+
+              This program is free software under the GNU General Public
+              License (>=v2). Read the file COPYING that comes with GRASS
+              for details.
+"""
+
+import numpy
+from math import sqrt, ceil
+
+class Colony(object):
+    """
+    Array based implementation of the ants living in an Anthill.
+
+    Instead of keeping a list of Ant objects, the state of the whole
+    colony (positions, next steps, penalties, time to live, whether the
+    ant is on its way home and the stack of its last steps) is stored in
+    numpy arrays. Every round all the ants are processed at once:
+    neighbour scoring, random draws and pheromone deposits are done for
+    the whole colony by array operations.
+
+    The rules are the same as for the Ant objects (see ant.Ant), with
+    one exception: the object based ants act one after another and may
+    already smell the pheromone laid by the ants that acted before them
+    in the same round, whereas here all the ants of a round see the
+    pheromone of the previous round and their marks are added together.
+    """
+    # neighbour offsets ordered by orientation (see
+    # playground.Playground.getorderedneighbourpositions)
+    OFFSETS = numpy.array([[-1, 0], [1, 0], [0, -1], [0, 1],
+                           [-1, -1], [1, -1], [-1, 1], [1, 1]])
+    STEPCOSTS = numpy.array([0, 0, 0, 0] + [sqrt(2)-1] * 4)
+
+    def __init__(self, world, freedom=8, capacity=64):
+        """
+        Create an empty colony for an Anthill
+        @param Anthill the world the colony lives in
+        @param int number of potentially reachable neighbours (4 or 8)
+        @param int initial number of ants the arrays can hold
+        """
+        self.world = world
+        self.freedom = freedom
+        self.offsets = Colony.OFFSETS[:freedom]
+        self.count = 0
+        # the stack of last steps can not grow longer than an ant lives
+        self.depth = int(ceil(world.antslife)) + 1
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        """
+        (Re)allocate the arrays for a given number of ants, keeping the
+        state of the living ants
+        @param int number of ants the arrays can hold
+        """
+        n = self.count
+        old = getattr(self, "alive", None)
+        def grow(name, shape, dtype, fill=0):
+            array = numpy.full(shape, fill, dtype=dtype)
+            if old is not None:
+                array[:n] = getattr(self, name)[:n]
+            setattr(self, name, array)
+        grow("alive", capacity, bool, False)
+        grow("ttl", capacity, numpy.int64)
+        grow("penalty", capacity, numpy.float64)
+        grow("position", (capacity, 2), numpy.int64)
+        grow("orientation", capacity, numpy.int8, -1)
+        grow("home", (capacity, 2), numpy.int64)
+        grow("nextstep", (capacity, 2), numpy.int64)
+        grow("nextorientation", capacity, numpy.int8, -1)
+        grow("hasnext", capacity, bool, False)
+        grow("homeward", capacity, bool, False)
+        grow("laststeps", (capacity, self.depth, 2), numpy.int64)
+        grow("lastorientations", (capacity, self.depth), numpy.int8, -1)
+        grow("nsteps", capacity, numpy.int64)
+        self.capacity = capacity
+
+    def compact(self):
+        """
+        Forget about the dead ants
+        """
+        keep = numpy.nonzero(self.alive[:self.count])[0]
+        n = len(keep)
+        for name in ("alive", "ttl", "penalty", "position", "orientation",
+                     "home", "nextstep", "nextorientation", "hasnext",
+                     "homeward", "laststeps", "lastorientations", "nsteps"):
+            array = getattr(self, name)
+            array[:n] = array[keep]
+        self.alive[n:self.count] = False
+        self.count = n
+
+    def getlivingcount(self):
+        """
+        Return the number of living ants
+        @return int number of ants
+        """
+        return int(numpy.count_nonzero(self.alive[:self.count]))
+
+    def bear(self):
+        """
+        Set a new ant on a randomly chosen site
+        """
+        if self.count == self.capacity:
+            self.compact()
+            if self.count == self.capacity:
+                self.allocate(2 * self.capacity)
+        i = self.count
+        site = self.world.sites[numpy.random.randint(len(self.world.sites))]
+        self.alive[i] = True
+        self.ttl[i] = int(ceil(self.world.antslife))
+        self.penalty[i] = 0.0
+        self.position[i] = site[:2]
+        self.orientation[i] = -1
+        self.home[i] = site[:2]
+        self.hasnext[i] = False
+        self.homeward[i] = False
+        self.nsteps[i] = 0
+        self.count += 1
+
+    def pop(self, ants):
+        """
+        Take the last steps from the stacks of some ants as their next steps
+        @param ndarray indexes of the ants
+        """
+        top = self.nsteps[ants] - 1
+        self.nextstep[ants] = self.laststeps[ants, top]
+        self.nextorientation[ants] = self.lastorientations[ants, top]
+        self.nsteps[ants] = top
+        self.hasnext[ants] = True
+
+    def addpenalty(self, ants):
+        """
+        Add the penalty of the next step to the penalty of some ants
+        @param ndarray indexes of the ants
+        """
+        cost = self.world.playground.layers[self.world.COST]
+        steps = self.nextstep[ants]
+        stepcost = numpy.where(self.nextorientation[ants] >= 0,
+                        Colony.STEPCOSTS[self.nextorientation[ants]], 0)
+        self.penalty[ants] += stepcost + cost[steps[:, 0], steps[:, 1]]
+
+    def choose(self, ants):
+        """
+        Make the decisions about where to go to next for some ants, see
+        ant.Ant.choose(), ant.Ant.check() and ant.Ant.markedposition()
+        @param ndarray indexes of the ants
+        """
+        world = self.world
+        layers = world.playground.layers
+        region = world.playground.getregion()
+        n = len(ants)
+        k = len(self.offsets)
+        # all the neighbour positions of all the ants: (ants, neighbours, 2)
+        candidates = self.position[ants, numpy.newaxis, :] + \
+                        self.offsets[numpy.newaxis, :, :]
+        valid = (candidates[:, :, 0] >= 0) & \
+                (candidates[:, :, 0] < region["rows"]) & \
+                (candidates[:, :, 1] >= 0) & \
+                (candidates[:, :, 1] < region["cols"])
+        rows = numpy.where(valid, candidates[:, :, 0], 0)
+        cols = numpy.where(valid, candidates[:, :, 1], 0)
+        # random keys replace the shuffling of the positions
+        order = numpy.random.random_sample((n, k))
+        order[~valid] = numpy.inf
+        # the first site in shuffled order decides: home or goal
+        issite = valid & (layers[world.SITE][rows, cols] < 0)
+        first = numpy.argmin(numpy.where(issite, order, numpy.inf), axis=1)
+        hassite = issite[numpy.arange(n), first]
+        firstpos = candidates[numpy.arange(n), first]
+        ishome = hassite & numpy.all(firstpos == self.home[ants], axis=1)
+        isgoal = hassite & ~ishome
+        valid[ishome, first[ishome]] = False
+        # goal found: head back home
+        goal = ants[isgoal]
+        if len(goal) > 0:
+            world.numberofpaths += len(goal)
+            self.homeward[goal] = True
+            # found right next to home: nowhere to walk back
+            nosteps = goal[self.nsteps[goal] == 0]
+            self.alive[nosteps] = False
+            goal = goal[self.nsteps[goal] > 0]
+            self.pop(goal)
+            self.addpenalty(goal)
+        # decide for the others
+        deciding = ~isgoal
+        if world.decisionbase == "costlymarked":
+            penalty = layers[world.COST][rows, cols]
+            valid &= (penalty >= world.minpenalty) & \
+                     (penalty <= world.maxpenalty)
+            score = - penalty * world.costweight
+        else:
+            score = numpy.zeros((n, k))
+        score = score + layers[world.RESULT][rows, cols] * world.pheroweight + \
+                    numpy.random.uniform(world.minrandom, world.maxrandom,
+                                         (n, k)) * world.randomweight
+        score[~valid] = -numpy.inf
+        # the first of the best in shuffled order wins
+        best = score.max(axis=1)
+        order[score < best[:, numpy.newaxis]] = numpy.inf
+        order[~valid] = numpy.inf
+        choice = numpy.argmin(order, axis=1)
+        # die as there is nowwhere to go to
+        nowhere = deciding & ~valid.any(axis=1)
+        self.alive[ants[nowhere]] = False
+        deciding &= ~nowhere
+        chosen = ants[deciding]
+        self.nextstep[chosen] = candidates[deciding, choice[deciding]]
+        self.nextorientation[chosen] = choice[deciding]
+        self.hasnext[chosen] = True
+        self.addpenalty(chosen)
+
+    def deposit(self, positions, intensity):
+        """
+        Mark positions with pheromone, respecting the maximum
+        @param ndarray positions (n, 2)
+        @param numeric intensity to add per visit
+        """
+        layer = self.world.playground.layers[self.world.RESULT]
+        rows, cols = positions[:, 0], positions[:, 1]
+        numpy.add.at(layer, (rows, cols), intensity)
+        layer[rows, cols] = numpy.minimum(layer[rows, cols],
+                                            self.world.maxpheromone)
+
+    def walkaround(self, ants):
+        """
+        Perform a regular step for ants searching around
+        @param ndarray indexes of the ants
+        """
+        self.laststeps[ants, self.nsteps[ants]] = self.position[ants]
+        self.lastorientations[ants, self.nsteps[ants]] = self.orientation[ants]
+        self.nsteps[ants] += 1
+        self.position[ants] = self.nextstep[ants]
+        self.orientation[ants] = self.nextorientation[ants]
+        self.hasnext[ants] = False
+        self.deposit(self.position[ants], self.world.stepintensity)
+
+    def walkhome(self, ants):
+        """
+        Perform a regular step for ants walking back home
+        @param ndarray indexes of the ants
+        """
+        self.position[ants] = self.nextstep[ants]
+        self.orientation[ants] = self.nextorientation[ants]
+        self.hasnext[ants] = False
+        going = ants[self.nsteps[ants] > 1]
+        # retire after work.
+        self.alive[ants[self.nsteps[ants] <= 1]] = False
+        if self.world.antavoidsloops and len(going) > 0:
+            # forget the loop between the first and the last occurence
+            # of the last step
+            top = self.nsteps[going] - 1
+            last = self.laststeps[going, top]
+            lastorientation = self.lastorientations[going, top]
+            same = numpy.all(self.laststeps[going] == last[:, numpy.newaxis, :],
+                             axis=2) & \
+                   (self.lastorientations[going] == \
+                        lastorientation[:, numpy.newaxis])
+            self.nsteps[going] = numpy.argmax(same, axis=1) + 1
+        self.pop(going)
+        self.addpenalty(going)
+        self.deposit(self.position[ants], self.world.pathintensity)
+
+    def work(self):
+        """
+        Let all the ants take action for one round, see ant.Ant.work()
+        """
+        ants = numpy.nonzero(self.alive[:self.count])[0]
+        # we are all only getting older..
+        old = ants[self.ttl[ants] <= 0]
+        self.alive[old] = False
+        ants = ants[self.ttl[ants] > 0]
+        self.ttl[ants] -= 1
+        # decide where to go to if it is not clear yet
+        undecided = ants[~self.hasnext[ants]]
+        if len(undecided) > 0:
+            self.choose(undecided)
+        ants = ants[self.alive[ants]]
+        # if penalty is positive, wait one round
+        waiting = self.penalty[ants] > 0
+        self.penalty[ants[waiting]] -= 1
+        walking = ants[~waiting]
+        self.walkaround(walking[~self.homeward[walking]])
+        self.walkhome(walking[self.homeward[walking]])
@@ -59,6 +59,10 @@ COPYRIGHT:    (C) 2011 by Michael Lustenberger and the GRASS Development Team
 #% key: l
 #% description: Avoid loops on the way back
 #%end
+#%flag
+#% key: v
+#% description: Process all ants of a round at once using arrays (faster for large colonies)
+#%end
 #%option
 #% key: sitesmap
 #% type: string
@@ -333,6 +337,8 @@ def main():
 
         if flags['s']:
             world.antavoidsloops = True
+        if flags['v']:
+            world.vectorized = True
         if options['lowcostlimit']:
             world.minpenalty = int(options['lowcostlimit'])
         if options['highcostlimit']:
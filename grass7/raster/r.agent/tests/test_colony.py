@@ -0,0 +1,63 @@
+import unittest2 as unittest
+#import unittest
+
+import numpy
+from libagent import playground, anthill, colony
+
+class TestColony(unittest.TestCase):
+    def setUp(self):
+        self.pg = playground.Playground()
+        self.pg.setregion(5,5)
+        self.world = anthill.Anthill(self.pg)
+        self.world.sites = [[2,2]]
+        self.world.playground.layers[anthill.Anthill.SITE][2][2] = -1
+        self.colony = colony.Colony(self.world, freedom=4, capacity=2)
+
+    def test_bear(self):
+        self.colony.bear()
+        self.assertEqual(1, self.colony.getlivingcount())
+        self.assertEqual([2,2], list(self.colony.position[0]))
+        self.assertEqual([2,2], list(self.colony.home[0]))
+
+    def test_allocate(self):
+        for i in range(3):
+            self.colony.bear()
+        self.assertEqual(3, self.colony.getlivingcount())
+        self.assertTrue(self.colony.capacity >= 3)
+        self.assertEqual([2,2], list(self.colony.position[2]))
+
+    def test_work(self):
+        self.colony.bear()
+        self.colony.work()
+        # not at home anymore and the new position is marked
+        self.assertNotEqual([2,2], list(self.colony.position[0]))
+        self.assertEqual(1, self.colony.nsteps[0])
+        position = self.colony.position[0]
+        self.assertEqual(self.world.stepintensity,
+                                self.world.getpheromone(position))
+
+    def test_goal(self):
+        self.world.playground.layers[anthill.Anthill.SITE][0][0] = -1
+        self.colony.bear()
+        self.colony.position[0] = [0,1]
+        self.colony.laststeps[0, 0] = [1,1]
+        self.colony.laststeps[0, 1] = [0,1]
+        self.colony.nsteps[0] = 2
+        self.colony.choose(numpy.array([0]))
+        self.assertEqual(1, self.world.numberofpaths)
+        self.assertTrue(self.colony.homeward[0])
+        self.assertEqual([0,1], list(self.colony.nextstep[0]))
+        self.assertEqual(1, self.colony.nsteps[0])
+
+    def test_ttl(self):
+        self.world.antslife = 1
+        self.colony = colony.Colony(self.world, freedom=4)
+        self.colony.bear()
+        self.colony.work()
+        self.colony.work()
+        self.assertEqual(0, self.colony.getlivingcount())
+
+    def test_letcolonydance(self):
+        self.world.vectorized = True
+        self.world.letantsdance(10)
+        self.assertTrue(self.world.colony.count > 0)
@@ -152,6 +152,15 @@ Todo:
 #% answer : 300
 #%end
 
+#%option
+#% key: cores
+#% type: integer
+#% description: Number of patches processed in parallel
+#% required : no
+#% guisection: Settings
+#% answer : 1
+#%end
+
 #%option G_OPT_M_DIR
 #% key: conefor_dir
 #% description: Directory for additional output in Conefor format
@@ -222,9 +231,10 @@ import sys
 import string
 import random
 import subprocess
-from io import StringIO
+from multiprocessing import Pool
 import numpy as np
 import grass.script as grass
+from grass.exceptions import CalledModuleError
 from grass.pygrass.vector import VectorTopo
 from grass.pygrass.vector.basic import Bbox
 from grass.pygrass.raster.history import History
@@ -255,6 +265,196 @@ def cleanup():
                           pattern='{}*'.format(TMP_PREFIX), quiet=True,
                           flags='f')
 
+def read_binary(raster, shape, env, dtype):
+    """Read a raster map in the region of env as binary array
+
+    NULL cells are 0 in integer and -1 in floating point arrays
+    """
+    filename = grass.tempfile()
+    if np.issubdtype(dtype, np.integer):
+        grass.run_command('r.out.bin', flags='i', input=raster,
+                          output=filename, bytes=np.dtype(dtype).itemsize,
+                          null=0, quiet=True, env=env)
+    else:
+        grass.run_command('r.out.bin', flags='f', input=raster,
+                          output=filename, bytes=np.dtype(dtype).itemsize,
+                          null=-1, quiet=True, env=env)
+    array = np.fromfile(filename, dtype=dtype).reshape(shape)
+    os.remove(filename)
+    return array
+
+
+def patch_extents(boundary_map, region, cutoff):
+    """Get the region cropped to the cutoff distance around every patch
+
+    Extents are derived from the rasterized patch boundaries, aligned
+    to and clipped by the current region. Returns the extent and the
+    number of rows and columns of the cropped region per patch.
+    """
+    shape = (int(region['rows']), int(region['cols']))
+    env = os.environ.copy()
+    boundary = read_binary(boundary_map, shape, env, np.int32).ravel()
+    cells = np.flatnonzero(boundary)
+    cats = boundary[cells]
+    order = np.argsort(cats, kind='mergesort')
+    cells = cells[order]
+    cats = cats[order]
+    rows, cols = np.divmod(cells, shape[1])
+    patch_cats, starts = np.unique(cats, return_index=True)
+
+    nsres = float(region['nsres'])
+    ewres = float(region['ewres'])
+    north = float(region['n'])
+    west = float(region['w'])
+    grow_rows = int(np.ceil(cutoff / nsres))
+    grow_cols = int(np.ceil(cutoff / ewres))
+    extents = {}
+    if len(cells) == 0:
+        return extents
+    min_rows = np.minimum.reduceat(rows, starts) - grow_rows
+    max_rows = np.maximum.reduceat(rows, starts) + grow_rows + 1
+    min_cols = np.minimum.reduceat(cols, starts) - grow_cols
+    max_cols = np.maximum.reduceat(cols, starts) + grow_cols + 1
+    min_rows = np.maximum(min_rows, 0)
+    max_rows = np.minimum(max_rows, shape[0])
+    min_cols = np.maximum(min_cols, 0)
+    max_cols = np.minimum(max_cols, shape[1])
+    for i, cat in enumerate(patch_cats):
+        extent = {'n': north - min_rows[i] * nsres,
+                  's': north - max_rows[i] * nsres,
+                  'w': west + min_cols[i] * ewres,
+                  'e': west + max_cols[i] * ewres}
+        extents[int(cat)] = (extent, (int(max_rows[i] - min_rows[i]),
+                                      int(max_cols[i] - min_cols[i])))
+
+    return extents
+
+
+def patch_distances(args):
+    """Compute cost distances from one patch to its neighbours
+
+    Runs in a worker process with GRASS_REGION cropped to the cutoff
+    distance around the patch. Distances at the neighbour boundaries are
+    read as binary arrays, sorted per neighbour and returned as tuples
+    of (to_cat, x, y, min_dist, dist, max_dist), where x and y are the
+    closest cell on the neighbour boundary. Returns None instead of the
+    connections if a module failed.
+
+    If shortest paths are requested, they are drained into vector maps
+    without attribute table and returned together with the vector map
+    of their start points and the connections they belong to. The
+    attributes are written by the main process, so that the workers do
+    not access the database at the same time.
+    """
+    cat, extent, shape, settings = args
+    env = os.environ.copy()
+    env['GRASS_REGION'] = grass.region_env(nsres=settings['nsres'],
+                                           ewres=settings['ewres'],
+                                           **extent)
+
+    start_patch = '{}_patch_{}'.format(TMP_PREFIX, cat)
+    start_buffer = '{}_patch_{}_buffer'.format(TMP_PREFIX, cat)
+    start_costs = '{}_patch_{}_costs'.format(TMP_PREFIX, cat)
+    cost_distance_map = '{}_patch_{}_cost_dist'.format(settings['prefix'],
+                                                       cat)
+    paths = []
+    try:
+        # Prepare start patch and search radius around it
+        grass.run_command('r.mapcalc', quiet=True, overwrite=True, env=env,
+                          expression='{} = if({} == {}, 1, null())'.format(
+                              start_patch, settings['boundary'], cat))
+        grass.run_command('r.buffer', quiet=True, overwrite=True, env=env,
+                          input=start_patch, output=start_buffer,
+                          distances=settings['cutoff'])
+        # Restrict the costs to the search radius (instead of a MASK,
+        # which would be shared by all processes in the mapset)
+        grass.run_command('r.mapcalc', quiet=True, overwrite=True, env=env,
+                          expression='{} = if(isnull({}), null(), {})'.format(
+                              start_costs, start_buffer, settings['costs']))
+
+        # Calculate cost distance
+        grass.run_command('r.cost', flags=settings['dist_flags'],
+                          quiet=True, overwrite=True, env=env,
+                          input=start_costs,
+                          output=cost_distance_map,
+                          start_rast=start_patch,
+                          memory=settings['memory'])
+
+        cdhist = History(cost_distance_map)
+        cdhist.clear()
+        cdhist.creator = os.environ['USER']
+        cdhist.write()
+        # History object cannot modify description
+        grass.run_command('r.support', env=env,
+                          map=cost_distance_map,
+                          description='Generated by r.connectivity.distance',
+                          history=os.environ['CMDLINE'])
+
+        # Cost distance at the boundaries of neighbours within the cutoff
+        neighbours = read_binary(settings['boundary'], shape, env, np.int32)
+        within = read_binary(start_buffer, shape, env, np.int32)
+        dist = read_binary(cost_distance_map, shape, env, np.float64)
+        rows, cols = np.nonzero((neighbours > 0) & (neighbours != cat) &
+                                (within > 0) & (dist >= 0))
+        to_cats = neighbours[rows, cols]
+        dists = dist[rows, cols]
+        order = np.lexsort((dists, to_cats))
+        rows, cols, to_cats, dists = (rows[order], cols[order],
+                                      to_cats[order], dists[order])
+        unique_cats, starts, counts = np.unique(to_cats, return_index=True,
+                                                return_counts=True)
+        north = float(extent['n'])
+        west = float(extent['w'])
+        nsres = float(settings['nsres'])
+        ewres = float(settings['ewres'])
+        connections = []
+        for to_cat, start, count in zip(unique_cats, starts, counts):
+            pixel = settings['border_dist'] if count > settings['border_dist'] else count - 1
+            connections.append((int(to_cat),
+                                west + (cols[start] + 0.5) * ewres,
+                                north - (rows[start] + 0.5) * nsres,
+                                float(dists[start]),
+                                float(dists[start + pixel]),
+                                float(dists[start + count - 1])))
+
+        # Save closest points and shortest paths through cost raster as
+        # vector maps (r.drain limited to 1024 points) if requested
+        if settings['p_flag'] and connections:
+            for tile_n in range(0, len(connections), 1024):
+                start_points = '{}_{}_{}_cp'.format(TMP_PREFIX, cat, tile_n)
+                cost_paths = '{}_{}_{}_cost_paths'.format(TMP_PREFIX, cat,
+                                                          tile_n)
+                tile = connections[tile_n:tile_n + 1024]
+                sp = grass.feed_command('v.in.ascii', flags='nt',
+                                        overwrite=True, quiet=True, env=env,
+                                        input='-', stderr=subprocess.PIPE,
+                                        output=start_points,
+                                        separator=",")
+                sp.stdin.write(grass.encode("\n".join(
+                    '{1},{2}'.format(*connection) for connection in tile)))
+                sp.stdin.close()
+                sp.wait()
+
+                grass.run_command('r.drain', overwrite=True, quiet=True,
+                                  env=env,
+                                  input=cost_distance_map,
+                                  output=cost_paths,
+                                  drain=cost_paths,
+                                  start_points=start_points)
+                paths.append((cost_paths, start_points, tile))
+    except CalledModuleError:
+        return cat, None, paths
+
+    # Remove temporary map data for patch
+    grass.run_command('g.remove', quiet=True, flags='f', type='raster',
+                      name=[start_patch, start_buffer, start_costs], env=env)
+    if settings['r_flag']:
+        grass.run_command('g.remove', flags='f', type='raster',
+                          name=cost_distance_map, quiet=True, env=env)
+
+    return cat, connections, paths
+
+
 def main():
     """Do the main processing
     """
@@ -270,6 +470,7 @@ def main():
     border_dist = int(options['border_dist'])
     conefor_dir = options['conefor_dir']
     memory = int(options['memory'])
+    cores = int(options['cores'])
 
     # Parse output options:
     prefix = options['prefix']
@@ -291,9 +492,6 @@ def main():
     if not os.path.exists(folder):
         os.makedirs(folder)
 
-    # Setup counter for progress message
-    counter = 0
-
     # Check if location is lat/lon (only in lat/lon geodesic distance
     # measuring is supported)
     if grass.locn_is_latlong():
@@ -445,10 +643,10 @@ def main():
     {p}_patches_pol[0,-1]!={p}_patches_pol)), \
     {p}_patches_pol,null()), null())'.format(p=TMP_PREFIX), quiet=True)
 
-    rasterized_cats = grass.read_command('r.category', separator='newline',
-                                         map='{p}_patches_boundary'.format(p=TMP_PREFIX)
-                                         ).replace('\t','').strip('\n')
-    rasterized_cats = list(map(int, set([x for x in rasterized_cats.split('\n')  if x != ''])))
+    # Get the search region of every rasterized patch
+    boundary_map = '{p}_patches_boundary'.format(p=TMP_PREFIX)
+    extents = patch_extents(boundary_map, start_reg, cutoff)
+    rasterized_cats = set(extents.keys())
 
     #Init output vector maps if they are requested by user
     network = VectorTopo(edge_map)
@@ -487,7 +685,6 @@ def main():
     vpatches = VectorTopo(patches, mapset=patches_mapset)
     vpatches.open('r', layer=int(layer))
 
-    ###Loop through patches
     vpatch_ids = np.array(vpatches.features_to_wkb_list(feature_type="centroid",
                                                         bbox=start_region_bbox),
                           dtype=[('vid', 'uint32'),
@@ -500,207 +697,109 @@ def main():
                       Using average coordinates of the centroids for \
                       visual representation of the patch.')
 
-    for cat in cats:
+    # Get centroid coordinates of all patches
+    centroids = {}
+    for vid, cat in zip(vpatch_ids['vid'], vpatch_ids['cat']):
+        centroid = Centroid(v_id=int(vid), c_mapinfo=vpatches.c_mapinfo)
+        if centroid:
+            centroids.setdefault(int(cat), []).append((centroid.x,
+                                                       centroid.y))
+    vertex_coords = dict((cat, np.average(coords, axis=0))
+                         for cat, coords in centroids.items())
+    vpatches.close()
+
+    # Get population proxy of all patches
+    proxy_vals = grass.vector_db_select(patch_map, layer=int(layer),
+                                        columns=pop_proxy)['values']
+
+    jobs = []
+    settings = {'boundary': boundary_map,
+                'costs': costs,
+                'prefix': prefix,
+                'cutoff': cutoff,
+                'border_dist': border_dist,
+                'memory': memory,
+                'dist_flags': dist_flags,
+                'nsres': start_reg['nsres'],
+                'ewres': start_reg['ewres'],
+                'p_flag': p_flag,
+                'r_flag': r_flag}
+    for cat in sorted(cats):
         if cat not in rasterized_cats:
             grass.warning('Patch {} has not been rasterized and will \
                           therefore not be treated as part of the \
                           network. Consider using t-flag or change \
                           resolution.'.format(cat))
-
             continue
-        grass.verbose("Calculating connectivity-distances for patch \
-                      number {}".format(cat))
-
-        # Filter
-        from_vpatch = vpatch_ids[vpatch_ids['cat'] == cat]
-
-        # Get patch ID
-        if from_vpatch['vid'].size == 1:
-            from_centroid = Centroid(v_id=int(from_vpatch['vid']),
-                                     c_mapinfo=vpatches.c_mapinfo)
-            from_x = from_centroid.x
-            from_y = from_centroid.y
-
-            # Get centroid
-            if not from_centroid:
-                continue
-        else:
-            xcoords = []
-            ycoords = []
-            for f_p in from_vpatch['vid']:
-                from_centroid = Centroid(v_id=int(f_p),
-                                         c_mapinfo=vpatches.c_mapinfo)
-                xcoords.append(from_centroid.x)
-                ycoords.append(from_centroid.y)
-
-                # Get centroid
-                if not from_centroid:
-                    continue
-            from_x = np.average(xcoords)
-            from_y = np.average(ycoords)
-
-        # Get BoundingBox
-        from_bbox = grass.parse_command('v.db.select', map=patch_map,
-                                        flags='r',
-                                        where='cat={}'.format(cat))
-
-        attr_filter = vpatches.table.filters.select(pop_proxy)
-        attr_filter = attr_filter.where("cat={}".format(cat))
-        proxy_val = vpatches.table.execute().fetchone()
-
-        # Prepare start patch
-        start_patch = '{}_patch_{}'.format(TMP_PREFIX, cat)
-        reclass_rule = u'{} = 1\n* = NULL'.format(cat)
-        recl = grass.feed_command('r.reclass', quiet=True,
-                                  input='{}_patches_boundary'.format(TMP_PREFIX),
-                                  output=start_patch,
-                                  rules='-')
-        recl.stdin.write(reclass_rule)
-        recl.stdin.close()
-        recl.wait()
-
-        # Check if patch was rasterised (patches smaller raster resolution and close to larger patches may not be rasterised)
-        #start_check = grass.parse_command('r.info', flags='r', map=start_patch)
-        #start_check = grass.parse_command('r.univar', flags='g', map=start_patch)
-        #print(start_check)
-        """if start_check['min'] != '1':
-            grass.warning('Patch {} has not been rasterized and will \
-                          therefore not be treated as part of the \
-                          network. Consider using t-flag or change \
-                          resolution.'.format(cat))
-
-            grass.run_command('g.remove', flags='f', vector=start_patch,
-                              raster=start_patch, quiet=True)
-            grass.del_temp_region()
-            continue"""
-
-        # Prepare stop patches
-        ############################################
-        reg = grass.parse_command('g.region', flags='ug', quiet=True,
-                                  raster=start_patch,
-                                  n=float(from_bbox['n']) + float(cutoff),
-                                  s=float(from_bbox['s']) - float(cutoff),
-                                  e=float(from_bbox['e']) + float(cutoff),
-                                  w=float(from_bbox['w']) - float(cutoff),
-                                  align='{}_patches_pol'.format(TMP_PREFIX))
-
-        north = reg['n'] if max_n > reg['n'] else max_n
-        south = reg['s'] if min_s < reg['s'] else min_s
-        east = reg['e'] if max_e < reg['e'] else max_e
-        west = reg['w'] if min_w > reg['w'] else min_w
-
-        # Set region to patch search radius
-        grass.use_temp_region()
-        grass.run_command('g.region', quiet=True,
-                          n=north, s=south, e=east, w=west,
-                          align='{}_patches_pol'.format(TMP_PREFIX))
-
-        # Create buffer around start-patch as a mask
-        # for cost distance analysis
-        grass.run_command('r.buffer', quiet=True,
-                          input=start_patch,
-                          output='MASK', distances=cutoff)
-        grass.run_command('r.mapcalc', quiet=True,
-                          expression='{pf}_patch_{p}_neighbours_contur=\
-                                     if({pf}_patches_boundary=={p},\
-                                     null(),\
-                                     {pf}_patches_boundary)'.format(pf=TMP_PREFIX, p=cat))
-        grass.run_command('r.mask', flags='r', quiet=True)
-
-        # Calculate cost distance
-        cost_distance_map = '{}_patch_{}_cost_dist'.format(prefix, cat)
-        grass.run_command('r.cost', flags=dist_flags, quiet=True,
-                          overwrite=True, input=costs,
-                          output=cost_distance_map,
-                          start_rast=start_patch, memory=memory)
-
-        #grass.run_command('g.region', flags='up')
-        # grass.raster.raster_history(cost_distance_map)
-        cdhist = History(cost_distance_map)
-        cdhist.clear()
-        cdhist.creator = os.environ['USER']
-        cdhist.write()
-        # History object cannot modify description
-        grass.run_command('r.support',
-                          map=cost_distance_map,
-                          description='Generated by r.connectivity.distance',
-                          history=os.environ['CMDLINE'])
-
-
-        # Export distance at boundaries
-        maps = '{0}_patch_{1}_neighbours_contur,{2}_patch_{1}_cost_dist'
-        maps = maps.format(TMP_PREFIX, cat, prefix),
-
-        connections = StringIO(unicode(grass.read_command('r.stats',
-                                                          flags='1ng',
-                                                          quiet=True,
-                                                          input=maps,
-                                                          separator=';').rstrip('\n')))
-        try:
-            con_array = np.genfromtxt(connections, delimiter=';',
-                                      dtype=None,
-                                      names=['x', 'y', 'cat', 'dist'])
-        except:
+        if int(cat) not in vertex_coords:
+            continue
+        extent, shape = extents[int(cat)]
+        jobs.append((int(cat), extent, shape, settings))
+
+    # Compute cost distances for all patches in parallel
+    connections = {}
+    pool = Pool(cores)
+    for counter, (cat, patch_connections, paths) in enumerate(
+            pool.imap_unordered(patch_distances, jobs)):
+        if patch_connections is None:
+            pool.terminate()
+            grass.fatal('Calculating connectivity-distances for patch \
+                        number {} failed'.format(cat))
+        if not patch_connections:
             grass.warning('No connections for patch {}'.format(cat))
-
-            # Write centroid to vertex map
-            vertex.write(Point(from_x, from_y),
-                         cat=int(cat),
-                         attrs=proxy_val)
-            vertex.table.conn.commit()
-
-            # Remove temporary map data
+        connections[cat] = patch_connections
+
+        # Add the attributes of the shortest paths and append them
+        for cost_paths, start_points, tile in paths:
+            grass.run_command('v.db.addtable',
+                              map=cost_paths,
+                              quiet=True,
+                              columns="cat integer,\
+                               from_p integer,\
+                               to_p integer,\
+                               dist_min double precision,\
+                               dist double precision,\
+                               dist_max double precision")
+            # Category of the closest start point (1 for the first
+            # connection of the tile)
+            grass.run_command('v.distance', quiet=True,
+                              from_=cost_paths,
+                              to=start_points,
+                              upload='cat',
+                              column='to_p')
+            cases = dict((column, ' '.join('WHEN {} THEN {}'.format(
+                point + 1, connection[index])
+                for point, connection in enumerate(tile)))
+                for column, index in (('to_p', 0), ('dist_min', 3),
+                                      ('dist', 4), ('dist_max', 5)))
+            grass.write_command('db.execute', input='-', stdin='UPDATE {t} \
+                                SET from_p = {cat}, \
+                                dist_min = CASE to_p {dist_min} END, \
+                                dist = CASE to_p {dist} END, \
+                                dist_max = CASE to_p {dist_max} END, \
+                                to_p = CASE to_p {to_p} END'.format(
+                                    t=cost_paths, cat=cat, **cases))
+            grass.run_command('v.patch', flags='ae', overwrite=True,
+                              quiet=True,
+                              input=cost_paths,
+                              output=shortest_paths)
             grass.run_command('g.remove', quiet=True, flags='f',
                               type=['raster', 'vector'],
-                              pattern="{}*{}*".format(TMP_PREFIX, cat))
-            grass.del_temp_region()
-            continue
+                              name=[cost_paths, start_points])
 
-        #Find closest points on neigbour patches
-        to_cats = set(np.atleast_1d(con_array['cat']))
-        to_coords = []
-        for to_cat in to_cats:
-            connection = con_array[con_array['cat'] == to_cat]
-            connection.sort(order=['dist'])
-            pixel = border_dist if len(connection) > border_dist else len(connection) - 1
-            # closest_points_x = connection['x'][pixel]
-            # closest_points_y = connection['y'][pixel]
-            closest_points_to_cat = to_cat
-            closest_points_min_dist = connection['dist'][0]
-            closest_points_dist = connection['dist'][pixel]
-            closest_points_max_dist = connection['dist'][-1]
-            to_patch_ids = vpatch_ids[vpatch_ids['cat'] == int(to_cat)]['vid']
-
-            if len(to_patch_ids) == 1:
-                to_centroid = Centroid(v_id=to_patch_ids,
-                                       c_mapinfo=vpatches.c_mapinfo)
-                to_x = to_centroid.x
-                to_y = to_centroid.y
-            elif len(to_patch_ids) >= 1:
-                xcoords = []
-                ycoords = []
-                for t_p in to_patch_ids:
-                    to_centroid = Centroid(v_id=int(t_p),
-                                             c_mapinfo=vpatches.c_mapinfo)
-                    xcoords.append(to_centroid.x)
-                    ycoords.append(to_centroid.y)
-
-                    # Get centroid
-                    if not to_centroid:
-                        continue
-                to_x = np.average(xcoords)
-                to_y = np.average(ycoords)
-
-            to_coords.append('{},{},{},{},{},{}'.format(connection['x'][0],
-                                                  connection['y'][0],
-                                                  to_cat,
-                                                  closest_points_min_dist,
-                                                  closest_points_dist,
-                                                  closest_points_max_dist
-                                                  ))
-
-            #Save edges to network dataset
-            if closest_points_dist <= 0:
+        # Print progress message
+        grass.percent(counter + 1, len(jobs), 3)
+    pool.close()
+    pool.join()
+
+    # Write vertices and edges of the network at once
+    for cat in sorted(connections):
+        from_x, from_y = vertex_coords[cat]
+        for to_cat, x, y, min_dist, dist, max_dist in connections[cat]:
+            if to_cat not in vertex_coords:
+                continue
+            to_x, to_y = vertex_coords[to_cat]
+            if dist <= 0:
                 zero_dist = 1
 
             # Write data to network
@@ -708,113 +807,17 @@ def main():
                                 (to_x, to_y)]),
                           cat=lin_cat,
                           attrs=(cat,
-                                 int(closest_points_to_cat),
-                                 closest_points_min_dist,
-                                 closest_points_dist,
-                                 closest_points_max_dist,))
-            network.table.conn.commit()
-
+                                 to_cat,
+                                 min_dist,
+                                 dist,
+                                 max_dist,))
             lin_cat = lin_cat + 1
 
-        # Save closest points and shortest paths through cost raster as
-        # vector map (r.drain limited to 1024 points) if requested
-        if p_flag:
-            grass.verbose('Extracting shortest paths for patch number \
-                          {}...'.format(cat))
-
-            points_n = len(to_cats)
-
-            tiles = int(points_n / 1024.0)
-            rest = points_n % 1024
-            if not rest == 0:
-                tiles = tiles + 1
-
-            tile_n = 0
-            while tile_n < tiles:
-                tile_n = tile_n + 1
-                #Import closest points for start-patch in 1000er blocks
-                sp = grass.feed_command('v.in.ascii', flags='nr',
-                                  overwrite=True, quiet=True,
-                                  input='-', stderr=subprocess.PIPE,
-                                  output="{}_{}_cp".format(TMP_PREFIX,
-                                                           cat),
-                                  separator=",",
-                                  columns="x double precision,\
-                                           y double precision,\
-                                           to_p integer,\
-                                           dist_min double precision,\
-                                           dist double precision,\
-                                           dist_max double precision")
-                sp.stdin.write("\n".join(to_coords))
-                sp.stdin.close()
-                sp.wait()
-
-                # Extract shortest paths for start-patch in chunks of
-                # 1024 points
-                cost_paths = "{}_{}_cost_paths".format(TMP_PREFIX, cat)
-                start_points = "{}_{}_cp".format(TMP_PREFIX, cat)
-                grass.run_command('r.drain', overwrite=True, quiet=True,
-                                  input=cost_distance_map,
-                                  output=cost_paths,
-                                  drain=cost_paths,
-                                  start_points=start_points)
-
-                grass.run_command('v.db.addtable',
-                                  map=cost_paths,
-                                  quiet=True,
-                                  columns="cat integer,\
-                                   from_p integer,\
-                                   to_p integer,\
-                                   dist_min double precision,\
-                                   dist double precision,\
-                                   dist_max double precision")
-                grass.run_command('v.db.update', map=cost_paths,
-                                  column='from_p', value=cat,
-                                  quiet=True)
-                grass.run_command('v.distance', quiet=True,
-                                  from_=cost_paths,
-                                  to=start_points,
-                                  upload='to_attr',
-                                  column='to_p',
-                                  to_column='to_p')
-                grass.run_command('v.db.join', quiet=True,
-                                  map=cost_paths,
-                                  column='to_p', other_column='to_p',
-                                  other_table=start_points,
-                                  subset_columns='dist_min,dist,dist_max')
-
-                #grass.run_command('v.info', flags='c',
-                #                  map=cost_paths)
-                grass.run_command('v.patch', flags='ae', overwrite=True,
-                                  quiet=True,
-                                  input=cost_paths,
-                                  output=shortest_paths)
-
-                # Remove temporary map data
-                grass.run_command('g.remove', quiet=True, flags='f',
-                                  type=['raster', 'vector'],
-                                  pattern="{}*{}*".format(TMP_PREFIX,
-                                                          cat))
-
-        # Remove temporary map data for patch
-        if r_flag:
-            grass.run_command('g.remove', flags='f', type='raster',
-                              name=cost_distance_map,
-                              quiet=True)
-
         vertex.write(Point(from_x, from_y),
-                     cat=int(cat),
-                     attrs=proxy_val)
-
-        vertex.table.conn.commit()
-
-        # Print progress message
-        grass.percent(i=int((float(counter) / n_cats) * 100),
-                      n=100,
-                      s=3)
-
-        # Update counter for progress message
-        counter = counter + 1
+                     cat=cat,
+                     attrs=(float(proxy_vals[cat][0]),))
+    network.table.conn.commit()
+    vertex.table.conn.commit()
 
     if zero_dist:
         grass.warning('Some patches are directly adjacent to others. \
@@ -5,7 +5,8 @@
 MODULE:       r.connectivity.network
 AUTHOR(S):    Stefan Blumentrath <stefan dot blumentrath at nina dot no>
 PURPOSE:      Compute connectivity measures for a set of habitat patches
-              based on graph-theory (usig the igraph-package in R).
+              based on graph-theory (with SciPy or the igraph-package
+              in R).
 
               Recently, graph-theory has been characterised as an
               efficient and useful tool for conservation planning
@@ -17,7 +18,7 @@ PURPOSE:      Compute connectivity measures for a set of habitat patches
 
               r.connectivity.network is the 2nd tool of the
               r.connectivity.* toolchain and performs the (core) network
-              analysis (usig the igraph-package in R) on the network
+              analysis (with SciPy or the igraph-package in R) on the network
               data prepared with r.connectivity.distance. This network
               data is analysed on graph, edge and vertex level.
 
@@ -65,12 +66,12 @@ COPYRIGHT:    (C) 2011, 2018 by the Norwegian Institute for Nature
 
 ########################################################################
 REQUIREMENTS:
-R with packages igraph (version 1.0) and nlme (for parallel processing
+NumPy and SciPy for backend=python (default)
+For backend=R: R with packages igraph (version 1.0) and nlme (for parallel processing
 doMC, multicore, iterators, codetools and foreach are required as well),
 ghostscript is required for postscript-output
 
 ToDo:
-- replace R with Python
 - add RGB columns instead of QML
 - Fix history assignment
 - - grass.parse_command('v.support', map=edges, flags='g')[comments]
@@ -196,6 +197,16 @@ ToDo:
 #% answer: 1
 #%end
 
+#%option
+#% key: backend
+#% type: string
+#% description: Library used for the network analysis
+#% options: python,R
+#% descriptions: python;In-process analysis with NumPy and SciPy;R;Analysis with the igraph package in R (through rpy2)
+#% required: no
+#% answer: python
+#%end
+
 #%flag
 #% key: i
 #% description: Install required R packages in an interactive session if they are missing
@@ -211,6 +222,8 @@ import os
 import sys
 import platform
 import warnings
+from datetime import datetime, timedelta
+from multiprocessing import Pool
 import numpy as np
 import matplotlib
 # Required for Windows
@@ -220,11 +233,21 @@ import grass.script as grass
 import grass.script.task as task
 import grass.script.db as grass_db
 
+try:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import (connected_components, dijkstra,
+                                      minimum_spanning_tree, shortest_path)
+except ImportError:
+    csr_matrix = None
+
 
 # check if GRASS is running or not
 if "GISBASE" not in os.environ:
     sys.exit("You must be in GRASS GIS to run this program")
 
+# (Sub)graphs shared with the worker processes
+graphs = {}
+
 def cleanup():
     """tmp_maps = grass.read_command("g.list",
                                   type=['vector', 'raster'],
@@ -250,34 +273,929 @@ def is_number(string):
     return True
 
 
+def invert_weights(values):
+    """Invert flow weights into the range igraph accepts as edge weights
+
+    Large flows become short distances for shortest paths, betweenness
+    and minimum spanning trees (see the R backend)
+    """
+    values = np.asarray(values, dtype=float)
+    if not len(values):
+        return values
+    lower = max(values.min(), 0.000000000001)
+    upper = min(values.max(), 10000000000000000)
+    span = values.max() - values.min()
+    if span == 0:
+        return np.full(values.shape, lower)
+    return (values.max() - values) * (upper - lower) / span + lower
+
+
+def read_columns(vector_map, columns):
+    """Read numeric attribute columns of a vector map into arrays"""
+    table = grass.read_command('v.db.select', map=vector_map, flags='c',
+                               columns=','.join(columns), separator=',',
+                               null_value='nan')
+    values = np.array([line.split(',') for line in table.splitlines()
+                       if line], dtype=float)
+    return values.reshape(-1, len(columns)).T
+
+
+def adjacency(n_vertices, heads, tails, weights=None):
+    """Build the symmetric sparse matrix of an undirected graph"""
+    if weights is None:
+        weights = np.ones(len(heads))
+    return csr_matrix((np.concatenate((weights, weights)),
+                       (np.concatenate((heads, tails)),
+                        np.concatenate((tails, heads)))),
+                      shape=(n_vertices, n_vertices))
+
+
+def expand(index, values, size):
+    """Spread the values of a subgraph over all edges or vertices,
+    masking those which are not part of it"""
+    expanded = np.ma.masked_all(size, dtype=np.asarray(values).dtype)
+    expanded[index] = values
+    return expanded
+
+
+def diameter(distances):
+    """Length of the longest finite geodesic"""
+    finite = distances[np.isfinite(distances)]
+    return finite.max() if len(finite) else 0.0
+
+
+def closeness(distances):
+    """Closeness centrality from the distances to all reachable vertices"""
+    reachable = np.isfinite(distances)
+    np.fill_diagonal(reachable, False)
+    total = np.where(reachable, distances, 0).sum(axis=1)
+    with np.errstate(divide='ignore'):
+        return np.where(reachable.any(axis=1), 1.0 / total, np.nan)
+
+
+def betweenness(distances, predecessors, heads, tails, targets=None):
+    """Edge and vertex betweenness of an undirected graph
+
+    Paths are followed along the shortest path tree of every source
+    vertex, so ties between equally short paths are not split. If a
+    boolean matrix of targets is given, only the paths from each
+    source (row) to its targets (columns) are counted.
+    """
+    n_vertices = len(distances)
+    weight = np.isfinite(distances)
+    if targets is not None:
+        weight &= targets
+    weight = weight.astype(float)
+    np.fill_diagonal(weight, 0)
+
+    # Number of targets in the subtree below each vertex, accumulated
+    # from the most distant vertices towards the source
+    below = weight.copy()
+    order = np.argsort(distances, axis=1)
+    sources = np.arange(n_vertices)
+    keys = np.concatenate((heads * n_vertices + tails,
+                           tails * n_vertices + heads))
+    edge_ids = np.tile(np.arange(len(heads)), 2)
+    key_order = np.argsort(keys)
+    edge_betweenness = np.zeros(len(heads))
+    for rank in range(n_vertices - 1, 0, -1):
+        vertex = order[:, rank]
+        parent = predecessors[sources, vertex]
+        reached = parent >= 0
+        source, vertex, parent = (sources[reached], vertex[reached],
+                                  parent[reached])
+        carried = below[source, vertex]
+        below[source, parent] += carried
+        edges = edge_ids[key_order[np.searchsorted(
+            keys, parent * n_vertices + vertex, sorter=key_order)]]
+        edge_betweenness += np.bincount(edges, carried,
+                                        minlength=len(heads))
+
+    # Paths passing a vertex without ending there
+    through = below - weight
+    np.fill_diagonal(through, 0)
+
+    # Every pair of vertices has been counted from both ends
+    return edge_betweenness / 2.0, through.sum(axis=0) / 2.0
+
+
+def shortest_edges(n_vertices, heads, tails, weights):
+    """Flag edges which are the shortest path between their vertices"""
+    distances = dijkstra(adjacency(n_vertices, heads, tails, weights),
+                         directed=False)
+    return (weights <= distances[heads, tails] * (1 + 1e-9)).astype(int)
+
+
+def spanning_forest(n_vertices, heads, tails, weights):
+    """Flag the edges of the minimum spanning tree (or forest)"""
+    tree = minimum_spanning_tree(adjacency(n_vertices, heads, tails,
+                                           weights)).tocoo()
+    tree_keys = (np.minimum(tree.row, tree.col) * n_vertices +
+                 np.maximum(tree.row, tree.col))
+    keys = np.minimum(heads, tails) * n_vertices + np.maximum(heads, tails)
+    return np.isin(keys, tree_keys).astype(int)
+
+
+def biconnected_components(n_vertices, heads, tails):
+    """Biconnected components with an iterative depth first search
+
+    Returns the component of each edge and of each tree edge of the
+    search (0 for others, components are numbered from 1) as well as
+    the articulation points of the graph
+    """
+    neighbours = [[] for vertex in range(n_vertices)]
+    for edge, (head, tail) in enumerate(zip(heads, tails)):
+        neighbours[head].append((tail, edge))
+        neighbours[tail].append((head, edge))
+    component = np.zeros(len(heads), dtype=int)
+    tree_edge = np.zeros(len(heads), dtype=bool)
+    articulation = np.zeros(n_vertices, dtype=int)
+    discovery = np.full(n_vertices, -1, dtype=int)
+    low = np.zeros(n_vertices, dtype=int)
+    count = 0
+    time = 0
+    for root in range(n_vertices):
+        if discovery[root] >= 0:
+            continue
+        discovery[root] = low[root] = time
+        time += 1
+        children = 0
+        stack = [(root, -1, iter(neighbours[root]))]
+        edge_stack = []
+        while stack:
+            vertex, parent_edge, candidates = stack[-1]
+            for other, edge in candidates:
+                if edge == parent_edge:
+                    continue
+                if discovery[other] < 0:
+                    tree_edge[edge] = True
+                    edge_stack.append(edge)
+                    discovery[other] = low[other] = time
+                    time += 1
+                    stack.append((other, edge, iter(neighbours[other])))
+                    break
+                if discovery[other] < discovery[vertex]:
+                    # Back edge to an ancestor
+                    edge_stack.append(edge)
+                    low[vertex] = min(low[vertex], discovery[other])
+            else:
+                stack.pop()
+                if not stack:
+                    continue
+                parent = stack[-1][0]
+                low[parent] = min(low[parent], low[vertex])
+                if low[vertex] >= discovery[parent]:
+                    if parent == root:
+                        children += 1
+                    else:
+                        articulation[parent] = 1
+                    count += 1
+                    while True:
+                        edge = edge_stack.pop()
+                        component[edge] = count
+                        if edge == parent_edge:
+                            break
+        if children > 1:
+            articulation[root] = 1
+    return component, np.where(tree_edge, component, 0), articulation
+
+
+def modularity(heads, tails, membership):
+    """Modularity of a partition of an unweighted graph"""
+    n_edges = float(len(heads))
+    if not n_edges:
+        return 0.0
+    size = membership.max() + 1
+    same = membership[heads] == membership[tails]
+    links = np.bincount(membership[heads][same], minlength=size)
+    degrees = (np.bincount(membership[heads], minlength=size) +
+               np.bincount(membership[tails], minlength=size))
+    return (links / n_edges - (degrees / (2 * n_edges)) ** 2).sum()
+
+
+def edge_betweenness_communities(n_vertices, heads, tails, weights):
+    """Communities by repeatedly removing the edge with the highest
+    edge betweenness (Girvan & Newman 2002)
+
+    Returns the edge betweenness of the edges at the time they were
+    removed, the order of removal, the number of clusters before the
+    removal, whether the removal split a cluster, and the vertex
+    membership (numbered from 1) for every number of clusters
+    """
+    n_edges = len(heads)
+    remaining = np.ones(n_edges, dtype=bool)
+    value = np.zeros(n_edges)
+    rank = np.zeros(n_edges, dtype=int)
+    clusters = np.zeros(n_edges, dtype=int)
+    bridge = np.zeros(n_edges, dtype=int)
+    count, labels = connected_components(
+        adjacency(n_vertices, heads, tails, weights), directed=False)
+    memberships = {count: labels + 1}
+    for step in range(n_edges):
+        edges = np.flatnonzero(remaining)
+        distances, predecessors = dijkstra(
+            adjacency(n_vertices, heads[edges], tails[edges],
+                      weights[edges]),
+            directed=False, return_predecessors=True)
+        edge_betweenness = betweenness(distances, predecessors,
+                                       heads[edges], tails[edges])[0]
+        best = np.argmax(edge_betweenness)
+        edge = edges[best]
+        value[edge] = edge_betweenness[best]
+        rank[edge] = step + 1
+        clusters[edge] = count
+        remaining[edge] = False
+        edges = np.flatnonzero(remaining)
+        new_count, labels = connected_components(
+            adjacency(n_vertices, heads[edges], tails[edges]),
+            directed=False)
+        if new_count > count:
+            bridge[edge] = 1
+            memberships[new_count] = labels + 1
+        count = new_count
+    return value, rank, clusters, bridge, memberships
+
+
+def probability_of_connectivity(matrix, pop, total, kernel):
+    """Probability of connectivity (PC) with the dispersal kernel applied
+    to the shortest cost distance between all pairs of vertices"""
+    distances = dijkstra(matrix, directed=False)
+    with np.errstate(over='ignore', invalid='ignore'):
+        probability = np.where(np.isfinite(distances),
+                               np.exp(kernel * distances), 0.0)
+    return pop.dot(probability).dot(pop) / total ** 2
+
+
+def integral_index(matrix, pop, total):
+    """Integral index of connectivity (IIC) from the number of links on
+    the topologically shortest paths between all pairs of vertices"""
+    links = shortest_path(matrix, directed=False, unweighted=True)
+    with np.errstate(divide='ignore'):
+        weight = np.where(np.isfinite(links), 1.0 / (1 + links), 0.0)
+    return pop.dot(weight).dot(pop) / total ** 2
+
+
+def init_worker(shared_graphs):
+    """Share the (sub)graphs with the worker processes"""
+    graphs.update(shared_graphs)
+
+
+def network_measures(task):
+    """Compute the measures of a (sub)graph for one task of the pool
+
+    Tasks are "path" for betweenness and closeness with one weight, or
+    "edge", "vertex" and "cumulative" for removal analyses
+    """
+    kind, name, index = task
+    graph = graphs[name]
+    n_vertices = graph['n_vertices']
+    heads = graph['heads']
+    tails = graph['tails']
+
+    if kind == 'path':
+        weights = graph['weights'][index]
+        distances, predecessors = dijkstra(
+            adjacency(n_vertices, heads, tails, weights),
+            directed=False, return_predecessors=True)
+        if index == 'cd':
+            cd_distances = distances
+        else:
+            cd_distances = dijkstra(adjacency(n_vertices, heads, tails,
+                                              graph['weights']['cd']),
+                                    directed=False)
+        local = cd_distances < graph['local_cutoff']
+        edge_betweenness, vertex_betweenness = betweenness(
+            distances, predecessors, heads, tails)
+        local_edge_betweenness, local_vertex_betweenness = betweenness(
+            distances, predecessors, heads, tails, local)
+        return kind, name, index, {'eb': edge_betweenness,
+                                   'leb': local_edge_betweenness,
+                                   'vb': vertex_betweenness,
+                                   'lvb': local_vertex_betweenness,
+                                   'cl': closeness(distances)}
+
+    pop = graph['pop']
+    keep = np.ones(len(heads), dtype=bool)
+    if kind == 'edge':
+        keep[index] = False
+    elif kind == 'vertex':
+        keep &= (heads != index) & (tails != index)
+        pop = pop.copy()
+        pop[index] = 0
+    else:
+        keep[graph['order'][:index + 1]] = False
+    matrix = adjacency(n_vertices, heads[keep], tails[keep],
+                       graph['weights']['cd'][keep])
+    count, labels = connected_components(matrix, directed=False)
+    if kind == 'vertex':
+        # The removed vertex remains as an isolated cluster
+        count -= 1
+    result = {'components': count}
+
+    if kind == 'cumulative':
+        result['max_size'] = np.bincount(labels, pop).max()
+        result['included'] = (
+            count / float(n_vertices) >= graph['convergence_threshold'] or
+            graph['weights']['cd'][graph['order'][index]] <=
+            graph['connectivity_cutoff'] * 1.25)
+        if result['included']:
+            result['diameter'] = diameter(dijkstra(matrix, directed=False))
+    if 'pc' in graph['measures']:
+        result['pc'] = probability_of_connectivity(matrix, pop,
+                                                   graph['total'],
+                                                   graph['kernel'])
+    if 'iic' in graph['measures']:
+        result['iic'] = integral_index(matrix, pop, graph['total'])
+    return kind, name, index, result
+
+
+def network_analysis(network_map, in_vertices, pop_proxy, settings, cores):
+    """Analyse the network on graph, edge and vertex level
+
+    Returns the network measures as (measure, value) rows, the vertex
+    and edge measures as lists of (column, values) tuples and the
+    results of the edge removal for the overview plot
+    """
+    kernel = settings['base'] * 10.0 ** settings['exponent']
+    connectivity_cutoff = settings['connectivity_cutoff']
+    cl_thresh = settings['cl_thresh']
+
+    # Read vertices and directed edges
+    patch_id, pop = read_columns(in_vertices, ['cat', pop_proxy])
+    patch_id = patch_id.astype(int)
+    pop = np.nan_to_num(pop)
+    edges = read_columns(network_map, ['cat', 'from_p', 'to_p', 'dist'])
+    edges = edges[:, np.argsort(edges[0])]
+    con_id, from_p, to_p = edges[:3].astype(int)
+    cost_distance = edges[3]
+    n_vertices = len(patch_id)
+    sorter = np.argsort(patch_id)
+    from_v = sorter[np.searchsorted(patch_id, from_p, sorter=sorter)]
+    to_v = sorter[np.searchsorted(patch_id, to_p, sorter=sorter)]
+
+    # Group the directed edges to undirected edges, numbered in order
+    # of appearance and represented by their first directed edge
+    keys = (np.minimum(from_v, to_v) * n_vertices +
+            np.maximum(from_v, to_v))
+    first, pair = np.unique(keys, return_index=True,
+                            return_inverse=True)[1:]
+    appearance = np.argsort(first)
+    renumber = np.empty_like(appearance)
+    renumber[appearance] = np.arange(len(appearance))
+    pair = renumber[pair]
+    first = first[appearance]
+    n_pairs = len(first)
+    cd_u_pairs = (np.bincount(pair, cost_distance, minlength=n_pairs) /
+                  np.bincount(pair, minlength=n_pairs))
+    cd_u = cd_u_pairs[pair]
+
+    # Attributes representing proxies for potential flow between patches
+    from_pop = pop[from_v]
+    to_pop = pop[to_v]
+    distance_weight_e = np.exp(kernel * cost_distance)
+    distance_weight_e_ud = np.exp(kernel * cd_u)
+    mf_o = from_pop * distance_weight_e
+    mf_i = to_pop * distance_weight_e
+    mf_u = (from_pop + to_pop) * distance_weight_e_ud
+    with np.errstate(divide='ignore'):
+        mf_o_inv = 1.0 / mf_o
+        mf_i_inv = 1.0 / mf_i
+    mf_inv_u = invert_weights(mf_u)
+    sum_mf_i = np.bincount(from_v, mf_i, minlength=n_vertices)[from_v]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cf = np.where(sum_mf_i > 0, mf_o * mf_i / sum_mf_i, 0.0)
+    cf_inv = invert_weights(cf)
+    cf_u_pairs = np.bincount(pair, cf, minlength=n_pairs)
+    cf_inv_u_pairs = invert_weights(cf_u_pairs)
+
+    # Undirected graph and its subgraphs with only direct edges (d)
+    # and/or only edges shorter than the connectivity cutoff (c)
+    heads = from_v[first]
+    tails = to_v[first]
+    weights = {'cd': cd_u_pairs,
+               'mf': mf_inv_u[first],
+               'cf': cf_inv_u_pairs}
+    isshort = {}
+    for weight in ('cd', 'mf', 'cf'):
+        isshort[weight] = shortest_edges(n_vertices, heads, tails,
+                                         weights[weight])
+    isshort_any = isshort['cd'] | isshort['mf'] | isshort['cf']
+    shorter = cd_u_pairs < connectivity_cutoff
+    subgraphs = {'u': np.arange(n_pairs),
+                 'uc': np.flatnonzero(shorter),
+                 'ud': np.flatnonzero(isshort_any),
+                 'udc': np.flatnonzero(isshort_any & shorter)}
+
+    def subgraph(name):
+        index = subgraphs[name]
+        return n_vertices, heads[index], tails[index]
+
+    ###Analysis on graph level
+    grass.verbose('Starting analysis on graph level...')
+    labels = {}
+    cl_no = {}
+    cls_size = {}
+    for name in ('ud', 'udc'):
+        cl_no[name], labels[name] = connected_components(
+            adjacency(*subgraph(name)), directed=False)
+        cls_size[name] = np.bincount(labels[name], pop)
+    diam = {}
+    for name in ('u', 'ud', 'udc'):
+        diam[name] = diameter(dijkstra(
+            adjacency(*subgraph(name),
+                      weights=weights['cd'][subgraphs[name]]),
+            directed=False))
+    possible_edges = n_vertices * (n_vertices - 1)
+    total_pop = pop.sum()
+
+    # Share the (sub)graphs with the worker processes
+    shared = {}
+    for name, measures in (('u', {'pc'}), ('uc', {'iic'}),
+                           ('ud', set()), ('udc', set())):
+        index = subgraphs[name]
+        shared[name] = {
+            'n_vertices': n_vertices,
+            'heads': heads[index],
+            'tails': tails[index],
+            'weights': {weight: weights[weight][index]
+                        for weight in weights},
+            'pop': pop,
+            'total': total_pop,
+            'kernel': kernel,
+            'measures': measures,
+            'local_cutoff': settings['lnbh_cutoff'] * connectivity_cutoff,
+            'connectivity_cutoff': connectivity_cutoff,
+            'convergence_threshold': settings['convergence_threshold'],
+            # Edges are removed with decreasing cost distance
+            'order': np.argsort(-weights['cd'][index], kind='mergesort')}
+
+    # Baseline for the removal analyses
+    pc_u = probability_of_connectivity(
+        adjacency(*subgraph('u'), weights=weights['cd']), pop, total_pop,
+        kernel)
+    iic_uc = integral_index(adjacency(*subgraph('uc')), pop, total_pop)
+
+    # Run betweenness and the per edge and per vertex removal analyses
+    # in parallel
+    jobs = [('path', name, weight) for name in ('ud', 'udc')
+            for weight in ('cd', 'mf', 'cf')]
+    for name in ('u', 'uc', 'ud', 'udc'):
+        jobs.extend([('edge', name, edge)
+                     for edge in range(len(subgraphs[name]))])
+        jobs.extend([('vertex', name, vertex)
+                     for vertex in range(n_vertices)])
+    if settings['overview_plot']:
+        jobs.extend([('cumulative', 'u', edge) for edge in range(n_pairs)])
+
+    results = {}
+    pool = Pool(max(cores, 1), initializer=init_worker,
+                initargs=(shared,))
+    for counter, (kind, name, index, result) in enumerate(
+            pool.imap_unordered(network_measures, jobs)):
+        results[(kind, name, index)] = result
+        grass.percent(counter + 1, len(jobs), 5)
+    pool.close()
+    pool.join()
+
+    def removal(kind, name, measure):
+        size = len(subgraphs[name]) if kind == 'edge' else n_vertices
+        return np.array([results[(kind, name, index)][measure]
+                         for index in range(size)])
+
+    ###Analysis on edge level
+    grass.verbose('Starting analysis on edge level...')
+    edge_measures_u = {}
+    vertex_measures_u = {}
+    for weight in ('cd', 'mf', 'cf'):
+        edge_measures_u['isshort_{}'.format(weight)] = isshort[weight]
+    edge_measures_u['isshort'] = isshort_any
+    for name in ('u', 'ud', 'udc'):
+        index = subgraphs[name]
+        _, sub_heads, sub_tails = subgraph(name)
+        base_components = cl_no['ud' if name == 'u' else name]
+        if name != 'u':
+            for weight in ('mf', 'cd', 'cf'):
+                edge_measures_u['{}_mst_{}'.format(weight, name)] = expand(
+                    index, spanning_forest(n_vertices, sub_heads, sub_tails,
+                                           weights[weight][index]),
+                    n_pairs)
+        edge_measures_u['is_br_{}'.format(name)] = expand(
+            index, removal('edge', name, 'components') - base_components,
+            n_pairs)
+        component, tree_component, articulation = biconnected_components(
+            n_vertices, sub_heads, sub_tails)
+        edge_measures_u['bc_e_{}'.format(name)] = expand(index, component,
+                                                        n_pairs)
+        edge_measures_u['bc_te_{}'.format(name)] = expand(
+            index, tree_component, n_pairs)
+        if name == 'u':
+            continue
+        vertex_measures_u['art_p_{}'.format(name)] = articulation
+        for weight in ('cd', 'mf', 'cf'):
+            paths = results[('path', name, weight)]
+            for measure in ('eb', 'leb'):
+                edge_measures_u['{}_{}_{}'.format(weight, measure,
+                                                  name)] = expand(
+                    index, paths[measure], n_pairs)
+            for measure in ('cl', 'vb', 'lvb'):
+                vertex_measures_u['{}_{}_{}'.format(weight, measure,
+                                                    name)] = paths[measure]
+        vertex_measures_u['art_{}'.format(name)] = np.maximum(
+            removal('vertex', name, 'components') - cl_no[name], 0)
+
+    # Connectivity lost when single edges or vertices are removed
+    with np.errstate(divide='ignore', invalid='ignore'):
+        edge_measures_u['dpc_u'] = (pc_u - removal('edge', 'u', 'pc')) * \
+            100.0 / pc_u
+        edge_measures_u['diic_uc'] = expand(
+            subgraphs['uc'],
+            (iic_uc - removal('edge', 'uc', 'iic')) * 100.0 / iic_uc,
+            n_pairs)
+        vertex_measures_u['dpc_u'] = (
+            pc_u - removal('vertex', 'u', 'pc')) * 100.0 / pc_u
+        vertex_measures_u['diic_uc'] = (
+            iic_uc - removal('vertex', 'uc', 'iic')) * 100.0 / iic_uc
+
+    # Communities from edge betweenness on the undirected graph
+    # weighted by competing potential flow
+    edge_measures = {}
+    vertex_measures = {}
+    network_rows = []
+    if cl_thresh > 0:
+        grass.verbose('Calculating edge betweenness communities...')
+        value, rank, clusters, bridge, memberships = \
+            edge_betweenness_communities(n_vertices, heads, tails,
+                                         weights['cf'])
+        levels = sorted(memberships)
+
+        def cutat(level):
+            level = min(max(level, levels[0]), levels[-1])
+            return memberships[level]
+
+        scores = [modularity(heads, tails, memberships[level] - 1)
+                  for level in levels]
+        best = memberships[levels[int(np.argmax(scores))]]
+        community_levels = [cutat(level) for level in
+                            range(cl_no['ud'], cl_no['ud'] + cl_thresh + 1)]
+        community_structure = np.array([';'.join(str(level[vertex])
+                                                 for level in
+                                                 community_levels)
+                                        for vertex in range(n_vertices)])
+        community = cutat(cl_no['ud'] + cl_thresh)
+        now = datetime.now()
+        edge_measures_u['cf_iebc_v'] = value
+        edge_measures_u['cf_iebc_r'] = rank
+        edge_measures_u['cf_iebc_b'] = bridge
+        edge_measures_u['cf_iebc_c'] = (best[heads] !=
+                                        best[tails]).astype(int)
+        edge_measures_u['cf_ebc_v'] = value
+        edge_measures_u['cf_ebc_r'] = rank
+        edge_measures_u['cf_ebc_c'] = clusters
+        edge_measures_u['cf_ebc_vi'] = np.array([
+            (now + timedelta(seconds=int(seconds))).strftime(
+                '%Y-%m-%d %H:%M:%S') for seconds in rank])
+        vertex_measures['cf_iebc_me'] = best
+        vertex_measures['cf_iebc_cs'] = community_structure
+        vertex_measures['cf_iebc_cl'] = community
+        vertex_measures_u['cf_ebc_cs'] = community_structure
+        vertex_measures_u['cf_ebc_cl'] = community
+        edge_measures['cf_ebc_cc'] = (community[from_v] !=
+                                      community[to_v]).astype(int)
+        com_sizes_u = np.bincount(best)[1:]
+        network_rows.extend([
+            ('Modularity (from iebc) of the entire graph (undirected) '
+             'weighted by cf', max(scores)),
+            ('Number of communities (at maximum modularity score (from '
+             'iebc)) of the entire (undirected) graph weighted by cf',
+             len(com_sizes_u)),
+            ('com_sizes_u', ', '.join(str(size) for size in com_sizes_u)),
+            ('com_sizes_u_names', ', '.join(
+                'Size of comumity {} (at maximum modularity score (from '
+                'iebc))'.format(community_id)
+                for community_id in range(1, len(com_sizes_u) + 1)))])
+    else:
+        grass.verbose('Skipping comunity algorithms...')
+
+    # Potential cluster connectors (based on cost distance threshold)
+    edge_measures['cl_pc'] = (labels['udc'][from_v] !=
+                              labels['udc'][to_v]).astype(int)
+
+    ###Analysis on vertex level
+    grass.verbose('Starting analysis on vertex level...')
+    vertex_measures_u['cl_ud'] = labels['ud'] + 1
+    vertex_measures_u['cl_udc'] = labels['udc'] + 1
+    for name in ('u', 'uc', 'ud', 'udc'):
+        _, sub_heads, sub_tails = subgraph(name)
+        vertex_measures_u['deg_{}'.format(name)] = (
+            np.bincount(sub_heads, minlength=n_vertices) +
+            np.bincount(sub_tails, minlength=n_vertices))
+    vertex_measures_u['nbh_s_uc'] = vertex_measures_u['deg_uc'] + 1
+    links = shortest_path(adjacency(*subgraph('uc')), directed=False,
+                          unweighted=True)
+    vertex_measures_u['nbh_sl_uc'] = (
+        links <= int(settings['lnbh_cutoff'])).sum(axis=1)
+
+    # Sum of incoming potential flow
+    shorter_directed = cd_u < connectivity_cutoff
+    vertex_measures['mf_evc_d'] = np.bincount(to_v, mf_o,
+                                              minlength=n_vertices)
+    vertex_measures['cf_evc_d'] = np.bincount(to_v, cf,
+                                              minlength=n_vertices)
+    vertex_measures['mf_evc_cd'] = np.bincount(
+        to_v[shorter_directed], mf_o[shorter_directed],
+        minlength=n_vertices)
+    vertex_measures['cf_evc_cd'] = np.bincount(
+        to_v[shorter_directed], cf[shorter_directed],
+        minlength=n_vertices)
+
+    # Network overview measures
+    edges_n = {name: len(subgraphs[name]) for name in subgraphs}
+    network_rows = [
+        ('Command', os.environ['CMDLINE']),
+        ('Number of vertices', n_vertices),
+        ('Number of edges (undirected)', edges_n['u']),
+        ('Number of direct edges (undirected)', edges_n['ud']),
+        ('Number of edges shorter than cost distance threshold '
+         '(undirected)', edges_n['uc']),
+        ('Number of direct edges shorter than cost distance threshold '
+         '(undirected)', edges_n['udc']),
+        ('Number of clusters of the entire graph', cl_no['ud']),
+        ('Number of clusters of the graph with only edges shorter cost '
+         'distance threshold', cl_no['udc']),
+        ('Size of the largest cluster of the entire graph',
+         cls_size['ud'].max()),
+        ('Size of the largest cluster of the graph with only edges '
+         'shorter cost distance threshold', cls_size['udc'].max()),
+        ('Average size of the clusters of the entire graph',
+         cls_size['ud'].mean()),
+        ('Average size of the clusters of the graph with only edges '
+         'shorter cost distance threshold', cls_size['udc'].mean()),
+        ('Diameter of the entire graph (undirected)', diam['u']),
+        ('Diameter of the graph with only direct edges (undirected)',
+         diam['ud']),
+        ('Diameter of the graph with only edges shorter cost distance '
+         'threshold', diam['udc']),
+        ('Density of the entire graph (directed)',
+         len(con_id) / float(possible_edges)),
+        ('Density of the entire graph (undirected)',
+         2.0 * edges_n['u'] / possible_edges),
+        ('Density of the graph with only direct edges (undirected)',
+         2.0 * edges_n['ud'] / possible_edges),
+        ('Density of the graph with only edges shorter cost distance '
+         'threshold', 2.0 * edges_n['udc'] / possible_edges),
+        ('Probability of connectivity (PC) of the entire graph '
+         '(undirected)', pc_u),
+        ('Integral index of connectivity (IIC) of the graph with only '
+         'edges shorter cost distance threshold', iic_uc)] + network_rows
+
+    # Collect vertex and edge measures
+    vertex_columns = [('patch_id', patch_id)]
+    vertex_columns.extend(sorted(vertex_measures.items()))
+    vertex_columns.extend(sorted(vertex_measures_u.items()))
+    edge_columns = [('con_id', con_id),
+                    ('con_id_u', pair + 1),
+                    ('from_p', from_p),
+                    ('from_pop', from_pop),
+                    ('to_p', to_p),
+                    ('to_pop', to_pop),
+                    ('cd', cost_distance),
+                    ('cd_u', cd_u),
+                    ('distk', distance_weight_e),
+                    ('distk_u', distance_weight_e_ud),
+                    ('mf_o', mf_o),
+                    ('mf_o_inv', mf_o_inv),
+                    ('mf_i', mf_i),
+                    ('mf_i_inv', mf_i_inv),
+                    ('mf_u', mf_u),
+                    ('mf_inv_u', mf_inv_u),
+                    ('cf', cf),
+                    ('cf_inv', cf_inv),
+                    ('cf_u', cf_u_pairs[pair]),
+                    ('cf_inv_u', cf_inv_u_pairs[pair])]
+    edge_columns.extend(sorted(edge_measures.items()))
+    edge_columns.extend([(column, values[pair]) for column, values in
+                         sorted(edge_measures_u.items())])
+
+    # Clusters when edges are removed with decreasing cost distance
+    overview = None
+    if settings['overview_plot']:
+        order = shared['u']['order']
+        included = [edge for edge in range(n_pairs)
+                    if results[('cumulative', 'u', edge)]['included']]
+        overview = {
+            'distance': cd_u_pairs[order[included]],
+            'clusters': np.array(
+                [results[('cumulative', 'u', edge)]['components']
+                 for edge in included]) * 100.0 / n_vertices,
+            'max_size': np.array(
+                [results[('cumulative', 'u', edge)]['max_size']
+                 for edge in included]) * 100.0 / total_pop,
+            'edges': (n_pairs - 1 - np.array(included, dtype=int)) *
+                     100.0 / n_pairs,
+            'diameter': np.array(
+                [results[('cumulative', 'u', edge)]['diameter']
+                 for edge in included]) * 100.0 / diam['ud']}
+
+    return network_rows, vertex_columns, edge_columns, overview
+
+
+def write_table(table, columns):
+    """Write columns given as (name, values) to a new attribute table"""
+    if grass_db.db_table_exist(table):
+        grass.run_command('db.droptable', table=table, flags='f',
+                          quiet=True)
+    definitions = []
+    for name, values in columns:
+        kind = np.asarray(values).dtype.kind
+        if kind in 'iub':
+            definitions.append('{} integer'.format(name))
+        elif kind == 'f':
+            definitions.append('{} double precision'.format(name))
+        else:
+            definitions.append('{} text'.format(name))
+
+    def sql_value(value, masked):
+        if masked:
+            return 'NULL'
+        if isinstance(value, (str, bytes, np.str_)):
+            return "'{}'".format(str(value).replace("'", "''"))
+        if isinstance(value, (float, np.floating)) and not np.isfinite(value):
+            return 'NULL'
+        return repr(value.item() if hasattr(value, 'item') else value)
+
+    masks = [np.ma.getmaskarray(values) for name, values in columns]
+    rows = []
+    for row in range(len(columns[0][1])):
+        rows.append('INSERT INTO {} VALUES ({});'.format(
+            table, ','.join(sql_value(values[row], mask[row])
+                            for (name, values), mask in zip(columns,
+                                                            masks))))
+    sql = 'CREATE TABLE {} ({});\n{}\n'.format(table, ', '.join(definitions),
+                                             '\n'.join(rows))
+    grass.write_command('db.execute', input='-', stdin=sql)
+
+
+def write_qml(qml_style_dir, columns):
+    """Write QML files for styling the edge measures in QGIS"""
+    colortable = ['215,25,28,255', '253,174,97,255', '255,255,191,255',
+                  '166,217,106,255', '26,150,65,255']
+    line_layer = '''        <layer pass="{}" class="SimpleLine" locked="0">
+          <prop k="capstyle" v="square"/>
+          <prop k="color" v="{}"/>
+          <prop k="customdash" v="5;2"/>
+          <prop k="joinstyle" v="bevel"/>
+          <prop k="offset" v="0"/>
+          <prop k="penstyle" v="solid"/>
+          <prop k="use_custom_dash" v="0"/>
+          <prop k="width" v="0.26"/>
+        </layer>'''
+    for attribute, values in columns:
+        # Skip id and text columns
+        if attribute in ('id', 'con_id', 'con_id_u', 'from_p', 'to_p',
+                         'cf_ebc_vi'):
+            continue
+        if np.asarray(values).dtype.kind not in 'iubf':
+            continue
+        values = np.ma.filled(np.ma.asarray(values, dtype=float), np.nan)
+        values = values[np.isfinite(values)]
+        if not len(values):
+            continue
+
+        qml = ["<!DOCTYPE qgis PUBLIC 'http://mrcc.com/qgis.dtd' 'SYSTEM'>",
+               '<qgis version="1.8" minimumScale="0" maximumScale="1e+08" '
+               'hasScaleBasedVisibilityFlag="0">',
+               '  <transparencyLevelInt>255</transparencyLevelInt>']
+        if values.max() - values.min() == 1:
+            qml.extend([
+                '  <renderer-v2 attr="{}" symbollevels="0" '
+                'type="categorizedSymbol">'.format(attribute),
+                '    <categories>',
+                '      <category symbol="0" value="1" label=""/>',
+                '    </categories>',
+                '    <symbols>',
+                '      <symbol outputUnit="MM" alpha="1" type="line" '
+                'name="0">',
+                line_layer.format(0, '0,0,0,255'),
+                '      </symbol>'])
+        else:
+            quantiles = np.percentile(values, np.linspace(0, 100, 6))
+            qml.append('  <renderer-v2 attr="{}" symbollevels="1" '
+                       'type="graduatedSymbol">'.format(attribute))
+            qml.append('    <ranges>')
+            for quant in range(5):
+                qml.append('      <range symbol="{0}" lower="{1}" '
+                           'upper="{2}" label="{3} - {4}"/>'.format(
+                               quant, quantiles[quant],
+                               quantiles[quant + 1],
+                               round(quantiles[quant], 4),
+                               round(quantiles[quant + 1], 4)))
+            qml.append('    </ranges>')
+            qml.append('    <symbols>')
+            for quant in range(5):
+                qml.append('      <symbol outputUnit="MM" alpha="1" '
+                           'type="line" name="{}">'.format(quant))
+                qml.append(line_layer.format(quant, colortable[quant]))
+                qml.append('      </symbol>')
+        qml.extend([
+            '    </symbols>',
+            '    <source-symbol>',
+            '      <symbol outputUnit="MM" alpha="1" type="line" name="0">',
+            line_layer.format(0, '161,238,135,255'),
+            '      </symbol>',
+            '    </source-symbol>',
+            '    <mode name="quantile"/>',
+            '    <rotation field=""/>',
+            '    <sizescale field=""/>',
+            '  </renderer-v2>',
+            '  <customproperties/>',
+            '  <displayfield>"{}"</displayfield>'.format(attribute),
+            '  <attributeactions/>',
+            '</qgis>'])
+        with open(os.path.join(qml_style_dir, 'edge_measures_{}.qml'.format(
+                attribute)), 'w') as qml_file:
+            qml_file.write('\n'.join(qml) + '\n')
+
+
+def plot_overview(overview_plot, overview, connectivity_cutoff):
+    """Plot the fragmentation of the network with decreasing
+    connectivity threshold"""
+    order = np.argsort(overview['distance'])
+    distance = overview['distance'][order]
+    fig = plt.figure()
+    plt.plot(distance, overview['clusters'][order], linestyle='-',
+             color='black',
+             label='Clusters (in % of maximum possible clusters)')
+    plt.plot(distance, overview['max_size'][order], linestyle='--',
+             color='black',
+             label='Size of the largest cluster (in % of total population '
+             'size)')
+    plt.plot(distance, overview['edges'][order], linestyle=':',
+             color='black',
+             label='Number of edges (in % of maximum possible number of '
+             'edges)')
+    plt.plot(distance, overview['diameter'][order], linestyle='-.',
+             color='black',
+             label='Diameter (in % of diameter of the entire graph)')
+    if connectivity_cutoff > 0:
+        plt.axvline(connectivity_cutoff, color='red', linestyle=':',
+                    label='Connectivity threshold used in analysis')
+    plt.ylim(0, 100)
+    plt.yticks(range(0, 101, 25),
+               ['0 %', '25 %', '50 %', '75 %', '100 %'])
+    plt.xlabel('Connectivity threshold\n'
+               '(Cost distance between patches)')
+    plt.legend(loc='upper left', fontsize='small')
+    fig.savefig(overview_plot)
+
+
+def join_measures(network_map, in_vertices, edge_output, vertex_output,
+                  edge_output_tmp, vertex_output_tmp, net_hist_str):
+    """Join the tables with edge and vertex measures to copies of the
+    network maps"""
+
+    grass.run_command('g.copy', quiet=True,
+                      vector='{},{}'.format(network_map,
+                                            edge_output))
+    grass.run_command('g.copy', quiet=True,
+                      vector='{},{}'.format(in_vertices,
+                                            vertex_output))
+
+    # Use v.db.connect instead of v.db.join (much faster)
+
+    grass.run_command('v.db.join', map=edge_output, column='cat',
+                      other_table=edge_output_tmp,
+                      other_column='con_id', quiet=True)
+    grass.run_command('v.db.join', map=vertex_output, column='cat',
+                      other_table=vertex_output_tmp,
+                      other_column='patch_id', quiet=True)
+
+    update_history = '{}\n{}'.format(net_hist_str,
+                                     os.environ['CMDLINE'])
+
+    grass.run_command('v.support', flags='h', map=vertex_output,
+                      person=os.environ['USER'],
+                      cmdhist=update_history)
+
+    grass.run_command('v.support', flags='h', map=edge_output,
+                      person=os.environ['USER'],
+                      cmdhist=update_history)
+
+    for table in [edge_output_tmp, vertex_output_tmp]:
+        grass.run_command('db.droptable', flags='f', quiet=True,
+                          table=table)
+
+
 def main():
     """Do the main work"""
 
-    try:
-        import rpy2
-        import rpy2.rinterface
-        rpy2.rinterface.set_initoptions((b'rpy2', b'--no-save',
-                                         b'--no-restore', b'--quiet'))
-        import rpy2.robjects as robjects
-        # rpy2 throws lots of warnings (that cannot be suppressed)
-        # when packages are loaded
-        warnings.filterwarnings("ignore")
-        import rpy2.robjects.packages as rpackages
-        from rpy2.robjects.vectors import StrVector
-        import rpy2.robjects.numpy2ri
-    except ImportError:
-        grass.fatal(_("Cannot import rpy2 (https://rpy2.bitbucket.io)"
-                      " library."
-                      " Please install it (pip install rpy2)"
-                      " or ensure that it is on path"
-                      " (use PYTHONPATH variable)."))
     #Input variables
     network_map = options['input']
     # network_mapset = network_map.split('@')[0]
     # network = network_map.split('@')[1] if len(network_map.split('@'))
     # > 1 else None
     prefix = options['prefix']
-    cores = options['cores']
+    cores = int(options['cores'])
+    backend = options['backend']
     convergence_treshold = options['convergence_threshold']
     euler = np.exp(1)
     base = float(options['base'])
@@ -366,8 +1284,6 @@ def main():
     # OS adjustment
     os_type = platform.system()
 
-    robjects.numpy2ri.activate()
-
     grass.verbose("prefix is {}".format(prefix))
     grass.verbose("cores is {}".format(cores))
     grass.verbose("convergence_treshold is {}".format(convergence_treshold))
@@ -384,15 +1300,6 @@ def main():
     grass.verbose("VERTICES is {}_vertices".format(prefix))
     grass.verbose("cl_thresh is {}".format(cl_thresh))
 
-
-    #Check if R is installed
-    if not grass.find_program('R'):
-        grass.fatal("R is required, but can not be found on the system.\n \
-                    Please make sure that R is installed and the path \
-                    to R is added to the environment variables \
-                    (see: http://grass.osgeo.org/wiki/R_statistics#MS_Windows). \
-                    After that a restart of GRASS GIS is required.")
-
     #Visualise the negative exponential decay kernel and exit (if requested)
     if x_flag:
         rscript = """euler <- {euler}
@@ -430,6 +1337,67 @@ def main():
         elif kernel_plot:
             fig.savefig(kernel_plot)
 
+    if backend == 'python':
+        if csr_matrix is None:
+            grass.fatal("Cannot import scipy (https://www.scipy.org)."
+                        " Please install it (pip install scipy)"
+                        " or use backend=R.")
+        settings = {'base': base,
+                    'exponent': exponent,
+                    'connectivity_cutoff': connectivity_cutoff,
+                    'lnbh_cutoff': float(lnbh_cutoff),
+                    'convergence_threshold': float(convergence_treshold),
+                    'cl_thresh': int(cl_thresh),
+                    'overview_plot': overview_plot}
+        network_rows, vertex_columns, edge_columns, overview = \
+            network_analysis(network_map, in_vertices, pop_proxy, settings,
+                             cores)
+
+        grass.verbose("Writing connectivity measures...")
+        write_table(network_output,
+                    [('measure', np.array([row[0] for row in network_rows])),
+                     ('value', np.array([str(row[1])
+                                         for row in network_rows]))])
+        write_table(vertex_output_tmp, vertex_columns)
+        write_table(edge_output_tmp, edge_columns)
+        if qml_style_dir:
+            write_qml(qml_style_dir, edge_columns)
+        if overview_plot:
+            plot_overview(overview_plot, overview, connectivity_cutoff)
+
+        join_measures(network_map, in_vertices, edge_output, vertex_output,
+                      edge_output_tmp, vertex_output_tmp, net_hist_str)
+        return 0
+
+    try:
+        import rpy2
+        import rpy2.rinterface
+        rpy2.rinterface.set_initoptions((b'rpy2', b'--no-save',
+                                         b'--no-restore', b'--quiet'))
+        import rpy2.robjects as robjects
+        # rpy2 throws lots of warnings (that cannot be suppressed)
+        # when packages are loaded
+        warnings.filterwarnings("ignore")
+        import rpy2.robjects.packages as rpackages
+        from rpy2.robjects.vectors import StrVector
+        import rpy2.robjects.numpy2ri
+    except ImportError:
+        grass.fatal(_("Cannot import rpy2 (https://rpy2.bitbucket.io)"
+                      " library."
+                      " Please install it (pip install rpy2)"
+                      " or ensure that it is on path"
+                      " (use PYTHONPATH variable)."))
+
+    robjects.numpy2ri.activate()
+
+    #Check if R is installed
+    if not grass.find_program('R'):
+        grass.fatal("R is required, but can not be found on the system.\n \
+                    Please make sure that R is installed and the path \
+                    to R is added to the environment variables \
+                    (see: http://grass.osgeo.org/wiki/R_statistics#MS_Windows). \
+                    After that a restart of GRASS GIS is required.")
+
     if cores > 1 and os_type == "Windows":
         grass.warning('Parallel processing not yet supported on MS Windows. \
                        Setting number of cores to 1.')
@@ -1596,32 +2564,8 @@ close(con_qml)
 
     robjects.r(rscript)
 
-    grass.run_command('g.copy', quiet=True,
-                      vector='{},{}'.format(network_map,
-                                            edge_output))
-    grass.run_command('g.copy', quiet=True,
-                      vector='{},{}'.format(in_vertices,
-                                            vertex_output))
-
-    # Use v.db.connect instead of v.db.join (much faster)
-
-    grass.run_command('v.db.join', map=edge_output, column='cat',
-                      other_table=edge_output_tmp,
-                      other_column='con_id', quiet=True)
-    grass.run_command('v.db.join', map=vertex_output, column='cat',
-                      other_table=vertex_output_tmp,
-                      other_column='patch_id', quiet=True)
-
-    update_history = '{}\n{}'.format(net_hist_str,
-                                     os.environ['CMDLINE'])
-
-    grass.run_command('v.support', flags='h', map=vertex_output,
-                      person=os.environ['USER'],
-                      cmdhist=update_history)
-
-    grass.run_command('v.support', flags='h', map=edge_output,
-                      person=os.environ['USER'],
-                      cmdhist=update_history)
+    join_measures(network_map, in_vertices, edge_output, vertex_output,
+                  edge_output_tmp, vertex_output_tmp, net_hist_str)
 
 
 if __name__ == "__main__":
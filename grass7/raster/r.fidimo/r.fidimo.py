@@ -164,6 +164,26 @@
 #% guisection: Optional
 #%End
 #%Option
+#% key: engine
+#% type: string
+#% required: no
+#% multiple: no
+#% options: graph,raster
+#% description: Engine used to disperse the source populations
+#% descriptions: graph;dispersal kernels evaluated in memory on the river network graph;raster;dispersal kernels evaluated with raster maps per source population
+#% answer: graph
+#% guisection: Optional
+#%End
+#%Option
+#% key: nprocs
+#% type: integer
+#% required: no
+#% multiple: no
+#% description: Number of parallel processes for the graph engine
+#% answer: 1
+#% guisection: Optional
+#%End
+#%Option
 #% key: output
 #% type: string
 #% gisprompt: new
@@ -196,6 +216,7 @@ import sqlite3
 import math #for function sqrt()
 import csv
 import random
+from multiprocessing import Pool
 
 # import required grass modules
 import grass.script as grass
@@ -224,12 +245,242 @@ def cleanup():
 
 
 
+# River network graph shared with the worker processes
+network = {}
+
+
+def init_worker(shared_network):
+    """Share the river network graph with the worker processes"""
+    network.update(shared_network)
+
+
+def dispersal_parameters(fishmove, i, Strahler, p):
+    """Get sigma_stat, sigma_mob and the maximum (cutting) distance of the
+    dispersal kernel for a stream order (fishmove run i: fit, lwr or upr)"""
+    from scipy import stats
+    from scipy import optimize
+
+    m = 0 # m-parameter in dispersal function
+    SO = 'SO='+str(Strahler)
+
+    #if Random Value within Confidence Interval than select a sigma value that is within the CI assuming a normal distribution of sigma within the CI
+    if str(options['statistical_interval']) == "Random Value within Confidence Interval":
+        random.seed(int(options['seed1']))
+        sigma_stat = random.gauss(mu=fishmove.rx("fit",'sigma_stat',1,1,SO,1)[0],
+                sigma=(fishmove.rx("upr",'sigma_stat',1,1,SO,1)[0]-fishmove.rx("lwr",'sigma_stat',1,1,SO,1)[0])/4)
+        random.seed(int(options['seed1']))
+        sigma_mob = random.gauss(mu=fishmove.rx("fit",'sigma_mob',1,1,SO,1)[0],
+                sigma=(fishmove.rx("upr",'sigma_mob',1,1,SO,1)[0]-fishmove.rx("lwr",'sigma_mob',1,1,SO,1)[0])/4)
+    else:
+        sigma_stat = fishmove.rx(i,'sigma_stat',1,1,SO,1)[0]
+        sigma_mob = fishmove.rx(i,'sigma_mob',1,1,SO,1)[0]
+
+    # Getting maximum distance (cutting distance) based on truncation criterion
+    def func(x,sigma_stat,sigma_mob,m,truncation,p):
+        return p * stats.norm.cdf(x, loc=m, scale=sigma_stat) + (1-p) * stats.norm.cdf(x, loc=m, scale=sigma_mob) - truncation
+    if options['truncation'] == "inf":
+        max_dist = 0
+    else:
+        truncation = float(options['truncation'])
+        max_dist = int(optimize.newton(func, 1., args=(sigma_stat,sigma_mob,m,truncation,p)))
+
+    return float(sigma_stat), float(sigma_mob), max_dist
+
+
+def river_network(river, flow_direction, shreve, res, habitat_attract=None):
+    """Build the river network as a directed graph of cells
+
+    Every river cell is a vertex with an edge to the cell it drains to
+    (r.watershed drainage direction). The vertices are numbered in
+    preorder from the outlets, so the cells upstream of vertex v (its
+    r.stream.basins) are the vertices v to v+size[v]-1.
+
+    Returns the graph and the vertex of every cell of the region (-1
+    outside the network)
+    """
+    import numpy
+
+    def read(name):
+        array = garray.array()
+        array.read(name)
+        return numpy.asarray(array)
+
+    cells = numpy.flatnonzero(read(river) > 0)
+    rows, cols = garray.array().shape
+    vertex = numpy.full(rows * cols, -1, dtype=numpy.int64)
+    vertex[cells] = numpy.arange(len(cells))
+
+    # Drainage directions: 1 = NE, 2 = N, ... 8 = E, counterclockwise.
+    # Negative directions drain out of the region.
+    direction = read(flow_direction).ravel()[cells].astype(numpy.int64)
+    drow = numpy.array([0, -1, -1, -1, 0, 1, 1, 1, 0])
+    dcol = numpy.array([0, 1, 0, -1, -1, -1, 0, 1, 1])
+    valid = (direction > 0) & (direction <= 8)
+    to_row = cells // cols + drow[numpy.where(valid, direction, 0)]
+    to_col = cells % cols + dcol[numpy.where(valid, direction, 0)]
+    valid &= (to_row >= 0) & (to_row < rows) & (to_col >= 0) & (to_col < cols)
+    down = numpy.full(len(cells), -1, dtype=numpy.int64)
+    down[valid] = vertex[to_row[valid] * cols + to_col[valid]]
+
+    # Flow length through a cell (orthogonal or diagonal) which is also
+    # the distance to the cell it drains to
+    step = numpy.where((direction != 0) & (direction % 2 == 0),
+                       float(res), math.sqrt(2) * res)
+
+    # Preorder from the outlets (cells in flow loops are left out)
+    order = numpy.argsort(down, kind='mergesort')
+    n_outlets = numpy.count_nonzero(down < 0)
+    children = order[n_outlets:]
+    first = numpy.concatenate(([0], numpy.cumsum(
+        numpy.bincount(down[children], minlength=len(cells)))))
+    preorder = []
+    stack = list(order[:n_outlets])
+    while stack:
+        v = stack.pop()
+        preorder.append(v)
+        stack.extend(children[first[v]:first[v + 1]])
+    preorder = numpy.array(preorder, dtype=numpy.int64)
+
+    rank = numpy.full(len(cells), -1, dtype=numpy.int64)
+    rank[preorder] = numpy.arange(len(preorder))
+    vertex[cells] = rank
+    down = down[preorder]
+    down[down >= 0] = rank[down[down >= 0]]
+    step = step[preorder]
+
+    # Flow distance to the outlet and number of cells upstream (incl. self)
+    distance = numpy.zeros(len(preorder))
+    for v in range(len(preorder)):
+        if down[v] >= 0:
+            distance[v] = distance[down[v]] + step[v]
+    size = numpy.ones(len(preorder), dtype=numpy.int64)
+    for v in range(len(preorder) - 1, 0, -1):
+        if down[v] >= 0:
+            size[down[v]] += size[v]
+
+    graph = {'cells': cells[preorder],
+             'down': down,
+             'size': size,
+             'distance': distance,
+             'step': step,
+             'shreve': read(shreve).ravel()[cells[preorder]].astype(float)}
+    if habitat_attract:
+        graph['habitat_attract'] = \
+            read(habitat_attract).ravel()[cells[preorder]].astype(float)
+
+    return graph, vertex
+
+
+def barrier_neighbourhoods(graph, barriers, barrier_effect):
+    """Get the cells within barrier_effect of each barrier that are not
+    upstream of it, and their inverse distance weights for relocating
+    the density hold back by the barrier"""
+    import numpy
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra
+
+    down = graph['down']
+    size = graph['size']
+    n_vertices = len(down)
+    child = numpy.flatnonzero(down >= 0)
+    adjacency = csr_matrix((graph['step'][child], (child, down[child])),
+                           shape=(n_vertices, n_vertices))
+
+    neighbourhoods = []
+    for vertex, passability in barriers:
+        distance = dijkstra(adjacency, directed=False, indices=vertex,
+                            limit=barrier_effect)
+        near = numpy.flatnonzero(numpy.isfinite(distance))
+        near = near[(near < vertex) | (near >= vertex + size[vertex])]
+        inverse = 1.0 / distance[near]
+        neighbourhoods.append((vertex, passability, near,
+                               inverse / inverse.sum()))
+    return neighbourhoods
+
+
+def dispersal(source):
+    """Disperse one source population on the river network graph
+
+    The kernel is evaluated for the cells upstream the source population
+    (split at confluences by the inverse Shreve order) and for the cells
+    it drains to. Barriers upstream the source hold back the share
+    (1-passability) of the density above them and relocate it to the
+    cells below them. Returns the vertices reached, their densities and
+    the realised fish counts (if n_fish is given).
+    """
+    import numpy
+    from scipy import stats
+
+    vertex, prob_scalar, sigma_stat, sigma_mob, p, max_dist, n_fish, seed = source
+    down = network['down']
+    size = network['size']
+    distance = network['distance']
+
+    upstream = numpy.arange(vertex, vertex + size[vertex])
+    downstream = []
+    v = down[vertex]
+    while v >= 0 and (not max_dist or distance[vertex] - distance[v] <= max_dist):
+        downstream.append(v)
+        v = down[v]
+    downstream = numpy.array(downstream, dtype=numpy.int64)
+
+    # Upstream split at network nodes based on inverse shreve stream order
+    division = network['shreve'][upstream] / (network['shreve'][upstream].max() or 1.0)
+    division[0] = 1.0
+    dist = distance[upstream] - distance[vertex]
+    if max_dist:
+        division = division[dist <= max_dist]
+        upstream = upstream[dist <= max_dist]
+        dist = dist[dist <= max_dist]
+
+    vertices = numpy.concatenate((upstream, downstream))
+    dist = numpy.concatenate((dist, distance[vertex] - distance[downstream]))
+    division = numpy.concatenate((division, numpy.ones(len(downstream))))
+
+    # leptokurtic probability density kernel based on fishmove (m=0),
+    # integrated between the lower and upper cell boundaries
+    def cdf(x):
+        return (p * stats.norm.cdf(x, scale=sigma_stat) + (1-p) * stats.norm.cdf(x, scale=sigma_mob)) * prob_scalar
+    half = network['step'][vertices] / 2.0
+    density = (cdf(dist + half) - cdf(dist - half)) * division
+
+    # Barriers upstream the source, from the most downstream one
+    barriers = [b for b in network.get('barriers', [])
+                if vertex < b[0] < vertex + size[vertex] and
+                (not max_dist or distance[b[0]] - distance[vertex] <= max_dist)]
+    if barriers:
+        full = numpy.zeros(len(down))
+        full[vertices] = density
+        for barrier, passability, near, weights in sorted(
+                barriers, key=lambda b: distance[b[0]]):
+            basin = slice(barrier, barrier + size[barrier])
+            upstream_density = full[basin].sum()
+            if upstream_density == 0:
+                continue
+            full[basin] *= passability
+            full[near] += upstream_density * (1 - passability) * weights
+        vertices = numpy.flatnonzero(full)
+        density = full[vertices]
+
+    if 'habitat_attract' in network:
+        # Weight density with attractiveness relative to the source habitat
+        attract = network['habitat_attract']
+        density = density * attract[vertices] / attract[vertex]
+
+    realised = None
+    if n_fish is not None and density.sum() > 0:
+        # Multinomial backtransformation from probability into fish counts
+        realised = numpy.random.RandomState(seed).multinomial(
+            n_fish, density / density.sum())
+
+    return vertices, density, realised
+
+
 def main():
 
     # lazy import required numpy and scipy modules
     import numpy
     from scipy import stats
-    from scipy import optimize
 
     ############ DEFINITION CLEANUP TEMPORARY FILES ##############
     #global variables for cleanup
@@ -694,6 +945,93 @@ def main():
         nrun = ['fit','lwr','upr']
 
 
+    ########### Graph engine: all source points on the river network graph ##########
+    if options['engine'] == "graph":
+        grass.message(_("Building river network graph"))
+        graph, vertex = river_network("river_raster_tmp_%d" % os.getpid(),
+                                      "flow_direction_tmp_%d" % os.getpid(),
+                                      "shreve_tmp_%d" % os.getpid(),
+                                      res,
+                                      habitat_attract=options['habitat_attract'])
+        region = grass.region()
+
+        def cell_vertex(X, Y):
+            row = int((region['n'] - Y) / region['nsres'])
+            col = int((X - region['w']) / region['ewres'])
+            if 0 <= row < region['rows'] and 0 <= col < region['cols']:
+                return vertex[row * region['cols'] + col]
+            return -1
+
+        if options['barriers']:
+            # barrier_effect = Length of Effect of barriers (linear decrease up to max (barrier_effect)
+            barrier_effect=200 #units as in mapset (m)
+            barriers = []
+            barriers_list = grass.read_command("db.select", flags="c", sql= "SELECT cat, adj_X, adj_Y, %s FROM barriers_%d" % (passability_col,os.getpid())).split("\n")[:-1] # remove last (empty line)
+            for l in csv.reader(barriers_list,delimiter="|"):
+                barrier_vertex = cell_vertex(float(l[1]), float(l[2]))
+                if barrier_vertex < 0:
+                    grass.warning(_("Barrier "+l[0]+" is not on the river network and will be ignored"))
+                    continue
+                barriers.append((barrier_vertex, float(l[3])))
+            graph['barriers'] = barrier_neighbourhoods(graph, barriers, barrier_effect)
+
+        source_points_list = grass.read_command("db.select", flags="c", sql= "SELECT cat, X, Y, n_fish, prob_scalar, Strahler, p FROM source_points_%d" % os.getpid()).split("\n")[:-1] # remove last (empty line)
+        source_points_list = list(csv.reader(source_points_list,delimiter="|"))
+
+        nprocs = max(int(options['nprocs']), 1)
+        pool = Pool(nprocs, initializer=init_worker, initargs=(graph,))
+
+        for i in nrun:
+            sources = []
+            for k in source_points_list:
+                source_vertex = cell_vertex(float(k[1]), float(k[2]))
+                if source_vertex < 0:
+                    grass.warning(_("Source point "+k[0]+" is not on the river network and will be ignored"))
+                    continue
+                if options['habitat_attract'] and not graph['habitat_attract'][source_vertex] > 0:
+                    grass.fatal(_("No habitat attractiveness at source point "+k[0]))
+                p = float(k[6])
+                sigma_stat, sigma_mob, max_dist = dispersal_parameters(fishmove, i, int(k[5]), p)
+                n_fish = int(k[3]) if flags['r'] else None
+                seed = int(options['seed2']) if options['seed2'] else None
+                sources.append((source_vertex, float(k[4]), sigma_stat, sigma_mob, p, max_dist, n_fish, seed))
+
+            grass.message(_("Dispersal from "+str(len(sources))+" source points ("+i+")"))
+            density_final = numpy.zeros(len(graph['down']))
+            realised_density_final = numpy.zeros(len(graph['down']))
+            for counter, (vertices, density, realised) in enumerate(
+                    pool.imap_unordered(dispersal, sources,
+                                        max(len(sources) // (4 * nprocs), 1))):
+                density_final[vertices] += density
+                if realised is not None:
+                    realised_density_final[vertices] += realised
+                grass.percent(counter + 1, len(sources), 5)
+
+            # backtransformation (divide by scalar which was defined before)
+            Density = garray.array()
+            Density.flat[graph['cells']] = density_final / scalar
+            Density.write(output_fidimo+"_"+i, overwrite=True)
+            # Set all 0-values to NULL, Backgroundvalues
+            grass.run_command("r.null", map=output_fidimo+"_"+i, setnull="0")
+
+            if flags['r']:
+                RealisedDensity = garray.array()
+                RealisedDensity.flat[graph['cells']] = realised_density_final
+                RealisedDensity.write("realised_"+output_fidimo+"_"+i, overwrite=True)
+                grass.run_command("r.null", map="realised_"+output_fidimo+"_"+i, setnull="0")
+
+        pool.close()
+        pool.join()
+
+        # Delete basic maps if flag "b" is set
+        if flags['b']:
+            grass.run_command("g.remove", flags = 'bf', type = 'vector', name = output_fidimo + "_source_points")
+            if options['barriers']:
+                grass.run_command("g.remove", flags = 'bf', type = 'vector', name = output_fidimo + "_barriers")
+
+        return 0
+
+
     for i in nrun:
         database = sqlite3.connect(os.path.join(gisdbase, location, mapset, 'sqlite.db'))
         #update database-connection
@@ -750,35 +1088,12 @@ def main():
                 grass.debug(_("Source point coors:"+coors+" in segment nr: " +str(segment_cat)))
 
                 #Select dispersal parameters
-                SO = 'SO='+str(Strahler)
                 grass.debug(_("This is i:"+str(i)))
-                grass.debug(_("This is "+str(SO)))
-
-                #if Random Value within Confidence Interval than select a sigma value that is within the CI assuming a normal distribution of sigma within the CI
-                if str(options['statistical_interval']) == "Random Value within Confidence Interval":
-                    random.seed(int(options['seed1']))
-                    sigma_stat = random.gauss(mu=fishmove.rx("fit",'sigma_stat',1,1,SO,1)[0],
-                            sigma=(fishmove.rx("upr",'sigma_stat',1,1,SO,1)[0]-fishmove.rx("lwr",'sigma_stat',1,1,SO,1)[0])/4)
-                    random.seed(int(options['seed1']))
-                    sigma_mob = random.gauss(mu=fishmove.rx("fit",'sigma_mob',1,1,SO,1)[0],
-                            sigma=(fishmove.rx("upr",'sigma_mob',1,1,SO,1)[0]-fishmove.rx("lwr",'sigma_mob',1,1,SO,1)[0])/4)
-                else:
-                    sigma_stat = fishmove.rx(i,'sigma_stat',1,1,SO,1)
-                    sigma_mob = fishmove.rx(i,'sigma_mob',1,1,SO,1)
-
-
+                grass.debug(_("This is SO="+str(Strahler)))
+                sigma_stat, sigma_mob, max_dist = dispersal_parameters(fishmove, i, Strahler, p)
 
                 grass.debug(_("Dispersal parameters: prob_scalar="+str(prob_scalar)+", sigma_stat="+str(sigma_stat)+", sigma_mob="+str(sigma_mob)+", p="+str(p)))
 
-                # Getting maximum distance (cutting distance) based on truncation criterion
-                def func(x,sigma_stat,sigma_mob,m,truncation,p):
-                    return p * stats.norm.cdf(x, loc=m, scale=sigma_stat) + (1-p) * stats.norm.cdf(x, loc=m, scale=sigma_mob) - truncation
-                if options['truncation'] == "inf":
-                    max_dist = 0
-                else:
-                    truncation = float(options['truncation'])
-                    max_dist = int(optimize.zeros.newton(func, 1., args=(sigma_stat,sigma_mob,m,truncation,p)))
-
 
                 grass.debug(_("Distance from each source point is calculated up to a treshold of: "+str(max_dist)))
 
@@ -34,6 +34,12 @@
 #% description: r.futures.pga runs for each subregion and after all subregions are completed, the results are patched together
 #% guisection: Parallel
 #%end
+#%flag
+#% key: r
+#% label: Resume previously interrupted computation
+#% description: Simulations and patched repeats completed in a previous run with the same output name are skipped
+#% guisection: Parallel
+#%end
 #%option
 #% key: nprocs
 #% type: integer
@@ -283,7 +289,8 @@ def futures_process(params):
             gscript.message(_("Running simulation {s}/{r}".format(s=seed, r=repeat)))
             gscript.run_command('r.futures.pga', **options)
     except (KeyboardInterrupt, CalledModuleError):
-        return
+        return seed, cat, False
+    return seed, cat, True
 
 
 def split_subregions(expr):
@@ -293,11 +300,52 @@ def split_subregions(expr):
         return
 
 
+class Checkpoint(object):
+    """Records completed simulations and patched repeats in a file in the
+    current mapset, so that an interrupted computation can be resumed"""
+
+    def __init__(self, output, resume):
+        env = gscript.gisenv()
+        self.path = os.path.join(env['GISDBASE'], env['LOCATION_NAME'], env['MAPSET'],
+                                 '.{prefix}_{output}.checkpoint'.format(prefix=PREFIX, output=output))
+        self.completed = set()
+        self.patched = set()
+        if resume and os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    items = line.split()
+                    if not items:
+                        continue
+                    if items[0] == 'patched':
+                        self.patched.add(int(items[1]))
+                    else:
+                        self.completed.add((int(items[0]), items[1] if len(items) > 1 else None))
+        self.file = open(self.path, 'a' if resume else 'w')
+
+    def is_completed(self, seed, cat):
+        return (seed, cat) in self.completed or seed in self.patched
+
+    def add_completed(self, seed, cat):
+        self.completed.add((seed, cat))
+        self.file.write('{s} {c}\n'.format(s=seed, c=cat) if cat else '{s}\n'.format(s=seed))
+        self.file.flush()
+
+    def add_patched(self, seed):
+        self.patched.add(seed)
+        self.file.write('patched {s}\n'.format(s=seed))
+        self.file.flush()
+
+    def remove(self):
+        self.file.close()
+        os.remove(self.path)
+
+
 def main():
     repeat = int(options.pop('repeat'))
     nprocs = int(options.pop('nprocs'))
     subregions = options['subregions']
     tosplit = flags['d']
+    resume = flags['r']
     # filter unused optional params
     for key in list(options.keys()):
         if options[key] == '':
@@ -305,14 +353,20 @@ def main():
     if tosplit and 'output_series' in options:
         gscript.fatal(_("Parallelization on subregion level is not supported together with <output_series> option"))
 
-    if not gscript.overwrite() and gscript.list_grouped('raster', pattern=options['output'] + '_run1')[gscript.gisenv()['MAPSET']]:
+    if not resume and not gscript.overwrite() and gscript.list_grouped('raster', pattern=options['output'] + '_run1')[gscript.gisenv()['MAPSET']]:
         gscript.fatal(_("Raster map <{r}> already exists."
                      " To overwrite, use the --overwrite flag").format(r=options['output'] + '_run_1'))
+    checkpoint = Checkpoint(options['output'], resume)
     global TMP_RASTERS
     cats = []
+    cells = {}
     if tosplit:
         gscript.message(_("Splitting subregions"))
-        cats = gscript.read_command('r.stats', flags='n', input=subregions).strip().splitlines()
+        for line in gscript.read_command('r.stats', flags='nc', input=subregions).strip().splitlines():
+            cat, count = line.split()
+            cells[cat] = int(count)
+        # largest subregions first, so that they do not become stragglers
+        cats = sorted(cells, key=lambda cat: cells[cat], reverse=True)
         if len(cats) < 2:
             gscript.fatal(_("Not enough subregions to split computation. Do not use -d flag."))
         mapcalcs = []
@@ -327,40 +381,92 @@ def main():
         except (KeyboardInterrupt, CalledModuleError):
             return
 
+    # jobs are ordered by repeat and, within each repeat, largest subregion
+    # first; idle processes take the next job from the queue, so that
+    # repeats are completed one after another and can be patched while
+    # the remaining simulations are still running
     options_list = []
+    remaining = {}
     for i in range(repeat):
+        seed = i + 1
+        if seed in checkpoint.patched:
+            continue
         if cats:
+            remaining[seed] = set()
             for cat in cats:
+                if checkpoint.is_completed(seed, cat):
+                    continue
                 op = options.copy()
-                op['random_seed'] = i + 1
-                if 'output_series' in op:
-                    op['output_series'] += '_run' + str(i + 1) + '_' + cat
-                    TMP_RASTERS.append(op['output_series'])
-                op['output'] += '_run' + str(i + 1) + '_' + cat
+                op['random_seed'] = seed
+                op['output'] += '_run' + str(seed) + '_' + cat
                 op['subregions'] = PREFIX + cat
-                options_list.append((repeat, i + 1, cat, op))
-                TMP_RASTERS.append(op['output'])
+                options_list.append((repeat, seed, cat, op))
+                remaining[seed].add(cat)
         else:
+            if checkpoint.is_completed(seed, None):
+                continue
             op = options.copy()
-            op['random_seed'] = i + 1
+            op['random_seed'] = seed
             if 'output_series' in op:
-                op['output_series'] += '_run' + str(i + 1)
-            op['output'] += '_run' + str(i + 1)
-            options_list.append((repeat, i + 1, None, op))
+                op['output_series'] += '_run' + str(seed)
+            op['output'] += '_run' + str(seed)
+            options_list.append((repeat, seed, None, op))
+
+    skipped = repeat * max(len(cats), 1) - len(options_list)
+    if skipped:
+        gscript.message(_("Skipping {n} simulations completed in a previous run").format(n=skipped))
+
+    patches = []
+
+    def patch(seed):
+        gscript.message(_("Patching subregions of repeat {s}").format(s=seed))
+        patch_input = [options['output'] + '_run' + str(seed) + '_' + cat for cat in cats]
+        patch_output = options['output'] + '_run' + str(seed)
+        process = gscript.start_command('r.patch', input=patch_input, output=patch_output,
+                                        overwrite=True, quiet=True)
+        patches.append((seed, patch_input, process))
 
+    def finish_patches(wait):
+        for item in list(patches):
+            seed, patch_input, process = item
+            if not wait and process.poll() is None:
+                continue
+            if process.wait() != 0:
+                gscript.fatal(_("Patching of repeat {s} failed").format(s=seed))
+            checkpoint.add_patched(seed)
+            gscript.run_command('g.remove', type='raster', name=patch_input, flags='f', quiet=True)
+            patches.remove(item)
+
+    # repeats completed in a previous run which were not patched yet
+    for seed in sorted(remaining):
+        if not remaining[seed]:
+            patch(seed)
+
+    failed = []
     pool = Pool(nprocs)
-    p = pool.map_async(futures_process, options_list)
     try:
-        p.get()
-    except (KeyboardInterrupt, CalledModuleError):
-        return
+        for done, (seed, cat, success) in enumerate(pool.imap_unordered(futures_process, options_list, chunksize=1)):
+            gscript.percent(done + 1, len(options_list), 1)
+            if not success:
+                failed.append((seed, cat))
+                continue
+            checkpoint.add_completed(seed, cat)
+            if cat:
+                remaining[seed].discard(cat)
+                if not remaining[seed]:
+                    patch(seed)
+            finish_patches(wait=False)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        return 1
+    pool.join()
+    finish_patches(wait=True)
 
-    if cats:
-        gscript.message(_("Patching subregions"))
-        for i in range(repeat):
-            patch_input = [options['output'] + '_run' + str(i + 1) + '_' + cat for cat in cats]
-            gscript.run_command('r.patch', input=patch_input, output=options['output'] + '_run' + str(i + 1))
+    if failed:
+        gscript.fatal(_("{n} simulations failed, rerun with the -r flag to compute only the missing ones").format(n=len(failed)))
 
+    checkpoint.remove()
     return 0
 
 if __name__ == "__main__":
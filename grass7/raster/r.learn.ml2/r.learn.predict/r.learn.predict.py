@@ -68,6 +68,15 @@
 #% guisection: Optional
 #%end
 
+#%option
+#% key: workers
+#% type: integer
+#% label: Number of processes used for prediction
+#% description: Number of worker processes that apply the estimator to blocks of rows in parallel while rows are read and written by the main process
+#% answer: 1
+#% guisection: Optional
+#%end
+
 
 import sys
 import grass.script as gs
@@ -112,6 +121,10 @@ def main():
     probability = flags["p"]
     prob_only = flags["z"]
     chunksize = int(options["chunksize"])
+    workers = int(options["workers"])
+
+    if workers < 1:
+        gs.fatal("Number of workers must be at least 1")
 
     # remove @ from output in case overwriting result
     if "@" in output:
@@ -131,9 +144,13 @@ def main():
     region = Region()
     row_incr = math.ceil(chunksize / region.cols)
 
-    # do not read by increments if increment > n_rows
+    # do not read by increments if increment > n_rows, unless the blocks
+    # of rows are distributed to several workers
     if row_incr >= region.rows:
-        row_incr = None
+        if workers > 1:
+            row_incr = math.ceil(region.rows / workers)
+        else:
+            row_incr = None
 
     # prediction
     if prob_only is False:
@@ -143,6 +160,7 @@ def main():
             output=output,
             height=row_incr,
             overwrite=gs.overwrite(),
+            workers=workers,
         )
 
     if probability is True:
@@ -153,6 +171,7 @@ def main():
             class_labels=np.unique(y),
             overwrite=gs.overwrite(),
             height=row_incr,
+            workers=workers,
         )
 
     # assign categories for classification map
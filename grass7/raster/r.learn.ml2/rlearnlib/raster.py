@@ -3,6 +3,9 @@ import os
 from subprocess import PIPE
 from copy import deepcopy
 import re
+import ctypes
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 import grass.script as gs
 import numpy as np
@@ -10,16 +13,75 @@ import pandas as pd
 from grass.pygrass.gis.region import Region
 from grass.pygrass.modules.shortcuts import imagery as im
 from grass.pygrass.modules.shortcuts import raster as r
-from grass.pygrass.modules.shortcuts import vector as v
 from grass.pygrass.modules.shortcuts import general as g
 from grass.pygrass.raster import RasterRow, numpy2raster
 from grass.pygrass.raster.buffer import Buffer
 from grass.pygrass.utils import get_mapset_raster
 from grass.pygrass.vector import VectorTopo
+import grass.lib.raster as libraster
 from indexing import _LocIndexer, _ILocIndexer
 from stats import StatisticsMixin
 from transformers import CategoryEncoder
 
+# numpy dtypes and GRASS GIS raster types that correspond to each map type
+_GRASS_DTYPES = {"CELL": np.int32, "FCELL": np.float32, "DCELL": np.float64}
+_GRASS_RTYPES = {
+    np.dtype(np.int32): libraster.CELL_TYPE,
+    np.dtype(np.float32): libraster.FCELL_TYPE,
+    np.dtype(np.float64): libraster.DCELL_TYPE,
+}
+
+
+def read_block(src, row_start, row_stop, out):
+    """Read a block of rows from an open RasterRow directly into an array
+
+    The rows are decoded by libraster straight into the memory of `out`
+    without creating intermediate Buffer objects. Values are converted to the
+    GRASS GIS raster type that corresponds to the dtype of `out`, i.e. null
+    cells are returned as -2147483648 for int32 arrays and NaN otherwise.
+
+    Parameters
+    ----------
+    src : grass.pygrass.raster.RasterRow
+        RasterRow that is open for reading.
+
+    row_start, row_stop : int
+        Start and end (exclusive) row indexes of the block.
+
+    out : numpy.ndarray
+        C-contiguous 2d array of shape (row_stop - row_start, region.cols)
+        and dtype int32, float32 or float64 to receive the data.
+
+    Returns
+    -------
+    numpy.ndarray
+        The `out` array.
+    """
+    rtype = _GRASS_RTYPES[out.dtype]
+
+    for i, row in enumerate(range(row_start, row_stop)):
+        libraster.Rast_get_row(
+            src._fd, out[i, :].ctypes.data_as(ctypes.c_void_p), row, rtype
+        )
+
+    return out
+
+
+# estimator that is shared with the prediction worker processes
+_worker_estimator = None
+
+
+def _init_predict_worker(estimator):
+    """Initializer for prediction worker processes that stores the estimator
+    once per process rather than pickling it with every window"""
+    global _worker_estimator
+    _worker_estimator = estimator
+
+
+def _predict_worker(func, img):
+    """Apply a prediction function to a window of data within a worker"""
+    return func(img, _worker_estimator)
+
 
 class RasterStack(StatisticsMixin):
     def __init__(self, rasters=None, group=None):
@@ -304,6 +366,24 @@ class RasterStack(StatisticsMixin):
 
             return new_raster
     
+    @property
+    def dtype(self):
+        """Return the numpy dtype that is able to hold the values of all of
+        the rasters in the RasterStack without loss of precision
+        
+        Notes
+        -----
+        A RasterStack composed entirely of CELL maps is represented using
+        int32, entirely of FCELL maps using float32, and any other combination
+        of map types is promoted to float64.
+        """
+        dtypes = [_GRASS_DTYPES[mtype] for mtype in self.mtypes.values()]
+
+        if len(dtypes) == 0:
+            return np.dtype(np.float64)
+
+        return np.result_type(*dtypes)
+
     def read(self, row=None, rows=None):
         """Read data from RasterStack as a masked 3D numpy array
         
@@ -319,6 +399,11 @@ class RasterStack(StatisticsMixin):
         If no additional arguments are supplied, then all of the maps within the RasterStack are
         read into a 3d numpy array (obeying the GRASS region settings)
 
+        The array is allocated using the native GRASS GIS data type of the
+        rasters within the stack (see the `dtype` property) and each band is
+        read as a single block of rows directly into the array. The nodata
+        mask is built in a single pass over the data.
+
         Parameters
         ----------
         row : int (opt)
@@ -337,43 +422,33 @@ class RasterStack(StatisticsMixin):
 
         reg = Region()
 
-        # create numpy array to receive data
-        if rows:
+        # determine the block of rows to read
+        if rows is not None:
             row_start, row_stop = rows
-            width = reg.cols
-            height = abs(row_stop - row_start)
-            shape = (self.count, height, width)
-            rowincrs = [i for i in range(row_start, row_stop)]
-        elif row:
-            row_start = row
-            row_stop = row + 1
-            height = 1
-            shape = (self.count, height, reg.cols)
-            rowincrs = [i for i in range(row_start, row_stop)]
+        elif row is not None:
+            row_start, row_stop = row, row + 1
         else:
-            shape = (self.count, reg.rows, reg.cols)
+            row_start, row_stop = 0, reg.rows
+
+        height = abs(row_stop - row_start)
+        shape = (self.count, height, reg.cols)
 
-        data = np.zeros(shape)
+        # create numpy arrays to receive data and mask
+        dtype = self.dtype
+        data = np.empty(shape, dtype=dtype)
+        mask = np.empty(shape, dtype="bool")
 
         # read from each RasterRow object
         for band, (name, src) in enumerate(self.layers.items()):
             with RasterRow(src.fullname()) as f:
-                if row or rows:
-                    for i, row in enumerate(rowincrs):
-                        data[band, i, :] = f[row]
-                else:
-                    data[band, :, :] = np.asarray(f)
-
-        # mask array
-        data = np.ma.masked_equal(data, self._cell_nodata)
-        data = np.ma.masked_invalid(data)
+                read_block(f, row_start, row_stop, out=data[band, :, :])
 
-        if isinstance(data.mask, np.bool_):
-            mask_arr = np.empty(data.shape, dtype="bool")
-            mask_arr[:] = False
-            data.mask = mask_arr
+            if np.issubdtype(dtype, np.integer):
+                np.equal(data[band, :, :], self._cell_nodata, out=mask[band, :, :])
+            else:
+                np.isnan(data[band, :, :], out=mask[band, :, :])
 
-        return data
+        return np.ma.masked_array(data, mask=mask, copy=False)
 
     @staticmethod
     def _pred_fun(img, estimator):
@@ -516,7 +591,7 @@ class RasterStack(StatisticsMixin):
 
         return result
 
-    def predict(self, estimator, output, height=None, overwrite=False):
+    def predict(self, estimator, output, height=None, overwrite=False, workers=1):
         """Prediction method for RasterStack class
 
         Parameters
@@ -533,6 +608,10 @@ class RasterStack(StatisticsMixin):
             
         overwrite : bool (opt). Default is False
             Option to overwrite an existing raster.
+
+        workers : int (opt). Default is 1
+            Number of processes used to apply the estimator to windows of
+            rows in parallel. Only used when `height` is specified.
         
         Returns
         -------
@@ -543,7 +622,7 @@ class RasterStack(StatisticsMixin):
         func = self._pred_fun
 
         # determine dtype
-        test_window = list(self.row_windows(height=1))[0]
+        test_window = next(self.row_windows(height=1))
         img = self.read(rows=test_window)
         result = func(img, estimator)
 
@@ -571,7 +650,8 @@ class RasterStack(StatisticsMixin):
 
         if len(indexes) > 1:
             result_stack = self._predict_multi(
-                estimator, reg, indexes, indexes, height, func, output, overwrite
+                estimator, reg, indexes, indexes, height, func, output, overwrite,
+                workers
             )
         else:
             if height is not None:
@@ -580,20 +660,15 @@ class RasterStack(StatisticsMixin):
                     output, mode="w", mtype=mtype, overwrite=overwrite
                 ) as dst:
                     n_windows = len([i for i in self.row_windows(height=height)])
+                    data_gen = self._predict_windows(estimator, func, height, workers)
+                    newrow = Buffer((reg.cols,), mtype=mtype)
 
-                    data_gen = (
-                        (wi, self.read(rows=rows))
-                        for wi, rows in enumerate(self.row_windows(height=height))
-                    )
-
-                    for wi, arr in data_gen:
+                    for wi, result in data_gen:
                         gs.percent(wi, n_windows, 1)
-                        result = func(arr, estimator)
                         result = np.ma.filled(result, nodata)
 
                         # writing data to GRASS raster row-by-row
                         for i in range(result.shape[1]):
-                            newrow = Buffer((reg.cols,), mtype=mtype)
                             newrow[:] = result[0, i, :]
                             dst.put_row(newrow)
 
@@ -609,7 +684,10 @@ class RasterStack(StatisticsMixin):
 
         return result_stack
 
-    def predict_proba(self, estimator, output, class_labels=None, height=None, overwrite=False):
+    def predict_proba(
+        self, estimator, output, class_labels=None, height=None, overwrite=False,
+        workers=1
+    ):
         """Prediction method for RasterStack class
 
         Parameters
@@ -631,6 +709,10 @@ class RasterStack(StatisticsMixin):
             
         overwrite : bool (opt). Default is False
             Option to overwrite an existing raster(s)
+
+        workers : int (opt). Default is 1
+            Number of processes used to apply the estimator to windows of
+            rows in parallel. Only used when `height` is specified.
         
         Returns
         -------
@@ -641,7 +723,7 @@ class RasterStack(StatisticsMixin):
 
         # use class labels if supplied else output preds as 0,1,2...n
         if class_labels is None:
-            test_window = list(self.row_windows(height=1))[0]
+            test_window = next(self.row_windows(height=1))
             img = self.read(rows=test_window)
             result = func(img, estimator)
             class_labels = range(result.shape[0])
@@ -654,41 +736,42 @@ class RasterStack(StatisticsMixin):
 
         # create and open rasters for writing
         result_stack = self._predict_multi(
-            estimator, reg, indexes, class_labels, height, func, output, overwrite
+            estimator, reg, indexes, class_labels, height, func, output, overwrite,
+            workers
         )
 
         return result_stack
 
-    def _predict_multi(self, estimator, region, indexes, class_labels, height, func, output, overwrite):
+    def _predict_multi(
+        self, estimator, region, indexes, class_labels, height, func, output,
+        overwrite, workers=1
+    ):
+        rasternames = [output + "_" + str(label) for label in class_labels]
+
         # create and open rasters for writing if incremental reading
         if height is not None:
             dst = []
 
-            for i, label in enumerate(class_labels):
-                rastername = output + "_" + str(label)
+            for i, rastername in enumerate(rasternames):
                 dst.append(RasterRow(rastername))
                 dst[i].open("w", mtype="FCELL", overwrite=overwrite)
 
-            # create data reader generator
+            # create prediction generator
             n_windows = len([i for i in self.row_windows(height=height)])
-
-            data_gen = (
-                (wi, self.read(rows=rows))
-                for wi, rows in enumerate(self.row_windows(height=height))
-            )
+            data_gen = self._predict_windows(estimator, func, height, workers)
 
         # perform prediction
         try:
             if height is not None:
-                for wi, arr in data_gen:
+                newrow = Buffer((region.cols,), mtype="FCELL")
+
+                for wi, result in data_gen:
                     gs.percent(wi, n_windows, 1)
-                    result = func(arr, estimator)
                     result = np.ma.filled(result, np.nan)
 
                     # write multiple features to GRASS GIS rasters
                     for i, arr_index in enumerate(indexes):
                         for row in range(result.shape[1]):
-                            newrow = Buffer((region.cols,), mtype="FCELL")
                             newrow[:] = result[arr_index, row, :]
                             dst[i].put_row(newrow)
             else:
@@ -700,7 +783,7 @@ class RasterStack(StatisticsMixin):
                     numpy2raster(
                         result[arr_index, :, :],
                         mtype="FCELL",
-                        rastname=rastername[i],
+                        rastname=rasternames[i],
                         overwrite=overwrite,
                     )
         except:
@@ -711,7 +794,63 @@ class RasterStack(StatisticsMixin):
                 for i in dst:
                     i.close()
         
-        return RasterStack([i.name for i in dst])
+        return RasterStack(rasternames)
+
+    def _predict_windows(self, estimator, func, height, workers=1):
+        """Generator of prediction results for each window of rows
+
+        Notes
+        -----
+        If `workers` is larger than one then the prediction is pipelined: the
+        calling process reads windows of rows ahead of time while a pool of
+        worker processes applies the estimator to them. At most 2 * `workers`
+        windows are held in memory at any time, and the results are always
+        yielded in row order so that they can be streamed to a RasterRow
+        opened for writing.
+
+        Parameters
+        ----------
+        estimator : estimator object implementing 'fit'
+            The object to use to fit the data.
+
+        func : function
+            Prediction function, e.g. `_pred_fun` or `_prob_fun`.
+
+        height : int
+            Height of window in number of image rows.
+
+        workers : int (opt). Default is 1
+            Number of worker processes.
+
+        Yields
+        ------
+        tuple
+            Index of the window and the masked 3d prediction result.
+        """
+        windows = self.row_windows(height=height)
+
+        if workers is None or workers <= 1:
+            for wi, rows in enumerate(windows):
+                yield wi, func(self.read(rows=rows), estimator)
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_predict_worker,
+            initargs=(estimator,),
+        ) as executor:
+            pending = deque()
+
+            for wi, rows in enumerate(windows):
+                pending.append(executor.submit(_predict_worker, func, self.read(rows=rows)))
+
+                if len(pending) >= 2 * workers:
+                    yield wi - len(pending) + 1, pending.popleft().result()
+
+            n_windows = wi + 1
+
+            while pending:
+                yield n_windows - len(pending), pending.popleft().result()
 
     def row_windows(self, region=None, height=25):
         """Returns an generator for row increments, tuple (startrow, endrow)
@@ -735,9 +874,18 @@ class RasterStack(StatisticsMixin):
 
         return windows
 
-    def extract_pixels(self, rast_name, use_cats=False, as_df=False):
+    def extract_pixels(self, rast_name, use_cats=False, as_df=False, height=25):
         """Extract pixel values from a RasterStack using another RasterRow
         object of labelled pixels
+
+        Notes
+        -----
+        The labelled raster is read block-wise in windows of `height` rows.
+        Within each window the labelled cells are located using a numpy index
+        and the predictor values are gathered directly from the blocks of the
+        RasterStack, which are only read if the window contains any labelled
+        cells. Similar to `r.stats -n`, cells that are null in any of the
+        predictors are skipped. Pixels are returned in row-major order.
         
         Parameters
         ----------
@@ -753,31 +901,51 @@ class RasterStack(StatisticsMixin):
         as_df : bool (opt). Default is False
             Whether to return the extracted RasterStack pixels as a Pandas
             DataFrame.
+
+        height : int (opt). Default is 25
+            Number of raster rows to read at one time.
         """
+        reg = Region()
+
         # check for categories in labelled pixel map
         with RasterRow(rast_name) as src:
             labels = src.cats
+            label_dtype = np.dtype(_GRASS_DTYPES[src.mtype])
 
         if "" in labels.labels() or use_cats is False:
             labels = None
 
         # extract predictor values at pixel locations
-        data = r.stats(
-            input=[rast_name] + self.names,
-            separator="pipe",
-            flags=["n", "g"],
-            stdout_=PIPE,
-        ).outputs.stdout
+        ys, Xs = [], []
+        label_block = np.empty((height, reg.cols), dtype=label_dtype)
+
+        with RasterRow(rast_name) as src:
+            for row_start, row_stop in self.row_windows(region=reg, height=height):
+                block = read_block(
+                    src, row_start, row_stop, out=label_block[0 : row_stop - row_start]
+                )
 
-        data = data.strip().split(os.linesep)
-        data = [i.split("|") for i in data]
-        data = np.asarray(data).astype("float32")
+                if np.issubdtype(label_dtype, np.integer):
+                    rows, cols = np.nonzero(block != self._cell_nodata)
+                else:
+                    rows, cols = np.nonzero(~np.isnan(block))
+
+                if rows.shape[0] == 0:
+                    continue
 
-        # remove x,y columns from array indexes 1 and 2
-        data = data[:, 2:]
+                arr = self.read(rows=(row_start, row_stop))
+                X = arr.data[:, rows, cols].T
+                valid = ~arr.mask[:, rows, cols].any(axis=0)
 
-        y = data[:, 0]
-        X = data[:, 1:]
+                ys.append(block[rows[valid], cols[valid]].astype("float32"))
+                Xs.append(X[valid].astype("float32"))
+
+        if len(ys) > 0:
+            y = np.concatenate(ys)
+            X = np.concatenate(Xs)
+        else:
+            y = np.empty((0,), dtype="float32")
+            X = np.empty((0, self.count), dtype="float32")
 
         if (y % 1).all() == 0:
             y = y.astype("int")
@@ -799,9 +967,15 @@ class RasterStack(StatisticsMixin):
 
         return X, y, cat
 
-    def extract_points(self, vect_name, fields, na_rm=True, as_df=False):
+    def extract_points(self, vect_name, fields, na_rm=True, as_df=False, height=25):
         """Samples a list of GRASS rasters using a point dataset
 
+        Notes
+        -----
+        The point coordinates are read once from the vector map and all of
+        the rasters in the RasterStack are sampled in a single pass over the
+        windows of rows that contain points (see `_sample_coordinates`).
+
         Parameters
         ----------
         vect_name : str
@@ -817,6 +991,9 @@ class RasterStack(StatisticsMixin):
             Whether to return the extracted RasterStack values as a Pandas
             DataFrame.
 
+        height : int (opt). Default is 25
+            Number of raster rows to read at one time.
+
         Returns
         -------
         X : ndarray
@@ -860,41 +1037,22 @@ class RasterStack(StatisticsMixin):
 
             df = df.loc[:, fields + [points.table.key]]
 
-            # extract raster data
-            Xs = []
-
-            for name, layer in self.loc.items():
-                rast_data = v.what_rast(
-                    map=vect_name,
-                    raster=layer.fullname(),
-                    flags="p",
-                    quiet=True,
-                    stdout_=PIPE,
-                ).outputs.stdout.strip().split(os.linesep)
-
-                with RasterRow(layer.fullname()) as src:
-                    if src.mtype == "CELL":
-                        nodata = self._cell_nodata
-                        dtype = pd.Int64Dtype()
-                    else:
-                        nodata = np.nan
-                        dtype = np.float32
-
-                    X = [k.split("|")[1] if k.split("|")[1] != "*" else nodata for k in rast_data]
-                    X = np.asarray(X)
-                    cat = np.asarray([int(k.split("|")[0]) for k in rast_data])
-
-                    if src.mtype == "CELL":
-                        X = [int(i) for i in X]
-                    else:
-                        X = [float(i) for i in X]
-
-                X = pd.DataFrame(data=np.column_stack((X, cat)), columns=[name, key_col])
-                X[name] = X[name].astype(dtype)
-                Xs.append(X)
-
-        for X in Xs:
-            df = df.merge(X, on=key_col)
+            # read point coordinates once
+            coords = [(pnt.cat, pnt.x, pnt.y) for pnt in points.viter("points")]
+
+        coords = np.asarray(coords, dtype=np.float64).reshape((-1, 3))
+        cat = coords[:, 0].astype(np.int64)
+
+        # extract raster data
+        X = self._sample_coordinates(coords[:, 1], coords[:, 2], height=height)
+        X = pd.DataFrame(data=X, columns=list(self.loc.keys()))
+
+        for name, mtype in zip(self.loc.keys(), self.mtypes.values()):
+            if mtype == "CELL":
+                X[name] = X[name].astype(pd.Int64Dtype())
+
+        X[key_col] = cat
+        df = df.merge(X, on=key_col)
 
         # set any grass integer nodata values to NaN
         df = df.replace(self._cell_nodata, np.nan)
@@ -919,37 +1077,143 @@ class RasterStack(StatisticsMixin):
 
         return df
 
-    def to_pandas(self):
-        """RasterStack to pandas DataFrame
-        
+    def _sample_coordinates(self, x, y, height=25):
+        """Sample the RasterStack at point coordinates
+
+        Notes
+        -----
+        The coordinates are converted to row/column indexes of the current
+        region and the points are grouped by windows of rows. Each window
+        that contains points is read once and the values of all the bands
+        are gathered into a preallocated feature matrix. Points outside the
+        region and null cells are returned as NaN.
+
+        Parameters
+        ----------
+        x, y : ndarray
+            1d arrays of the easting and northing of the points.
+
+        height : int (opt). Default is 25
+            Number of raster rows to read at one time.
+
         Returns
         -------
-        pandas.DataFrame
+        ndarray
+            2d float64 array with the dimensions (n_points, n_features).
         """
+        reg = Region()
+
+        rows = np.floor((reg.north - y) / reg.nsres).astype(np.int64)
+        cols = np.floor((x - reg.west) / reg.ewres).astype(np.int64)
+
+        inside = (rows >= 0) & (rows < reg.rows) & (cols >= 0) & (cols < reg.cols)
+        idx = np.nonzero(inside)[0]
+        idx = idx[np.argsort(rows[idx], kind="stable")]
 
+        X = np.full((x.shape[0], self.count), np.nan, dtype=np.float64)
+
+        # start and end positions of the sorted points within each window
+        window_starts = np.arange(0, reg.rows, height)
+        bounds = np.searchsorted(rows[idx], np.append(window_starts, reg.rows))
+
+        for wi, row_start in enumerate(window_starts):
+            pts = idx[bounds[wi] : bounds[wi + 1]]
+
+            if pts.shape[0] == 0:
+                continue
+
+            row_stop = min(row_start + height, reg.rows)
+            arr = self.read(rows=(row_start, row_stop))
+            values = arr[:, rows[pts] - row_start, cols[pts]]
+            X[pts, :] = np.ma.filled(values.astype(np.float64), np.nan).T
+
+        return X
+
+    def iter_pandas(self, height=1000, dropna=False):
+        """Iterate over the RasterStack as pandas DataFrames of windows of rows
+
+        Notes
+        -----
+        Each band is read at its native GRASS GIS data type and stored using
+        a nullable pandas dtype (Int32 for CELL, Float32 for FCELL and
+        Float64 for DCELL maps), so that null cells are represented as
+        pd.NA without promoting the data to float64. The x and y coordinates
+        of the cell centres are computed for each window only.
+
+        Parameters
+        ----------
+        height : int (opt). Default is 1000
+            Number of raster rows in each DataFrame.
+
+        dropna : bool (opt). Default is False
+            Whether to skip cells that are null in all of the rasters.
+
+        Yields
+        ------
+        pandas.DataFrame
+        """
         reg = Region()
-        arr = self.read()
 
-        # generate x and y grid coordinate arrays
-        x_range = np.linspace(start=reg.west, stop=reg.east, num=reg.cols)
-        y_range = np.linspace(start=reg.south, stop=reg.north, num=reg.rows)
-        xs, ys = np.meshgrid(x_range, y_range)
+        x_coords = reg.west + (np.arange(reg.cols) + 0.5) * reg.ewres
 
-        # flatten 3d data into 2d array (layer, sample)
-        arr = arr.reshape((arr.shape[0], arr.shape[1] * arr.shape[2]))
-        arr = arr.transpose()
+        for row_start, row_stop in self.row_windows(region=reg, height=height):
+            n_rows = row_stop - row_start
+            y_coords = reg.north - (np.arange(row_start, row_stop) + 0.5) * reg.nsres
 
-        # convert to dataframe
-        df = pd.DataFrame(
-            np.column_stack((xs.flatten(), ys.flatten(), arr)),
-            columns=["x", "y"] + self.names,
-        )
+            columns = {
+                "x": np.tile(x_coords, n_rows),
+                "y": np.repeat(y_coords, reg.cols),
+            }
+            all_null = np.ones(n_rows * reg.cols, dtype="bool")
 
-        # set nodata values to nan
-        for i, col_name in enumerate(self.names):
-            df.loc[df[col_name] == self._cell_nodata, col_name] = np.nan
+            for name, src in self.layers.items():
+                dtype = np.dtype(_GRASS_DTYPES[self.mtypes[src.fullname()]])
+                data = np.empty((n_rows, reg.cols), dtype=dtype)
 
-        return df
+                with RasterRow(src.fullname()) as f:
+                    read_block(f, row_start, row_stop, out=data)
+
+                data = data.reshape(-1)
+
+                if np.issubdtype(dtype, np.integer):
+                    mask = data == self._cell_nodata
+                    columns[src.fullname()] = pd.arrays.IntegerArray(data, mask)
+                else:
+                    mask = np.isnan(data)
+                    columns[src.fullname()] = pd.arrays.FloatingArray(data, mask)
+
+                all_null &= mask
+
+            df = pd.DataFrame(columns)
+
+            if dropna is True:
+                df = df.loc[~all_null]
+
+            yield df
+
+    def to_pandas(self, height=None, dropna=False):
+        """RasterStack to pandas DataFrame
+
+        Parameters
+        ----------
+        height : int (opt)
+            Number of raster rows to read at one time. If not specified then
+            the entire raster is read at once.
+
+        dropna : bool (opt). Default is False
+            Whether to skip cells that are null in all of the rasters.
+        
+        Returns
+        -------
+        pandas.DataFrame
+        """
+
+        if height is None:
+            height = Region().rows
+
+        return pd.concat(
+            self.iter_pandas(height=height, dropna=dropna), ignore_index=True
+        )
 
     def head(self):
         """Show the head (first rows, first columns) or tail (last rows, last 
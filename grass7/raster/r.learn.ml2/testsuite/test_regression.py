@@ -112,6 +112,29 @@ class TestRegression(TestCase):
         )
         self.assertRasterExists(self.output, msg="Output was not created")
 
+    def test_output_created_workers(self):
+        """Checks that the output is created using parallel prediction"""
+        self.assertModule(
+            "r.learn.train",
+            group=self.group,
+            training_points=self.training_points,
+            field="value",
+            model_name="RandomForestRegressor",
+            n_estimators=100,
+            save_model=self.model_file,
+        )
+        self.assertFileExists(filename=self.model_file)
+
+        self.assertModule(
+            "r.learn.predict",
+            group=self.group,
+            load_model=self.model_file,
+            output=self.output,
+            chunksize=10000,
+            workers=2,
+        )
+        self.assertRasterExists(self.output, msg="Output was not created")
+
     def test_save_load_training(self):
         """Test that training data can be saved and loaded"""
 
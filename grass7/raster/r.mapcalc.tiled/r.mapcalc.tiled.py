@@ -69,30 +69,154 @@
 #%option
 #% key: mapset_prefix
 #% type: string
-#% description: Mapset prefix
+#% description: Prefix of the temporary raster maps created during processing
 #% required: no
 #%end
 
 
-import math
+import os
+import re
+import time
+import atexit
+from multiprocessing import Pool
+
+import numpy as np
 import grass.script as gscript
-from grass.pygrass.modules.grid.grid import *
+from grass.exceptions import CalledModuleError
+from grass.pygrass.raster import RasterRow
+from grass.pygrass.raster.buffer import Buffer
+from grass.pygrass.gis.region import Region
+
+
+# numpy dtypes for each output raster type
+DTYPES = {'CELL': np.int32, 'FCELL': np.float32, 'DCELL': np.float64}
+TMP_MAPS = []
+TMP_FILES = []
+
+
+def cleanup():
+    if TMP_MAPS:
+        gscript.run_command('g.remove', flags='f', type='raster',
+                            name=TMP_MAPS, quiet=True)
+    for tmp_file in TMP_FILES:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def rename_output(expression, output_mapname, new_name):
+    """Replace the output map name on the left side of the expression"""
+    pattern = r'^\s*' + re.escape(output_mapname) + r'\s*=(?!=)'
+    new_expression, n = re.subn(pattern, new_name + ' =', expression, count=1)
+    if n == 0:
+        gscript.fatal(_("Output map <{}> not found on the left side of the "
+                        "expression").format(output_mapname))
+    return new_expression
+
+
+def tile_region(region, row_start, row_end, col_start, col_end):
+    """Return GRASS_REGION string for the given rows and columns of region"""
+    return gscript.region_env(
+        n=region['n'] - row_start * region['nsres'],
+        s=region['n'] - row_end * region['nsres'],
+        w=region['w'] + col_start * region['ewres'],
+        e=region['w'] + col_end * region['ewres'],
+        nsres=region['nsres'], ewres=region['ewres'])
+
+
+def split_tiles(rows, cols, width, height, overlap):
+    """Split the region into tiles
+
+    Returns a list of tuples of the core rows and columns of each tile
+    (row_start, row_end, col_start, col_end) and the same bounds extended
+    by the overlap and clipped to the region.
+    """
+    tiles = []
+    for row_start in range(0, rows, height):
+        row_end = min(row_start + height, rows)
+        for col_start in range(0, cols, width):
+            col_end = min(col_start + width, cols)
+            core = (row_start, row_end, col_start, col_end)
+            extended = (max(row_start - overlap, 0), min(row_end + overlap, rows),
+                        max(col_start - overlap, 0), min(col_end + overlap, cols))
+            tiles.append((core, extended))
+    return tiles
+
+
+def output_type(expression, output_mapname, region, prefix):
+    """Determine the raster type of the expression by evaluating it for a
+    single cell"""
+    probe = prefix + 'probe'
+    TMP_MAPS.append(probe)
+    env = os.environ.copy()
+    env['GRASS_REGION'] = tile_region(region, 0, 1, 0, 1)
+    gscript.run_command('r.mapcalc',
+                        expression=rename_output(expression, output_mapname, probe),
+                        overwrite=True, quiet=True, env=env)
+    return gscript.raster_info(probe)['datatype']
+
 
-class MyGridModule(GridModule):
-    """inherit GridModule, but handle the fact that the output name is in the expression"""
+def compute_tile(args):
+    """Compute one tile and write its core into the shared output array
 
-    def patch(self):
-        """Patch the final results."""
-        bboxes = split_region_tiles(width=self.width, height=self.height)
-        loc = Location()
-        mset = loc[self.mset.name]
-        mset.visible.extend(loc.mapsets())
-        output_map = self.out_prefix[:]
-        self.out_prefix = ''
-        rpatch_map(output_map,
-                   self.mset.name, self.msetstr, bboxes,
-                   self.module.flags.overwrite,
-                   self.start_row, self.start_col, self.out_prefix)
+    The expression is evaluated in the current mapset over the tile extended
+    by the overlap. The core of the tile (without the overlap) is read row
+    by row straight into its disjoint block of the memory-mapped output.
+    """
+    (index, core, extended, expression, output_mapname, region, mtype,
+     prefix, array_file, shape) = args
+    start = time.time()
+    tile = '{p}tile_{i}'.format(p=prefix, i=index)
+    try:
+        env = os.environ.copy()
+        env['GRASS_REGION'] = tile_region(region, *extended)
+        gscript.run_command('r.mapcalc',
+                            expression=rename_output(expression, output_mapname, tile),
+                            overwrite=True, quiet=True, env=env)
+
+        # read the tile in the region of its core only
+        row_start, row_end, col_start, col_end = core
+        window = Region()
+        window.north = region['n'] - row_start * region['nsres']
+        window.south = region['n'] - row_end * region['nsres']
+        window.west = region['w'] + col_start * region['ewres']
+        window.east = region['w'] + col_end * region['ewres']
+        window.nsres = region['nsres']
+        window.ewres = region['ewres']
+        window.adjust()
+        window.set_raster_region()
+
+        output = np.memmap(array_file, dtype=DTYPES[mtype], mode='r+',
+                           shape=shape)
+        with RasterRow(tile) as raster:
+            for row in range(row_end - row_start):
+                output[row_start + row, col_start:col_end] = raster.get_row(row)
+        output.flush()
+        del output
+        gscript.run_command('g.remove', flags='f', type='raster', name=tile,
+                            quiet=True)
+    except (KeyboardInterrupt, CalledModuleError):
+        return index, None
+    return index, time.time() - start
+
+
+def write_output(array_file, output, mtype, shape, overwrite):
+    """Stream the assembled array into the output raster map
+
+    This is the only sequential step: the array is read once in storage
+    order and every output row is written once. The tiles themselves were
+    decompressed by the workers, while the patching it replaces read every
+    tile map again in a single process.
+    """
+    data = np.memmap(array_file, dtype=DTYPES[mtype], mode='r', shape=shape)
+    rows, cols = shape
+    newrow = Buffer((cols,), mtype=mtype)
+    with RasterRow(output, mode='w', mtype=mtype, overwrite=overwrite) as dst:
+        for row in range(rows):
+            gscript.percent(row, rows, 5)
+            newrow[:] = data[row, :]
+            dst.put_row(newrow)
+    gscript.percent(1, 1, 1)
+    del data
 
 
 def main():
@@ -109,26 +233,69 @@ def main():
     if options['mapset_prefix']:
         mapset_prefix = options['mapset_prefix']
 
-
-    kwargs = {'expression' : expression,
-              'quiet' : True}
-
     if output:
         output_mapname = output
     else:
         output_mapname = expression.split('=')[0].strip()
 
-    grd = MyGridModule('r.mapcalc',
-                       width=width,
-                       height=height,
-                       overlap=overlap,
-                       processes=processes,
-                       split=False,
-                       mapset_prefix=mapset_prefix,
-                       out_prefix=output_mapname,
-                       **kwargs)
-    grd.run()
+    prefix = gscript.tempname(12) + '_'
+    if mapset_prefix:
+        prefix = mapset_prefix + '_' + prefix
+
+    region = gscript.region()
+    shape = (region['rows'], region['cols'])
+
+    mtype = output_type(expression, output_mapname, region, prefix)
+
+    # preallocated output array that the workers write their tiles into
+    array_file = gscript.tempfile(create=False)
+    TMP_FILES.append(array_file)
+    data = np.memmap(array_file, dtype=DTYPES[mtype], mode='w+', shape=shape)
+    del data
+
+    tiles = split_tiles(region['rows'], region['cols'], width, height, overlap)
+    TMP_MAPS.extend(['{p}tile_{i}'.format(p=prefix, i=i) for i in range(len(tiles))])
+    jobs = [(i, core, extended, expression, output_mapname, region, mtype,
+             prefix, array_file, shape)
+            for i, (core, extended) in enumerate(tiles)]
+
+    gscript.message(_("Computing {n} tiles...").format(n=len(tiles)))
+    start = time.time()
+    pool = Pool(processes)
+    try:
+        timings = {}
+        for i, seconds in pool.imap_unordered(compute_tile, jobs):
+            if seconds is None:
+                pool.terminate()
+                gscript.fatal(_("Computation of tile {i} failed").format(i=i))
+            timings[i] = seconds
+            gscript.percent(len(timings), len(tiles), 1)
+            gscript.verbose(_("Tile {i} (rows {r0}-{r1}, cols {c0}-{c1}): "
+                              "{t:.2f} s").format(
+                                  i=i, r0=tiles[i][0][0], r1=tiles[i][0][1],
+                                  c0=tiles[i][0][2], c1=tiles[i][0][3],
+                                  t=seconds))
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        gscript.fatal(_("Interrupted"))
+    pool.join()
+
+    times = list(timings.values())
+    gscript.message(_("Tiles computed in {t:.2f} s (per tile: min {mn:.2f} s, "
+                      "mean {me:.2f} s, max {mx:.2f} s)").format(
+                          t=time.time() - start, mn=min(times),
+                          me=sum(times) / len(times), mx=max(times)))
+
+    gscript.message(_("Writing output raster map <{}>...").format(output_mapname))
+    start = time.time()
+    write_output(array_file, output_mapname, mtype, shape, gscript.overwrite())
+    gscript.message(_("Output written in {t:.2f} s").format(
+        t=time.time() - start))
+    gscript.raster_history(output_mapname)
+
 
 if __name__ == "__main__":
     options, flags = gscript.parser()
+    atexit.register(cleanup)
     main()
@@ -339,6 +339,24 @@ COPYRIGHT: (C) 2016 Brendan Harmon and the GRASS Development Team
 #% guisection: Multiprocessing
 #%end
 
+#%option G_OPT_F_INPUT
+#% key: ensemble
+#% description: CSV file with a header of parameter names and one parameter set per line
+#% label: Ensemble parameter file
+#% required: no
+#% guisection: Ensemble
+#%end
+
+#%option
+#% key: nprocs
+#% type: integer
+#% description: Number of ensemble members run in parallel
+#% answer: 1
+#% multiple: no
+#% required: no
+#% guisection: Ensemble
+#%end
+
 #%option G_OPT_STRDS_OUTPUT
 #% key: elevation_timeseries
 #% answer: elevation_timeseries
@@ -379,15 +397,27 @@ COPYRIGHT: (C) 2016 Brendan Harmon and the GRASS Development Team
 #% description: Fill depressions
 #%end
 
+#%flag
+#% key: m
+#% description: Evolve the terrain in memory
+#% guisection: Multiprocessing
+#%end
+
 
 import os
 import sys
 import atexit
 import csv
 import datetime
+import shutil
 from math import exp
+from multiprocessing import Pool
+import numpy as np
 import grass.script as gscript
 from grass.exceptions import CalledModuleError
+from grass.pygrass.raster import RasterRow
+from grass.pygrass.raster.buffer import Buffer
+from grass.pygrass.gis.region import Region
 
 difference_colors = """\
 0% 100 0 100
@@ -419,8 +449,17 @@ erosion_colors = """\
 100% black
 """
 
+# parameters that can vary between the members of an ensemble,
+# either as raster maps or constants
+ensemble_rasters = ('runoff', 'mannings', 'detachment', 'transport',
+    'shearstress', 'density', 'mass', 'k_factor', 'c_factor')
+ensemble_values = ('grav_diffusion', 'erdepmin', 'erdepmax', 'm', 'n')
+
 def main():
     options, flags = gscript.parser()
+    if options['ensemble']:
+        run_ensemble(options, flags)
+        sys.exit(0)
     elevation = options['elevation']
     runs = options['runs']
     mode = options['mode']
@@ -472,6 +511,7 @@ def main():
     n = options['n']
     threads = options['threads']
     fill_depressions = flags['f']
+    in_memory = flags['m']
 
     # check for alternative input parameters
     if not runoff:
@@ -599,7 +639,8 @@ def main():
         m=m,
         n=n,
         threads=threads,
-        fill_depressions=fill_depressions)
+        fill_depressions=fill_depressions,
+        in_memory=in_memory)
 
     # determine type of model and run
     if runs == "series":
@@ -1564,6 +1605,215 @@ class Evolution:
 
         return (evolved_elevation, time, depth, sediment_flux, difference)
 
+class ArrayEvolution(Evolution):
+    """landscape evolution with the elevation, its derivatives, divergence
+    and erosion-deposition kept in memory as arrays across all time steps
+
+    Only the maps of the output space time datasets are written,
+    along with the inputs of r.sim.water, r.sim.sediment, r.watershed
+    and r.fill.dir which still run as modules."""
+
+    def __init__(self, mode, outputs, **kwargs):
+        Evolution.__init__(self, **kwargs)
+        self.mode = mode
+        self.outputs = outputs
+        region = gscript.region()
+        self.ewres = region['ewres']
+        self.nsres = region['nsres']
+        self.seconds = self.rain_interval * 60.
+
+        # read the evolving surface and the parameters once
+        self.surface = read_raster(self.elevation)
+        density = read_raster(self.density)
+        self.density_array = density
+        # gravitational diffusion (m) per unit divergence
+        self.settling = self.seconds / density * float(self.grav_diffusion)
+        self.erdepmin = float(self.erdepmin)
+        self.erdepmax = float(self.erdepmax)
+        self.m = float(self.m)
+        self.n = float(self.n)
+        if mode == 'simwe_mode':
+            self.runoff_array = read_raster(self.runoff)
+        else:
+            self.k_factor_array = read_raster(self.k_factor)
+            self.c_factor_array = read_raster(self.c_factor)
+        if mode == 'rusle_mode':
+            self.mass_array = read_raster(self.mass)
+
+    def r_factor(self, rain_intensity):
+        """compute event-based erosivity (R) factor (MJ mm ha^-1 hr^-1 yr^-1)
+        from rainfall intensity (mm/hr)"""
+
+        # rainfall energy (MJ ha^-1 mm^-1)
+        rain_energy = 0.29 * (1. - 0.72 * np.exp(-0.05 * rain_intensity))
+        # rainfall volume (mm)
+        rain_volume = rain_intensity * self.rain_interval / 60.
+        # event erosivity index (MJ mm ha^-1 hr^-1)
+        erosivity = rain_energy * rain_volume * rain_intensity
+        return erosivity / (self.rain_interval / 525600.)
+
+    def sediment_flow(self, rain_intensity, ls_factor):
+        """compute sediment flow (kg/m^2s) from the RUSLE factors"""
+
+        sedflow = (self.r_factor(rain_intensity)
+                   * self.k_factor_array
+                   * self.c_factor_array
+                   * ls_factor)
+        # convert sediment flow from tons/ha/yr to kg/m^2s
+        return sedflow * 1000. / 10000. / 31557600.
+
+    def flow_depth(self):
+        """compute flow accumulation of the current elevation map
+        times the resolution as depth (m)"""
+
+        gscript.run_command(
+            'r.watershed',
+            elevation=self.elevation,
+            accumulation='flowacc',
+            flags='a',
+            overwrite=True)
+        return read_raster('flowacc') * self.nsres
+
+    def simwe(self, rain_intensity, depth):
+        """hydrologic and erosion-deposition simulation with r.sim.water
+        and r.sim.sediment, returning water depth (m)
+        and erosion-deposition (kg/m^2s) arrays"""
+
+        dx = derivative_x(self.surface, self.ewres)
+        dy = derivative_y(self.surface, self.nsres)
+        write_raster(dx, 'dx')
+        write_raster(dy, 'dy')
+        write_raster(rain_intensity * self.runoff_array, 'rain')
+
+        gscript.run_command(
+            'r.sim.water',
+            elevation=self.elevation,
+            dx='dx',
+            dy='dy',
+            rain='rain',
+            man=self.mannings,
+            depth=depth,
+            niterations=self.rain_interval,
+            nwalkers=self.walkers,
+            nprocs=self.threads,
+            overwrite=True)
+        gscript.run_command(
+            'r.sim.sediment',
+            elevation=self.elevation,
+            water_depth=depth,
+            dx='dx',
+            dy='dy',
+            detachment_coeff=self.detachment,
+            transport_coeff=self.transport,
+            shear_stress=self.shearstress,
+            man=self.mannings,
+            erosion_deposition='erdep',
+            niterations=self.rain_interval,
+            nwalkers=self.walkers,
+            nprocs=self.threads,
+            overwrite=True)
+
+        return read_raster(depth), read_raster('erdep')
+
+    def step(self, rain_intensity):
+        """evolve the surface over one rainfall interval
+
+        The rainfall intensity (mm/hr) is either a number or an array.
+        Returns a dictionary of the written maps by output type
+        and the water depth array."""
+
+        # parse, advance, and stamp time
+        (evolved_elevation, time, depth, sediment_flux, erosion_deposition,
+        difference) = self.parse_time()
+        previous = self.surface
+        erdep = None
+        flux = None
+
+        if self.mode == 'simwe_mode':
+            depth_array, erdep = self.simwe(rain_intensity, depth)
+            erdep = np.clip(erdep, self.erdepmin, self.erdepmax)
+            surface = previous + self.seconds * erdep / self.density_array
+
+        elif self.mode == 'usped_mode':
+            depth_array = self.flow_depth()
+            dx = derivative_x(previous, self.ewres)
+            dy = derivative_y(previous, self.nsres)
+            slope = np.arctan(np.hypot(dx, dy))
+            # downslope direction counterclockwise from east
+            aspect = np.arctan2(-dy, -dx)
+            ls_factor = depth_array**self.m * np.sin(slope)**self.n
+            sedflow = self.sediment_flow(rain_intensity, ls_factor)
+            # net erosion-deposition as divergence of sediment flow,
+            # null only where the elevation is null
+            nulls = np.isnan(previous)
+            erdep = (derivative_x(sedflow * np.cos(aspect), self.ewres, nulls)
+                     + derivative_y(sedflow * np.sin(aspect), self.nsres,
+                                    nulls))
+            erdep = np.clip(erdep, self.erdepmin, self.erdepmax)
+            surface = previous + self.seconds * erdep / self.density_array
+
+        elif self.mode == 'rusle_mode':
+            depth_array = self.flow_depth()
+            dx = derivative_x(previous, self.ewres)
+            dy = derivative_y(previous, self.nsres)
+            slope = np.arctan(np.hypot(dx, dy))
+            ls_factor = ((self.m + 1.)
+                         * (depth_array / 22.1)**self.m
+                         * (np.sin(slope) / 5.14)**self.n)
+            flux = np.minimum(
+                self.sediment_flow(rain_intensity, ls_factor),
+                self.erdepmax)
+            surface = previous - self.seconds * flux / self.mass_array
+
+        else:
+            raise RuntimeError(
+                '{mode} mode does not exist'.format(mode=self.mode))
+
+        # fill sinks
+        if self.fill_depressions and self.mode == 'simwe_mode':
+            write_raster(surface, evolved_elevation)
+            gscript.run_command(
+                'r.fill.dir',
+                input=evolved_elevation,
+                output='depressionless_elevation',
+                direction='flow_direction',
+                overwrite=True)
+            surface = read_raster('depressionless_elevation')
+
+        # gravitational diffusion
+        surface = surface - self.settling * divergence(
+            surface, self.ewres, self.nsres)
+
+        # write the maps of the requested outputs
+        written = {'elevation': evolved_elevation}
+        write_raster(surface, evolved_elevation)
+        if self.outputs['depth']:
+            if self.mode == 'simwe_mode':
+                # remove relative timestamp from r.sim.water
+                gscript.run_command('r.timestamp', map=depth, date='none')
+            else:
+                write_raster(depth_array, depth)
+            written['depth'] = depth
+        elif self.mode == 'simwe_mode':
+            gscript.run_command(
+                'g.remove', type='raster', name=depth, flags='f')
+        if self.outputs['erdep'] and erdep is not None:
+            write_raster(erdep, erosion_deposition)
+            written['erdep'] = erosion_deposition
+        if self.outputs['flux'] and flux is not None:
+            write_raster(flux, sediment_flux)
+            written['flux'] = sediment_flux
+        if self.outputs['difference']:
+            write_raster(surface - previous, difference)
+            written['difference'] = difference
+
+        # update elevation and advance time
+        self.surface = surface
+        self.elevation = evolved_elevation
+        self.start = time
+
+        return written, depth_array
+
 class DynamicEvolution:
     def __init__(self, elevation, mode, precipitation, rain_intensity,
         rain_duration, rain_interval, temporaltype, elevation_timeseries,
@@ -1573,7 +1823,7 @@ class DynamicEvolution:
         difference_title, difference_description, start, walkers, runoff,
         mannings, detachment, transport, shearstress, density, mass,
         grav_diffusion, erdepmin, erdepmax, k_factor, c_factor,
-        m, n, threads, fill_depressions):
+        m, n, threads, fill_depressions, in_memory=False):
         self.elevation = elevation
         self.mode = mode
         self.precipitation = precipitation
@@ -1614,6 +1864,7 @@ class DynamicEvolution:
         self.n = n
         self.threads = threads
         self.fill_depressions = fill_depressions
+        self.in_memory = in_memory
 
     def rainfall_event(self):
         """a dynamic, process-based landscape evolution model
@@ -1628,6 +1879,11 @@ class DynamicEvolution:
         rain_excess = 'rain_excess'
         net_difference = 'net_difference'
 
+        if self.in_memory:
+            # constant rainfall intensity (mm/hr) for each interval
+            events = [(None, float(self.rain_intensity))] * int(iterations)
+            return self.evolve_in_memory(events)
+
         # create raster space time datasets
         gscript.run_command(
             't.create',
@@ -1859,6 +2115,21 @@ class DynamicEvolution:
         net_difference = 'net_difference'
         #iterations = sum(1 for row in precip)
 
+        if self.in_memory:
+            with open(self.precipitation) as csvfile:
+                has_header = csv.Sniffer().has_header(csvfile.read(1024))
+                csvfile.seek(0)
+                if has_header:
+                    next(csvfile)
+                precip = csv.reader(
+                    csvfile, delimiter=',', skipinitialspace=True)
+                # compute rainfall intensity (mm/hr)
+                # from rainfall observation (mm)
+                events = [
+                    (row[0], float(row[1]) / int(self.rain_interval) * 60.)
+                    for row in precip]
+            return self.evolve_in_memory(events)
+
         # create a raster space time dataset
         gscript.run_command(
             't.create',
@@ -2198,6 +2469,478 @@ class DynamicEvolution:
                 rules='-',
                 stdin=difference_colors)
 
+    def evolve_in_memory(self, events):
+        """evolve the landscape for a sequence of rainfall events,
+        given as pairs of start time (or None to continue)
+        and rainfall intensity (mm/hr), keeping the surface in memory
+        and writing only the maps of the requested timeseries"""
+
+        timeseries = {
+            'elevation': (self.elevation_timeseries,
+                self.elevation_title, self.elevation_description),
+            'depth': (self.depth_timeseries,
+                self.depth_title, self.depth_description),
+            'erdep': (self.erdep_timeseries,
+                self.erdep_title, self.erdep_description),
+            'flux': (self.flux_timeseries,
+                self.flux_title, self.flux_description),
+            'difference': (self.difference_timeseries,
+                self.difference_title, self.difference_description)}
+        outputs = dict((kind, bool(timeseries[kind][0]))
+            for kind in timeseries)
+        # rusle computes sediment flux, the other modes erosion-deposition
+        if self.mode == 'rusle_mode':
+            outputs['erdep'] = False
+        else:
+            outputs['flux'] = False
+
+        # create raster space time datasets
+        for kind in timeseries:
+            if outputs[kind]:
+                output, title, description = timeseries[kind]
+                gscript.run_command(
+                    't.create',
+                    type='strds',
+                    temporaltype=self.temporaltype,
+                    output=output,
+                    title=title,
+                    description=description,
+                    overwrite=True)
+
+        # create evolution object
+        evol = ArrayEvolution(mode=self.mode,
+            outputs=outputs,
+            elevation=self.elevation,
+            precipitation=self.precipitation,
+            start=self.start,
+            rain_intensity=self.rain_intensity,
+            rain_interval=self.rain_interval,
+            rain_duration=self.rain_duration,
+            walkers=self.walkers,
+            runoff=self.runoff,
+            mannings=self.mannings,
+            detachment=self.detachment,
+            transport=self.transport,
+            shearstress=self.shearstress,
+            density=self.density,
+            mass=self.mass,
+            grav_diffusion=self.grav_diffusion,
+            erdepmin=self.erdepmin,
+            erdepmax=self.erdepmax,
+            k_factor=self.k_factor,
+            c_factor=self.c_factor,
+            m=self.m,
+            n=self.n,
+            threads=self.threads,
+            fill_depressions=self.fill_depressions)
+
+        # the initial digital elevation model starts the timeseries
+        registered = dict((kind, []) for kind in timeseries)
+        registered['elevation'].append((self.elevation, self.start))
+        depth = None
+        for start, rain_intensity in events:
+            if start:
+                evol.start = start
+            if depth is not None:
+                # derive excess water (mm/hr) from rainfall rate (mm/hr)
+                # plus the depth (m) per rainfall interval (min)
+                rain_intensity = (rain_intensity
+                    + depth / 1000. / evol.rain_interval * 60.)
+            start = evol.start
+            written, depth = evol.step(rain_intensity)
+            for kind, name in written.items():
+                registered[kind].append((name, start))
+
+        # register the evolved maps and set their color tables
+        for kind in timeseries:
+            if outputs[kind]:
+                register_maps(timeseries[kind][0], registered[kind],
+                    evol.rain_interval)
+        evolved = [name for name, start in registered['elevation']][1:]
+        if evolved:
+            gscript.run_command(
+                'r.colors',
+                map=evolved,
+                color='elevation')
+        if registered['erdep']:
+            gscript.write_command(
+                'r.colors',
+                map=[name for name, start in registered['erdep']],
+                rules='-',
+                stdin=erosion_colors)
+        if registered['flux']:
+            gscript.run_command(
+                'r.colors',
+                map=[name for name, start in registered['flux']],
+                color='viridis',
+                flags='g')
+        if registered['difference']:
+            gscript.run_command(
+                'r.colors',
+                map=[name for name, start in registered['difference']],
+                color='differences')
+
+        # compute net elevation change
+        net_difference = 'net_difference'
+        gscript.run_command(
+            'r.mapcalc',
+            expression="{net_difference}"
+            "={evolved_elevation}-{elevation}".format(
+                net_difference=net_difference,
+                elevation=self.elevation,
+                evolved_elevation=evol.elevation),
+            overwrite=True)
+        gscript.write_command(
+            'r.colors',
+            map=net_difference,
+            rules='-',
+            stdin=difference_colors)
+
+def read_raster(name):
+    """read a raster map into an array with nulls as NaN"""
+
+    region = Region()
+    array = np.empty((region.rows, region.cols))
+    raster = RasterRow(name)
+    raster.open('r')
+    for row in range(region.rows):
+        values = raster.get_row(row)
+        if raster.mtype == 'CELL':
+            nulls = values == -2147483648
+            values = values.astype(np.float64)
+            values[nulls] = np.nan
+        array[row] = values
+    raster.close()
+    return array
+
+def write_raster(array, name):
+    """write an array to a double precision raster map
+    with NaN as nulls"""
+
+    raster = RasterRow(name, overwrite=True)
+    raster.open('w', 'DCELL')
+    row_buffer = Buffer((array.shape[1],), mtype='DCELL')
+    for values in array:
+        row_buffer[:] = values
+        raster.put_row(row_buffer)
+    raster.close()
+
+def fill_nulls(array, nulls):
+    """fill the NaN cells with the value of their nearest valid cell
+    like r.grow.distance does for the edges of moving window computations,
+    keeping NaN only where nulls is True"""
+
+    from scipy import ndimage
+
+    missing = np.isnan(array)
+    if missing.any() and not missing.all():
+        indices = ndimage.distance_transform_edt(
+            missing, return_distances=False, return_indices=True)
+        array = array[tuple(indices)]
+    array[nulls] = np.nan
+    return array
+
+def derivative_x(array, ewres, nulls=None):
+    """first order partial derivative in x direction
+    with the 3x3 weights of r.slope.aspect, null where nulls is True
+    (by default where the array is null)"""
+
+    dx = np.full(array.shape, np.nan)
+    dx[1:-1, 1:-1] = (
+        (array[:-2, 2:] + 2. * array[1:-1, 2:] + array[2:, 2:])
+        - (array[:-2, :-2] + 2. * array[1:-1, :-2] + array[2:, :-2])
+        ) / (8. * ewres)
+    if nulls is None:
+        nulls = np.isnan(array)
+    return fill_nulls(dx, nulls)
+
+def derivative_y(array, nsres, nulls=None):
+    """first order partial derivative in y direction (northwards)
+    with the 3x3 weights of r.slope.aspect, null where nulls is True
+    (by default where the array is null)"""
+
+    dy = np.full(array.shape, np.nan)
+    dy[1:-1, 1:-1] = (
+        (array[:-2, :-2] + 2. * array[:-2, 1:-1] + array[:-2, 2:])
+        - (array[2:, :-2] + 2. * array[2:, 1:-1] + array[2:, 2:])
+        ) / (8. * nsres)
+    if nulls is None:
+        nulls = np.isnan(array)
+    return fill_nulls(dy, nulls)
+
+def divergence(array, ewres, nsres):
+    """sum of the second order partial derivatives in x and y direction
+    with the sign r.slope.aspect gives them for dxx and dyy,
+    null where the array is null"""
+
+    center = array[1:-1, 1:-1]
+    west = array[:-2, :-2] + 2. * array[1:-1, :-2] + array[2:, :-2]
+    east = array[:-2, 2:] + 2. * array[1:-1, 2:] + array[2:, 2:]
+    north = array[:-2, :-2] + 2. * array[:-2, 1:-1] + array[:-2, 2:]
+    south = array[2:, :-2] + 2. * array[2:, 1:-1] + array[2:, 2:]
+    column = array[:-2, 1:-1] + 2. * center + array[2:, 1:-1]
+    row = array[1:-1, :-2] + 2. * center + array[1:-1, 2:]
+    div = np.full(array.shape, np.nan)
+    div[1:-1, 1:-1] = -(
+        (west - 2. * column + east) / (4. * ewres * ewres)
+        + (north - 2. * row + south) / (4. * nsres * nsres))
+    return fill_nulls(div, np.isnan(array))
+
+def register_maps(timeseries, maps, rain_interval):
+    """register maps with their start times in a space time raster dataset
+    at once, each map lasting one rainfall interval (min)"""
+
+    filename = gscript.tempfile()
+    with open(filename, 'w') as register:
+        for name, start in maps:
+            end = (datetime.datetime.strptime(start[:19], '%Y-%m-%d %H:%M:%S')
+                + datetime.timedelta(minutes=rain_interval))
+            register.write('{name}|{start}|{end}\n'.format(
+                name=name, start=start, end=end.isoformat(' ')))
+    gscript.run_command(
+        't.register',
+        type='raster',
+        input=timeseries,
+        file=filename,
+        overwrite=True)
+
+def read_ensemble(filename):
+    """read the parameter sets of the ensemble members from a CSV file
+    with a header of parameter names"""
+
+    with open(filename) as csvfile:
+        members = list(csv.DictReader(csvfile, skipinitialspace=True))
+    if not members:
+        gscript.fatal("No parameter sets in {filename}".format(
+            filename=filename))
+    for name in members[0]:
+        if name not in ensemble_rasters + ensemble_values:
+            gscript.fatal(
+                "Unknown parameter <{name}> in {filename}, use {names}".format(
+                    name=name,
+                    filename=filename,
+                    names=', '.join(ensemble_rasters + ensemble_values)))
+    return members
+
+def member_options(options, parameters):
+    """module options of an ensemble member with its parameter set,
+    a number sets the constant and a name the raster map of a parameter"""
+
+    member = dict((key, value) for key, value in options.items()
+        if value and key not in ('ensemble', 'nprocs'))
+    for name, value in parameters.items():
+        if name in ensemble_values:
+            member[name] = value
+            continue
+        try:
+            float(value)
+        except ValueError:
+            member[name] = value
+        else:
+            member[name + '_value'] = value
+            member.pop(name, None)
+
+    # members run in their own mapsets
+    for key in ('elevation',) + ensemble_rasters:
+        if key in member:
+            found = gscript.find_file(member[key], element='cell')
+            if found['fullname']:
+                member[key] = found['fullname']
+    return member
+
+def create_mapset(gisenv, mapset):
+    """create a temporary mapset with the default region
+    and a gisrc file to run modules in it"""
+
+    location = os.path.join(gisenv['GISDBASE'], gisenv['LOCATION_NAME'])
+    path = os.path.join(location, mapset)
+    os.mkdir(path)
+    shutil.copyfile(
+        os.path.join(location, 'PERMANENT', 'DEFAULT_WIND'),
+        os.path.join(path, 'WIND'))
+    gisrc = gscript.tempfile()
+    with open(gisrc, 'w') as rc:
+        rc.write("GISDBASE: {gisdbase}\n"
+            "LOCATION_NAME: {location}\n"
+            "MAPSET: {mapset}\n".format(
+                gisdbase=gisenv['GISDBASE'],
+                location=gisenv['LOCATION_NAME'],
+                mapset=mapset))
+    return path, gisrc
+
+def run_member(args):
+    """run an ensemble member in its own mapset and region"""
+
+    index, options, flags, env = args
+    try:
+        # the initial elevation starts the elevation timeseries,
+        # which only registers maps of the member's own mapset
+        elevation = options['elevation'].split('@')[0]
+        gscript.run_command(
+            'g.copy',
+            raster=[options['elevation'], elevation],
+            env=env,
+            quiet=True)
+        options = dict(options, elevation=elevation)
+        gscript.run_command(
+            'r.sim.terrain',
+            flags=flags,
+            env=env,
+            quiet=True,
+            **options)
+    except CalledModuleError:
+        return index, False
+    return index, True
+
+def gather_member(index, mapset, env, timeseries, temporaltype,
+    rain_interval):
+    """copy the maps of an ensemble member to the current mapset,
+    register them in the member's space time datasets and return
+    the final evolved elevation and net difference maps, the final
+    elevation is None if the member has no elevation timeseries"""
+
+    prefix = 'member{index}_'.format(index=index)
+    final_elevation = None
+    for output, title, description in timeseries:
+        try:
+            rows = gscript.read_command(
+                't.rast.list',
+                input=output,
+                columns='name,start_time',
+                separator='|',
+                flags='u',
+                env=env).splitlines()
+        except CalledModuleError:
+            continue
+        maps = [row.split('|') for row in rows if row]
+        if not maps:
+            continue
+        copies = []
+        for name, start in maps:
+            copies.extend(['{name}@{mapset}'.format(name=name, mapset=mapset),
+                prefix + name])
+        gscript.run_command('g.copy', raster=copies, quiet=True)
+
+        member_output = '{output}_{index}'.format(output=output, index=index)
+        gscript.run_command(
+            't.create',
+            type='strds',
+            temporaltype=temporaltype,
+            output=member_output,
+            title=title,
+            description=description,
+            overwrite=True)
+        register_maps(member_output,
+            [(prefix + name, start) for name, start in maps],
+            rain_interval)
+        if output == timeseries[0][0]:
+            final_elevation = prefix + maps[-1][0]
+
+    net_difference = prefix + 'net_difference'
+    gscript.run_command(
+        'g.copy',
+        raster='net_difference@{mapset},{net_difference}'.format(
+            mapset=mapset,
+            net_difference=net_difference),
+        quiet=True)
+    return final_elevation, net_difference
+
+def run_ensemble(options, flags):
+    """run the members of an ensemble in parallel, each in a temporary
+    mapset, gather their outputs into per-member space time datasets
+    and summarise them with per-cell mean and standard deviation"""
+
+    members = read_ensemble(options['ensemble'])
+    nprocs = int(options['nprocs'])
+    rain_interval = int(options['rain_interval'])
+    member_flags = ''.join(key for key in ('f', 'm') if flags[key])
+    # the elevation timeseries comes first for the final elevation
+    timeseries = [(options[key], title, description)
+        for key, title, description in (
+            ('elevation_timeseries', 'Evolved elevation',
+                'Time-series of evolved digital elevation models'),
+            ('depth_timeseries', 'Evolved depth',
+                'Time-series of evolved water depth'),
+            ('erdep_timeseries', 'Evolved erosion-deposition',
+                'Time-series of evolved erosion-deposition'),
+            ('flux_timeseries', 'Evolved flux',
+                'Time-series of evolved sediment flux'),
+            ('difference_timeseries', 'Evolved difference',
+                'Time-series of evolved difference in elevation'))
+        if options[key]]
+
+    gisenv = gscript.gisenv()
+    region = gscript.region_env()
+    mapsets = {}
+    jobs = []
+    try:
+        for index, parameters in enumerate(members, start=1):
+            mapset = 'tmp_r_sim_terrain_{pid}_{index}'.format(
+                pid=os.getpid(), index=index)
+            path, gisrc = create_mapset(gisenv, mapset)
+            mapsets[index] = (mapset, path)
+            env = os.environ.copy()
+            env['GISRC'] = gisrc
+            env['GRASS_REGION'] = region
+            jobs.append((index, member_options(options, parameters),
+                member_flags, env))
+        environments = dict((job[0], job[3]) for job in jobs)
+
+        final_elevations = []
+        net_differences = []
+        pool = Pool(nprocs)
+        for done, (index, success) in enumerate(
+                pool.imap_unordered(run_member, jobs), start=1):
+            if not success:
+                pool.terminate()
+                gscript.fatal("Ensemble member {index} failed".format(
+                    index=index))
+            mapset, path = mapsets[index]
+            final_elevation, net_difference = gather_member(
+                index, mapset, environments[index], timeseries,
+                options['temporaltype'], rain_interval)
+            if final_elevation is None:
+                pool.terminate()
+                gscript.fatal(
+                    "Ensemble member {index} produced no evolved "
+                    "elevation".format(index=index))
+            final_elevations.append(final_elevation)
+            net_differences.append(net_difference)
+            gscript.percent(done, len(jobs), 1)
+        pool.close()
+        pool.join()
+    finally:
+        for mapset, path in mapsets.values():
+            shutil.rmtree(path, ignore_errors=True)
+
+    # per-cell mean and standard deviation of the members
+    elevation = options['elevation_timeseries']
+    gscript.run_command(
+        'r.series',
+        input=final_elevations,
+        output=[elevation + '_mean', elevation + '_stddev'],
+        method=['average', 'stddev'],
+        overwrite=True)
+    gscript.run_command(
+        'r.colors',
+        map=elevation + '_mean',
+        color='elevation')
+    gscript.run_command(
+        'r.series',
+        input=net_differences,
+        output=['net_difference_mean', 'net_difference_stddev'],
+        method=['average', 'stddev'],
+        overwrite=True)
+    gscript.write_command(
+        'r.colors',
+        map='net_difference_mean',
+        rules='-',
+        stdin=difference_colors)
+    gscript.run_command(
+        'r.colors',
+        map=elevation + '_stddev,net_difference_stddev',
+        color='viridis')
+
 def cleanup():
     try:
         # remove temporary maps
@@ -0,0 +1,93 @@
+"""
+Name:      test_r_sim_terrain_ensemble
+Purpose:   Run r.sim.terrain with an ensemble of two parameter sets,
+           once with modules and once in memory.
+"""
+
+import os
+from grass.exceptions import CalledModuleError
+from grass.gunittest.case import TestCase
+from grass.gunittest.main import test
+
+ensemble = """\
+grav_diffusion,m
+0.1,1.5
+0.2,1.4
+"""
+
+
+class TestEnsemble(TestCase):
+    """Test case for the ensemble mode of r.sim.terrain"""
+
+    dem = 'test_ensemble_dem'
+    ensemble_file = 'test_ensemble.csv'
+    elevation = 'test_ensemble_elevation'
+    depth = 'test_ensemble_depth'
+    erdep = 'test_ensemble_erdep'
+    flux = 'test_ensemble_flux'
+    difference = 'test_ensemble_difference'
+
+    @classmethod
+    def setUpClass(cls):
+        """Create a small elevation map and the ensemble file"""
+        cls.use_temp_region()
+        cls.runModule('g.region', n=20, s=0, e=20, w=0, res=1)
+        cls.runModule('r.mapcalc', expression='{dem} = 100 + row() * 0.5 '
+                      '+ sin(col() * 20) * 2'.format(dem=cls.dem))
+        with open(cls.ensemble_file, 'w') as csvfile:
+            csvfile.write(ensemble)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Remove the elevation map, the ensemble file and the region"""
+        cls.runModule('g.remove', flags='f', type='raster', name=cls.dem)
+        os.remove(cls.ensemble_file)
+        cls.del_temp_region()
+
+    def tearDown(self):
+        """Remove the outputs of the ensemble"""
+        for output in (self.elevation, self.depth, self.erdep, self.flux,
+                       self.difference):
+            for index in (1, 2):
+                # rusle_mode does not create all the datasets
+                try:
+                    self.runModule('t.remove', flags='rf', type='strds',
+                                   inputs='{output}_{index}'.format(
+                                       output=output, index=index))
+                except CalledModuleError:
+                    pass
+        self.runModule('g.remove', flags='f', type='raster',
+                       pattern='member*')
+        self.runModule('g.remove', flags='f', type='raster',
+                       name=[self.elevation + '_mean',
+                             self.elevation + '_stddev',
+                             'net_difference_mean',
+                             'net_difference_stddev'])
+
+    def run_ensemble(self, flags=''):
+        self.assertModule('r.sim.terrain', flags=flags, elevation=self.dem,
+                          runs='event', mode='rusle_mode', rain_duration=2,
+                          rain_interval=1, ensemble=self.ensemble_file,
+                          nprocs=2, elevation_timeseries=self.elevation,
+                          depth_timeseries=self.depth,
+                          erdep_timeseries=self.erdep,
+                          flux_timeseries=self.flux,
+                          difference_timeseries=self.difference)
+        for index in (1, 2):
+            self.assertModule('t.info', input='{output}_{index}'.format(
+                output=self.elevation, index=index))
+        for name in (self.elevation + '_mean', self.elevation + '_stddev',
+                     'net_difference_mean', 'net_difference_stddev'):
+            self.assertRasterExists(name)
+
+    def test_ensemble(self):
+        """Run two members with modules"""
+        self.run_ensemble()
+
+    def test_ensemble_in_memory(self):
+        """Run two members in memory"""
+        self.run_ensemble(flags='m')
+
+
+if __name__ == '__main__':
+    test()
@@ -256,10 +256,11 @@
 
 import os
 import atexit
-from multiprocessing import Process
+from multiprocessing import Pool
 
 import grass.script as grass
 import grass.script.core as core
+from grass.exceptions import CalledModuleError
 
 
 REMOVE = []
@@ -344,6 +345,17 @@ def run_r_sun(elevation, aspect, slope, latitude, longitude,
                       **params)
 
 
+def run_r_sun_job(args):
+    """
+    Run r.sun in a worker process of the pool, return False on error
+    """
+    try:
+        run_r_sun(*args)
+    except CalledModuleError:
+        return False
+    return True
+
+
 def set_color_table(rasters):
     """
     Set 'gyr' color tables for raster maps
@@ -506,50 +518,37 @@ def main():
         rsun_flags += 'p'
 
     grass.info(_("Running r.sun in a loop..."))
-    count = 0
-    # Parallel processing
-    proc_list = []
-    proc_count = 0
     suffixes_all = []
+    jobs = []
     days = range(start_day, end_day + 1, day_step)
     num_days = len(days)
-    core.percent(0, num_days, 1)
     for day in days:
-        count += 1
-        core.percent(count, num_days, 10)
-
         suffix = '_' + format_order(day)
-        proc_list.append(Process(target=run_r_sun,
-                                 args=(elevation_input,
-                                       aspect_input, slope_input,
-                                       latitude, longitude,
-                                       linke_input, linke_value,
-                                       albedo_input, albedo_value,
-                                       horizon_basename, horizon_step,
-                                       solar_constant,
-                                       day, step,
-                                       beam_rad_basename,
-                                       diff_rad_basename,
-                                       refl_rad_basename,
-                                       glob_rad_basename,
-                                       suffix, rsun_flags)))
-
-        proc_list[proc_count].start()
-        proc_count += 1
+        jobs.append((elevation_input,
+                     aspect_input, slope_input,
+                     latitude, longitude,
+                     linke_input, linke_value,
+                     albedo_input, albedo_value,
+                     horizon_basename, horizon_step,
+                     solar_constant,
+                     day, step,
+                     beam_rad_basename,
+                     diff_rad_basename,
+                     refl_rad_basename,
+                     glob_rad_basename,
+                     suffix, rsun_flags))
         suffixes_all.append(suffix)
 
-        if proc_count == nprocs or proc_count == num_days or count == num_days:
-            proc_count = 0
-            exitcodes = 0
-            for proc in proc_list:
-                proc.join()
-                exitcodes += proc.exitcode
-
-            if exitcodes != 0:
-                core.fatal(_("Error while r.sun computation"))
-
-            # Empty process list
-            proc_list = []
+    # Parallel processing: a new r.sun run starts as soon as one finishes
+    core.percent(0, num_days, 1)
+    pool = Pool(nprocs)
+    for count, success in enumerate(pool.imap_unordered(run_r_sun_job, jobs)):
+        if not success:
+            pool.terminate()
+            core.fatal(_("Error while r.sun computation"))
+        core.percent(count + 1, num_days, 10)
+    pool.close()
+    pool.join()
 
     if beam_rad:
         sum_maps(beam_rad, beam_rad_basename, suffixes_all)
@@ -592,17 +591,20 @@ def main():
             maps = ','.join([basename + suf + '@' + mapset for suf in suffixes])
             tgis.open_new_stds(basename, type='strds', temporaltype='relative',
                                title=title, descr=desc, semantic='sum',
-                               dbif=None, overwrite=grass.overwrite())
+                               dbif=dbif, overwrite=grass.overwrite())
 
             tgis.register_maps_in_space_time_dataset(type='rast',
                                                      name=basename, maps=maps,
                                                      start=start_day, end=None,
                                                      unit='days',
                                                      increment=day_step,
-                                                     dbif=None, interval=False)
+                                                     dbif=dbif, interval=False)
 
         # Make sure the temporal database exists
         tgis.init()
+        # all the datasets are registered through a single connection
+        dbif = tgis.SQLDatabaseInterfaceConnection()
+        dbif.connect()
 
         mapset = grass.gisenv()['MAPSET']
         if beam_rad_basename_user:
@@ -623,6 +625,7 @@ def main():
             registerToTemporal(glob_rad_basename, suffixes_all, mapset,
                                start_day, day_step, title="Total irradiation",
                                desc="Output total irradiation raster maps [Wh.m-2.day-1]")
+        dbif.close()
 
     # just add timestamps, don't register
     else:
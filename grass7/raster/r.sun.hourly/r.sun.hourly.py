@@ -257,7 +257,7 @@
 import os
 import datetime
 import atexit
-from multiprocessing import Process
+from multiprocessing import Pool
 
 import grass.script as grass
 import grass.script.core as core
@@ -371,6 +371,60 @@ def run_r_sun(elevation, aspect, slope, day, time, civil_time,
                                                   output + suffix], overwrite=True, quiet=True)
 
 
+def run_r_sun_job(args):
+    """Run r.sun in a worker process of the pool, return False on error"""
+    try:
+        run_r_sun(*args)
+    except CalledModuleError:
+        return False
+    return True
+
+
+def cumulate_maps(basenames, suffixes):
+    """
+    Replace the time series of maps by their cumulative sums
+
+    The series are processed one after the other. The maps of a series are
+    read row by row in one pass, the row of each step is added to the
+    running sum of the row which is written to the new map of the step.
+    """
+    import numpy as np
+    from grass.pygrass.raster import RasterRow
+    from grass.pygrass.raster.buffer import Buffer
+    from grass.pygrass.gis.region import Region
+
+    region = Region()
+    for n, basename in enumerate(basenames):
+        maps = []
+        for suffix in suffixes:
+            inp = RasterRow(basename + suffix)
+            inp.open('r')
+            mtype = inp.mtype if inp.mtype != 'CELL' else 'DCELL'
+            # the new map replaces the input only when it is closed
+            out = RasterRow(basename + suffix, overwrite=True)
+            out.open('w', mtype)
+            maps.append((inp, out, Buffer((region.cols,), mtype=mtype)))
+
+        for row in range(region.rows):
+            running = np.zeros(region.cols)
+            for inp, out, out_row in maps:
+                values = inp.get_row(row)
+                if inp.mtype == 'CELL':
+                    nulls = values == -2147483648
+                    values = values.astype(np.float64)
+                    values[nulls] = np.nan
+                running += values
+                out_row[:] = running
+                out.put_row(out_row)
+            core.percent(n * region.rows + row,
+                         len(basenames) * region.rows, 2)
+
+        for inp, out, out_row in maps:
+            inp.close()
+            out.close()
+    core.percent(1, 1, 1)
+
+
 def set_color_table(rasters, binary=False):
     table = 'gyr'
     if binary:
@@ -589,22 +643,14 @@ def main():
                           quiet=True, **params)
 
     grass.info(_("Running r.sun in a loop..."))
-    count = 0
-    # Parallel processing
-    proc_list = []
-    proc_count = 0
-    suffixes = []
     suffixes_all = []
+    jobs = []
     if mode1:
         times = list(frange1(start_time, end_time, time_step))
     else:
         times = list(frange2(start_time, end_time, time_step))
     num_times = len(times)
-    core.percent(0, num_times, 1)
     for time in times:
-        count += 1
-        core.percent(count, num_times, 10)
-
         coeff_bh_raster = coeff_bh
         if coeff_bh_strds:
             coeff_bh_raster = get_raster_from_strds(year, day, time, strds=coeff_bh_strds)
@@ -613,43 +659,35 @@ def main():
             coeff_dh_raster = get_raster_from_strds(year, day, time, strds=coeff_dh_strds)
 
         suffix = '_' + format_time(time)
-        proc_list.append(Process(target=run_r_sun,
-                                 args=(elevation_input, aspect_input,
-                                       slope_input, day, time, civil_time,
-                                       linke, linke_value,
-                                       albedo, albedo_value,
-                                       coeff_bh_raster, coeff_dh_raster,
-                                       lat, long_,
-                                       beam_rad_basename,
-                                       diff_rad_basename,
-                                       refl_rad_basename,
-                                       glob_rad_basename,
-                                       incidout_basename,
-                                       suffix,
-                                       binary, tmpName,
-                                       None if mode1 else time_step,
-                                       distance_step,
-                                       solar_constant,
-                                       rsun_flags)))
-
-        proc_list[proc_count].start()
-        proc_count += 1
-        suffixes.append(suffix)
+        jobs.append((elevation_input, aspect_input,
+                     slope_input, day, time, civil_time,
+                     linke, linke_value,
+                     albedo, albedo_value,
+                     coeff_bh_raster, coeff_dh_raster,
+                     lat, long_,
+                     beam_rad_basename,
+                     diff_rad_basename,
+                     refl_rad_basename,
+                     glob_rad_basename,
+                     incidout_basename,
+                     suffix,
+                     binary, tmpName,
+                     None if mode1 else time_step,
+                     distance_step,
+                     solar_constant,
+                     rsun_flags))
         suffixes_all.append(suffix)
 
-        if proc_count == nprocs or proc_count == num_times or count == num_times:
-            proc_count = 0
-            exitcodes = 0
-            for proc in proc_list:
-                proc.join()
-                exitcodes += proc.exitcode
-
-            if exitcodes != 0:
-                core.fatal(_("Error while r.sun computation"))
-
-            # Empty process list
-            proc_list = []
-            suffixes = []
+    # Parallel processing: a new r.sun run starts as soon as one finishes
+    core.percent(0, num_times, 1)
+    pool = Pool(nprocs)
+    for count, success in enumerate(pool.imap_unordered(run_r_sun_job, jobs)):
+        if not success:
+            pool.terminate()
+            core.fatal(_("Error while r.sun computation"))
+        core.percent(count + 1, num_times, 10)
+    pool.close()
+    pool.join()
 
     if beam_rad:
         sum_maps(beam_rad, beam_rad_basename, suffixes_all)
@@ -670,18 +708,12 @@ def main():
 
     # cumulative sum
     if flags['c']:
-        copy_tmp = create_tmp_map_name('copy')
-        REMOVE.append(copy_tmp)
-        for each in (beam_rad_basename_user, diff_rad_basename_user,
-                     refl_rad_basename_user, glob_rad_basename_user):
-            if each:
-                previous = each + suffixes_all[0]
-                for suffix in suffixes_all[1:]:
-                    new = each + suffix
-                    grass.run_command('g.copy', raster=[new, copy_tmp], quiet=True)
-                    grass.mapcalc("{new} = {previous} + {current}".format(new=new,
-                                  previous=previous, current=copy_tmp), overwrite=True)
-                    previous = new
+        grass.info(_("Computing cumulative maps..."))
+        cumulate_maps([each for each in (beam_rad_basename_user,
+                                         diff_rad_basename_user,
+                                         refl_rad_basename_user,
+                                         glob_rad_basename_user) if each],
+                      suffixes_all)
 
     # add timestamps either via temporal framework in 7 or r.timestamp in 6.x
     if is_grass_7() and temporal:
@@ -694,13 +726,16 @@ def main():
             tgis.open_new_stds(basename, type='strds',
                                temporaltype='absolute',
                                title=title, descr=desc,
-                               semantic='mean', dbif=None,
+                               semantic='mean', dbif=dbif,
                                overwrite=grass.overwrite())
             tgis.register_maps_in_space_time_dataset(
                 type='raster', name=basename, maps=maps, start=start_time,
-                end=None, increment=time_step, dbif=None, interval=False)
+                end=None, increment=time_step, dbif=dbif, interval=False)
         # Make sure the temporal database exists
         tgis.init()
+        # all the datasets are registered through a single connection
+        dbif = tgis.SQLDatabaseInterfaceConnection()
+        dbif.connect()
 
         mapset = grass.gisenv()['MAPSET']
         if mode2:
@@ -736,6 +771,7 @@ def main():
             registerToTemporal(incidout_basename, suffixes_all, mapset, start,
                                step, title="Incidence angle",
                                desc="Output incidence angle raster maps")
+        dbif.close()
 
     else:
         absolute_time = datetime.datetime(year, 1, 1) + \
@@ -102,10 +102,236 @@
 #% description: Number of tiles in y direction
 #% guisection: Tiling
 #%end
+#%option
+#% key: processes
+#% type: integer
+#% required: no
+#% answer: 1
+#% multiple: no
+#% description: Number of tiles to vectorize in parallel
+#% guisection: Tiling
+#%end
 
+import os
 import sys
+from bisect import bisect_left, bisect_right
+from multiprocessing import Pool
 
 import grass.script as grass
+from grass.exceptions import CalledModuleError
+
+
+def tile_env(n, s, e, w, nsres, ewres):
+    """Environment with GRASS_REGION set to the given extent"""
+    env = os.environ.copy()
+    env['GRASS_REGION'] = grass.region_env(n = n, s = s, e = e, w = w,
+                                           nsres = nsres, ewres = ewres)
+    return env
+
+
+def on_seam(value, seam, tolerance):
+    return seam is not None and abs(value - seam) < tolerance
+
+
+def split_at_seams(points, west_seam, north_seam, tolerance):
+    """Split a boundary into its parts that do not run along a seam"""
+    def along_seam(p, q):
+        return (on_seam(p[0], west_seam, tolerance) and
+                on_seam(q[0], west_seam, tolerance)) or \
+               (on_seam(p[1], north_seam, tolerance) and
+                on_seam(q[1], north_seam, tolerance))
+
+    parts = []
+    part = [points[0]]
+    for p, q in zip(points[:-1], points[1:]):
+        if along_seam(p, q):
+            if len(part) > 1:
+                parts.append(part)
+            part = [q]
+        else:
+            part.append(q)
+    if len(part) > 1:
+        parts.append(part)
+    return parts
+
+
+def remove_seam_boundaries(mapname, west_seam, north_seam, tolerance):
+    """Delete the boundaries of a tile lying on its western or northern seam
+
+    Boundaries running partly along a seam are broken at the seam and only
+    their parts off the seam are kept. The neighbouring tiles provide the
+    removed boundaries along their eastern and southern edges. The nodes on
+    the seams where the boundaries of this tile end are returned, the
+    boundaries of the neighbours have to be broken at these coordinates.
+    """
+    from grass.pygrass.vector import VectorTopo
+    from grass.pygrass.vector.geometry import Boundary
+
+    seam_nodes = []
+    with VectorTopo(mapname, mode = 'rw') as vect:
+        to_delete = []
+        to_write = []
+        for boundary in vect.viter('boundaries'):
+            points = [tuple(point[:2]) for point in boundary.to_list()]
+            parts = split_at_seams(points, west_seam, north_seam, tolerance)
+            if len(parts) != 1 or len(parts[0]) != len(points):
+                to_delete.append(boundary.id)
+                to_write.extend(parts)
+            for part in parts:
+                for x, y in (part[0], part[-1]):
+                    if on_seam(x, west_seam, tolerance) or \
+                       on_seam(y, north_seam, tolerance):
+                        seam_nodes.append((x, y))
+        # delete from the highest id down to keep the remaining ids valid
+        for line_id in sorted(to_delete, reverse = True):
+            vect.delete(line_id)
+        for part in to_write:
+            vect.write(Boundary(points = part))
+
+    return seam_nodes
+
+
+def nodes_between(keys, nodes, a, b, tolerance):
+    """Nodes with keys strictly between a and b, ordered from a to b"""
+    i = bisect_right(keys, min(a, b) + tolerance)
+    j = bisect_left(keys, max(a, b) - tolerance)
+    between = nodes[i:j]
+    if a > b:
+        between.reverse()
+    return between
+
+
+def has_node(keys, value, tolerance):
+    i = bisect_left(keys, value - tolerance)
+    return i < len(keys) and keys[i] <= value + tolerance
+
+
+def break_at_nodes(points, east_edge, east_nodes, south_edge, south_nodes,
+                   tolerance):
+    """Break a boundary at the seam nodes on the eastern and southern edge
+
+    The nodes are lists of (x, y) tuples sorted along their edge. Segments
+    running along an edge are split at the nodes lying inside them, and
+    vertices on an edge are split when a node is found there.
+    """
+    east_keys = [y for x, y in east_nodes]
+    south_keys = [x for x, y in south_nodes]
+
+    def on_edges(point):
+        return (on_seam(point[0], east_edge, tolerance) and
+                has_node(east_keys, point[1], tolerance)) or \
+               (on_seam(point[1], south_edge, tolerance) and
+                has_node(south_keys, point[0], tolerance))
+
+    parts = []
+    part = [points[0]]
+    for i, (p, q) in enumerate(zip(points[:-1], points[1:])):
+        if on_seam(p[0], east_edge, tolerance) and \
+           on_seam(q[0], east_edge, tolerance):
+            cuts = nodes_between(east_keys, east_nodes, p[1], q[1], tolerance)
+        elif on_seam(p[1], south_edge, tolerance) and \
+             on_seam(q[1], south_edge, tolerance):
+            cuts = nodes_between(south_keys, south_nodes, p[0], q[0],
+                                 tolerance)
+        else:
+            cuts = []
+        for node in cuts:
+            part.append(node)
+            parts.append(part)
+            part = [node]
+        part.append(q)
+        if i < len(points) - 2 and on_edges(q):
+            parts.append(part)
+            part = [q]
+    parts.append(part)
+    return parts
+
+
+def break_tile_boundaries(args):
+    """Break the boundaries along the eastern and southern edge of a tile
+    at the seam nodes of its eastern and southern neighbours
+
+    The neighbours removed their boundaries along these seams, so the
+    boundaries of this tile must end where the boundaries of the
+    neighbours end, for the areas to close after patching.
+    """
+    from grass.pygrass.vector import VectorTopo
+    from grass.pygrass.vector.geometry import Boundary
+
+    mapname, east_edge, east_nodes, south_edge, south_nodes, tolerance = args
+    east_nodes = sorted(east_nodes, key = lambda node: node[1])
+    south_nodes = sorted(south_nodes)
+    try:
+        with VectorTopo(mapname, mode = 'rw') as vect:
+            to_delete = []
+            to_write = []
+            for boundary in vect.viter('boundaries'):
+                points = [tuple(point[:2]) for point in boundary.to_list()]
+                parts = break_at_nodes(points, east_edge, east_nodes,
+                                       south_edge, south_nodes, tolerance)
+                if len(parts) > 1:
+                    to_delete.append(boundary.id)
+                    to_write.extend(parts)
+            for line_id in sorted(to_delete, reverse = True):
+                vect.delete(line_id)
+            for part in to_write:
+                vect.write(Boundary(points = part))
+    except KeyboardInterrupt:
+        return False
+    return True
+
+
+def vectorize_tile(args):
+    """Vectorize one tile, optionally clip it, and prepare its seams
+
+    Returns the name of the output vector tile (None if the tile is empty
+    after clipping) and the seam node coordinates.
+    """
+    (input, output, ftype, column, rtvflags, ytile, xtile, bounds,
+     clip_bounds, seams, nsres, ewres) = args
+
+    n, s, e, w = bounds
+    suffix = str(ytile) + str(xtile)
+    outname = output + '_tile_' + suffix
+    try:
+        env = tile_env(n, s, e, w, nsres, ewres)
+        if clip_bounds:
+            tilename = output + '_stile_' + suffix
+        else:
+            tilename = outname
+
+        grass.run_command('r.to.vect', input = input, output = tilename,
+                          type = ftype, column = column, flags = rtvflags,
+                          env = env)
+
+        if clip_bounds:
+            if grass.vector_info_topo(tilename)['areas'] > 0:
+                n2, s2, e2, w2 = clip_bounds
+                env = tile_env(n2, s2, e2, w2, nsres, ewres)
+                extname = 'extent_tile_' + suffix + '_' + output
+                grass.run_command('v.in.region', output = extname, flags = 'd',
+                                  env = env)
+                grass.run_command('v.overlay', ainput = tilename, binput = extname,
+                                  output = outname, operator = 'and', olayer = '0,1,0',
+                                  env = env)
+                grass.run_command('g.remove', flags='f', type='vector', name= extname, quiet = True)
+            else:
+                outname = None
+            grass.run_command('g.remove', flags='f', type='vector', name= tilename, quiet = True)
+        else:
+            # write cmd history:
+            grass.vector_history(outname)
+
+        seam_nodes = []
+        if outname and seams:
+            west_seam, north_seam = seams
+            seam_nodes = remove_seam_boundaries(outname, west_seam, north_seam,
+                                                min(nsres, ewres) / 1000.)
+    except (KeyboardInterrupt, CalledModuleError):
+        return False, None, None
+
+    return True, outname, seam_nodes
+
 
 def main():
     input = options['input']
@@ -114,6 +340,7 @@ def main():
     ftype = options['type']
     xtiles = int(options['x'])
     ytiles = int(options['y'])
+    processes = int(options['processes'])
 
     rtvflags=""
     for key in 'sbtvz':
@@ -125,10 +352,11 @@ def main():
         grass.fatal(_("Number of tiles in x direction must be > 0"))
     if ytiles < 0:
         grass.fatal(_("Number of tiles in y direction must be > 0"))
+    if processes <= 0:
+        grass.fatal(_("Number of processes must be > 0"))
     if grass.find_file(name = input)['name'] == '':
         grass.fatal(_("Input raster %s not found") % input)
 
-    grass.use_temp_region()
     curr = grass.region()
     width = int(curr['cols'] / xtiles)
     if width <= 1:
@@ -143,6 +371,10 @@ def main():
         do_clip = True
         overlap = 2
 
+    # boundaries are stitched along the tile seams only, instead of
+    # cleaning the whole patched map
+    stitch_seams = flags['p'] and ftype == 'area' and not flags['b']
+
     ewres = curr['ewres']
     nsres = curr['nsres']
     xoverlap = overlap * ewres
@@ -159,8 +391,7 @@ def main():
     if s >= n:
         grass.fatal(_("Overlap is too large"))
 
-    datatype = grass.raster_info(input)['datatype']
-    vtiles = None
+    jobs = []
 
     # north to south
     for ytile in range(ytiles):
@@ -176,18 +407,9 @@ def main():
             if xtile == xtiles - 1:
                 e = curr['e']
 
-            grass.run_command('g.region', n = n, s = s, e = e, w = w, nsres = nsres, ewres = ewres)
-
-            if do_clip:
-                tilename = output + '_stile_' + str(ytile) + str(xtile)
-            else:
-                tilename = output + '_tile_' + str(ytile) + str(xtile)
-
-            outname = output + '_tile_' + str(ytile) + str(xtile)
-
-            grass.run_command('r.to.vect', input = input, output = tilename,
-                              type = ftype, column = column, flags = rtvflags)
-
+            clip_bounds = None
+            n2 = n
+            w2 = w
             if do_clip:
                 n2 = curr['n'] - ytile * height * nsres - yoverlap2
                 s2 = n2 - height * nsres
@@ -204,33 +426,65 @@ def main():
                     e2 = w2 + width * ewres + xoverlap2
                 if xtile == xtiles - 1:
                     e2 = curr['e']
+                clip_bounds = (n2, s2, e2, w2)
 
-                tilename = output + '_stile_' + str(ytile) + str(xtile)
-                if grass.vector_info_topo(tilename)['areas'] > 0:
-                    grass.run_command('g.region', n = n2, s = s2, e = e2, w = w2,
-                                      nsres = nsres, ewres = ewres)
+            seams = None
+            if stitch_seams:
+                seams = (w2 if xtile > 0 else None, n2 if ytile > 0 else None)
 
-                    extname = 'extent_tile_' + str(ytile) + str(xtile)
-                    grass.run_command('v.in.region', output = extname, flags = 'd')
-                    outname = output + '_tile_' + str(ytile) + str(xtile)
-                    grass.run_command('v.overlay', ainput = tilename, binput = extname,
-                                      output = outname, operator = 'and', olayer = '0,1,0')
-                    grass.run_command('g.remove', flags='f', type='vector', name= extname, quiet = True)
+            jobs.append((input, output, ftype, column, rtvflags, ytile, xtile,
+                         (n, s, e, w), clip_bounds, seams, nsres, ewres))
 
-                    if vtiles is None:
-                        vtiles = outname
-                    else:
-                        vtiles = vtiles + ',' + outname
+    pool = Pool(processes)
+    try:
+        results = pool.map_async(vectorize_tile, jobs).get()
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        grass.fatal(_("Interrupted"))
+    pool.join()
 
-                grass.run_command('g.remove', flags='f', type='vector', name= tilename, quiet = True)
+    if not all(success for success, outname, seam_nodes in results):
+        grass.fatal(_("Vectorization of tiles failed"))
 
-            else:
-                # write cmd history:
-                grass.vector_history(outname)
-                if vtiles is None:
-                    vtiles = outname
-                else:
-                    vtiles = vtiles + ',' + outname
+    vtiles = [outname for success, outname, seam_nodes in results if outname]
+
+    if stitch_seams:
+        # break the boundaries of every tile at the seam nodes of its
+        # eastern and southern neighbours, before patching
+        tolerance = min(nsres, ewres) / 1000.
+        tiles = {}
+        for job, (success, outname, seam_nodes) in zip(jobs, results):
+            tiles[(job[5], job[6])] = (outname, job[9], seam_nodes)
+        break_jobs = []
+        for (ytile, xtile), (outname, seams, seam_nodes) in tiles.items():
+            if not outname:
+                continue
+            east_edge = east_nodes = south_edge = south_nodes = None
+            if (ytile, xtile + 1) in tiles:
+                east_name, east_seams, nodes = tiles[(ytile, xtile + 1)]
+                east_edge = east_seams[0]
+                east_nodes = [node for node in nodes or []
+                              if on_seam(node[0], east_edge, tolerance)]
+            if (ytile + 1, xtile) in tiles:
+                south_name, south_seams, nodes = tiles[(ytile + 1, xtile)]
+                south_edge = south_seams[1]
+                south_nodes = [node for node in nodes or []
+                               if on_seam(node[1], south_edge, tolerance)]
+            if east_nodes or south_nodes:
+                break_jobs.append((outname, east_edge, east_nodes or [],
+                                   south_edge, south_nodes or [], tolerance))
+
+        pool = Pool(processes)
+        try:
+            broken = pool.map_async(break_tile_boundaries, break_jobs).get()
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            grass.fatal(_("Interrupted"))
+        pool.join()
+        if not all(broken):
+            grass.fatal(_("Stitching of tile seams failed"))
 
     if flags['p']:
         grass.run_command('v.patch', input = vtiles, output = output,
@@ -238,7 +492,7 @@ def main():
 
         grass.run_command('g.remove', flags='f', type='vector', name= vtiles, quiet = True)
 
-        if grass.vector_info_topo(output)['boundaries'] > 0:
+        if not stitch_seams and grass.vector_info_topo(output)['boundaries'] > 0:
             outpatch = output + '_patch'
             grass.run_command('g.rename', vector = (output,outpatch))
             grass.run_command('v.clean', input = outpatch, output = output,
@@ -30,7 +30,8 @@
 
 #%flag
 #% key: l
-#% label: Use memory swap
+#% label: Use low memory mode
+#% description: Read the maps by blocks of rows and compute kappa from the accumulated confusion matrix
 #% guisection: Optional
 #%end
 
@@ -73,18 +74,27 @@
 #%option G_OPT_F_SEP
 #%end
 
+#%option
+#% key: nprocs
+#% type: integer
+#% description: Number of pairs of maps to compare in parallel
+#% required: no
+#% multiple: no
+#% answer: 1
+#%end
+
 import sys
+from multiprocessing import Pool
 import grass.script as gscript
 import grass.temporal as tgis
 from grass.pygrass.raster import RasterRow
 from grass.pygrass.gis.region import Region
 from grass.script.utils import separator
-try:
-    from collections import OrderedDict
-except:
-    from types import DictType as OrderedDic
 import numpy as np
 
+# number of cells read from each map at once in the pixel by pixel analysis
+BLOCK_CELLS = 250000
+
 def _load_skll():
     try:
         from sklearn.metrics import cohen_kappa_score
@@ -95,8 +105,8 @@ def _load_skll():
 
 def _split_maps(maps, splitting):
     from datetime import datetime
-    before = OrderedDic()
-    after = OrderedDic()
+    before = []
+    after = []
     split = None
     if splitting.count('T') == 0:
         try:
@@ -114,64 +124,166 @@ def _split_maps(maps, splitting):
                         "'%Y-%m-%d' or '%Y-%m-%dT%H:%M:%S'"))
     for mapp in maps:
         tempext = mapp.get_temporal_extent()
-        raster = RasterRow(mapp.get_name())
-        raster.open('r')
-        array = np.array(raster)
         if tempext.start_time <= split:
-            before[mapp.get_name()] = array
+            before.append(mapp.get_name())
         else:
-            after[mapp.get_name()] = array
+            after.append(mapp.get_name())
     return before, after
 
+def _read_rows(raster, start, stop, cols):
+    """Read the rows from start to stop of an open raster into a flat
+    float64 array, null cells are set to NaN"""
+    block = np.empty((stop - start, cols), dtype=np.float64)
+    for row in range(start, stop):
+        values = raster.get_row(row)
+        block[row - start] = values
+        if raster.mtype == 'CELL':
+            block[row - start][values == -2147483648] = np.nan
+    return block.reshape(-1)
+
+def _dense_ranks(values):
+    """Return the index of each value in the sorted distinct values of its
+    column, that is the label index used by cohen_kappa_score"""
+    cols = np.arange(values.shape[1])
+    order = np.argsort(values, axis=0, kind='mergesort')
+    ordered = values[order, cols]
+    dense = np.zeros(values.shape, dtype=np.int64)
+    dense[1:] = np.cumsum(ordered[1:] != ordered[:-1], axis=0)
+    ranks = np.empty(values.shape, dtype=np.int64)
+    ranks[order, cols] = dense
+    return ranks
+
+def _kappa_weights(labels1, labels2, method):
+    """Return the weights of the disagreements between two label arrays"""
+    if method == 'linear':
+        return np.abs(labels1 - labels2)
+    elif method == 'quadratic':
+        return (labels1 - labels2) ** 2
+    return (labels1 != labels2).astype(np.int64)
+
+def _kappa_block(vals1, vals2, method):
+    """Compute Cohen's kappa for each column of two (dates, cells) arrays
+
+    Same as calling sklearn.metrics.cohen_kappa_score on each column:
+    with C the confusion matrix of the n dates, E the outer product of its
+    marginals divided by n and W the weight matrix, kappa is
+    1 - sum(W * C) / sum(W * E). sum(W * C) is the sum of the weights of
+    the n date pairs and sum(W * E) is the sum of the weights of all the
+    n * n combinations of dates divided by n, so no confusion matrix has
+    to be built for each cell."""
+    ndates = vals1.shape[0]
+    if method is None:
+        labels1, labels2 = vals1, vals2
+    else:
+        # the weights depend on the label indexes, not on the values
+        ranks = _dense_ranks(np.concatenate((vals1, vals2)))
+        labels1, labels2 = ranks[:ndates], ranks[ndates:]
+    observed = _kappa_weights(labels1, labels2, method).sum(axis=0)
+    expected = np.zeros(vals1.shape[1], dtype=np.int64)
+    for date in range(ndates):
+        expected += _kappa_weights(labels1[date], labels2, method).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kappa = 1 - ndates * observed / expected.astype(np.float64)
+    kappa[np.isnan(vals1).any(axis=0) | np.isnan(vals2).any(axis=0)] = np.nan
+    return kappa
+
 def _kappa_pixel(maps1, maps2, out, method, over):
     from grass.pygrass.raster.buffer import Buffer
-    import sklearn
+    if len(maps1) != len(maps2):
+        gscript.fatal(_("The two groups of maps must have the same number of "
+                        "maps, {b} maps before and {a} maps after the "
+                        "splitting day".format(b=len(maps1), a=len(maps2))))
+    rasters1 = [RasterRow(name) for name in maps1]
+    rasters2 = [RasterRow(name) for name in maps2]
+    for raster in rasters1 + rasters2:
+        raster.open('r')
+    current = Region()
     rasterout = RasterRow(out, overwrite=over)
     rasterout.open('w','DCELL')
-    array1 = maps1.values()[0]
-    for row in range(len(array1)):
-        newrow = Buffer((len(array1[row]),), mtype='DCELL')
-        for col in range(len(array1[row])):
-            vals1 = np.ndarray(len(maps1.values()))
-            vals2 = np.ndarray(len(maps2.values()))
-            x = 0
-            for value in maps1.values():
-                vals1[x] = value[row][col]
-                x += 1
-            x = 0
-            for value in maps2.values():
-                vals2[x] = value[row][col]
-                x += 1
-            if sklearn.__version__ >= '0.18':
-                outval = sklearn.metrics.cohen_kappa_score(vals1, vals2,
-                                                           weights=method)
-            else:
-                outval = sklearn.metrics.cohen_kappa_score(vals1, vals2)
-            newrow[col] = outval
-        rasterout.put_row(newrow)
+    height = max(1, BLOCK_CELLS // current.cols)
+    newrow = Buffer((current.cols,), mtype='DCELL')
+    for start in range(0, current.rows, height):
+        stop = min(start + height, current.rows)
+        vals1 = np.array([_read_rows(rast, start, stop, current.cols)
+                          for rast in rasters1])
+        vals2 = np.array([_read_rows(rast, start, stop, current.cols)
+                          for rast in rasters2])
+        kappa = _kappa_block(vals1, vals2, method)
+        for row in kappa.reshape(stop - start, current.cols):
+            newrow[:] = row
+            rasterout.put_row(newrow)
+        gscript.percent(stop, current.rows, 1)
     rasterout.close()
+    for raster in rasters1 + rasters2:
+        raster.close()
     return
 
+def _confusion_matrix(map1, map2):
+    """Accumulate the confusion matrix of two maps reading them by blocks
+    of rows, cells that are null in one of the maps are skipped
+
+    Return the sorted labels and the confusion matrix, with the values of
+    map1 as rows and the values of map2 as columns"""
+    current = Region()
+    raster1 = RasterRow(map1)
+    raster2 = RasterRow(map2)
+    raster1.open('r')
+    raster2.open('r')
+    labels = np.array([], dtype=np.float64)
+    confusion = np.zeros((0, 0), dtype=np.int64)
+    height = max(1, BLOCK_CELLS // current.cols)
+    for start in range(0, current.rows, height):
+        stop = min(start + height, current.rows)
+        vals1 = _read_rows(raster1, start, stop, current.cols)
+        vals2 = _read_rows(raster2, start, stop, current.cols)
+        valid = ~(np.isnan(vals1) | np.isnan(vals2))
+        vals1 = vals1[valid]
+        vals2 = vals2[valid]
+        new = np.union1d(labels, np.union1d(vals1, vals2))
+        if len(new) > len(labels):
+            # new classes found, grow the matrix
+            grown = np.zeros((len(new), len(new)), dtype=np.int64)
+            index = np.searchsorted(new, labels)
+            grown[np.ix_(index, index)] = confusion
+            labels = new
+            confusion = grown
+        nlabels = len(labels)
+        cells = np.searchsorted(labels, vals1) * nlabels + \
+            np.searchsorted(labels, vals2)
+        confusion += np.bincount(cells, minlength=nlabels * nlabels).reshape(
+            nlabels, nlabels)
+    raster1.close()
+    raster2.close()
+    return labels, confusion
+
+def _kappa_confusion(confusion, method):
+    """Compute Cohen's kappa from a confusion matrix, like
+    sklearn.metrics.cohen_kappa_score"""
+    nlabels = confusion.shape[0]
+    sum0 = np.sum(confusion, axis=0)
+    sum1 = np.sum(confusion, axis=1)
+    expected = np.outer(sum0, sum1) / float(np.sum(sum0))
+    index = np.arange(nlabels)
+    if method == 'linear':
+        weights = np.abs(index[:, np.newaxis] - index[np.newaxis, :])
+    elif method == 'quadratic':
+        weights = (index[:, np.newaxis] - index[np.newaxis, :]) ** 2
+    else:
+        weights = 1 - np.eye(nlabels, dtype=np.int64)
+    k = np.sum(weights * confusion) / np.sum(weights * expected)
+    return 1 - k
+
 def _kappa_skll(map1, map2, lowmem, method):
+    if lowmem:
+        labels, confusion = _confusion_matrix(map1, map2)
+        return _kappa_confusion(confusion, method)
     import sklearn
     raster1 = RasterRow(map1)
     raster2 = RasterRow(map2)
     raster1.open('r')
     raster2.open('r')
-    if lowmem is False:
-        array1 = np.array(raster1).reshape(-1)
-        array2 = np.array(raster2).reshape(-1)
-    else:
-        import tempfile
-        current = Region()
-        array1 = np.memmap(tempfile.NamedTemporaryFile(),
-                           dtype='float32', mode='w+',
-                           shape=(current.rows, current.cols))
-        array1[:] = np.array(raster1).reshape(-1)
-        array2 = np.memmap(tempfile.NamedTemporaryFile(),
-                           dtype='float32', mode='w+',
-                           shape=(current.rows, current.cols))
-        array2[:] = np.array(raster2).reshape(-1)
+    array1 = np.array(raster1).reshape(-1)
+    array2 = np.array(raster2).reshape(-1)
     raster1.close()
     raster2.close()
     if sklearn.__version__ >= '0.18':
@@ -180,6 +292,10 @@ def _kappa_skll(map1, map2, lowmem, method):
     else:
         return sklearn.metrics.cohen_kappa_score(array1, array2)
 
+def _kappa_pair(args):
+    map1, map2, lowmem, method = args
+    return map1, map2, _kappa_skll(map1, map2, lowmem, method)
+
 def _kappa_grass(map1, map2):
     return(gscript.read_command('r.kappa', classification=map1,
                                 reference=map2, quiet=True))
@@ -193,6 +309,7 @@ def main():
         method = options["weight"]
     where = options["where"]
     sep = separator(options["separator"])
+    nprocs = int(options["nprocs"])
     if flags['p'] and not options["splittingday"]:
         gscript.fatal(_("'p' flag required to set also 'splittingday' option"))
     elif flags['p'] and options["splittingday"] and out_name == '-':
@@ -227,31 +344,40 @@ def main():
         return
 
     mapnames = [mapp.get_name() for mapp in maps]
-    if not rkappa:
-        if out_name != '-':
-            fi = open(out_name, 'w')
-        else:
-            fi = sys.stdout
+    pairs = []
     for i1 in range(len(mapnames)):
         for i2 in range(i1 + 1, len(mapnames)):
             map1 = mapnames[i1]
             map2 = mapnames[i2]
             if map1 != map2:
-                if not rkappa:
-                    fi.write("{}-{}{}{}\n".format(map1, map2, sep,
-                                                  _kappa_skll(map1, map2,
-                                                              flags['l'],
-                                                              method)))
-                else:
-                    if out_name != '-':
-                        fi = open("{}_{}_{}".format(out_name, map1, map2), 'w')
-                    else:
-                        fi = sys.stdout
-                    fi.write("{}".format(_kappa_grass(map1, map2)))
-                    if out_name != '-':
-                        fi.close()
+                pairs.append((map1, map2))
     if not rkappa:
-        fi.close()
+        if out_name != '-':
+            fi = open(out_name, 'w')
+        else:
+            fi = sys.stdout
+        jobs = [(map1, map2, flags['l'], method) for map1, map2 in pairs]
+        if nprocs > 1:
+            pool = Pool(nprocs)
+            results = pool.imap(_kappa_pair, jobs)
+        else:
+            results = map(_kappa_pair, jobs)
+        for map1, map2, kappa in results:
+            fi.write("{}-{}{}{}\n".format(map1, map2, sep, kappa))
+        if nprocs > 1:
+            pool.close()
+            pool.join()
+        if out_name != '-':
+            fi.close()
+    else:
+        for map1, map2 in pairs:
+            if out_name != '-':
+                fi = open("{}_{}_{}".format(out_name, map1, map2), 'w')
+            else:
+                fi = sys.stdout
+            fi.write("{}".format(_kappa_grass(map1, map2)))
+            if out_name != '-':
+                fi.close()
 
     gscript.message(_("All data have analyzed"))
 
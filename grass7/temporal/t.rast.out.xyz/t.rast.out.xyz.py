@@ -39,23 +39,242 @@
 #%option G_OPT_F_SEP
 #%end
 
+#%option
+#% key: format
+#% type: string
+#% description: Output format
+#% descriptions: text;Delimited text file;npy;Directory with one NumPy .npy file per column
+#% options: text,npy
+#% answer: text
+#%end
+
+#%option
+#% key: layout
+#% type: string
+#% description: Layout of the output table
+#% descriptions: wide;One row per cell, one column per map;long;One row per cell and map
+#% options: wide,long
+#% answer: wide
+#%end
+
+#%option
+#% key: nprocs
+#% type: integer
+#% description: Number of processes reading the maps in parallel
+#% required: no
+#% multiple: no
+#% answer: 1
+#%end
+
 #%flag
 #% key: i
 #% description: Include no data values
 #%end
 
+#%flag
+#% key: n
+#% description: Skip only the cells with no data values in all the maps
+#%end
+
+#%rules
+#% exclusive: -i,-n
+#%end
+
+import os
+import sys
+import struct
+from collections import deque
+from multiprocessing import Pool
+import numpy as np
 import grass.script as gscript
 import grass.temporal as tgis
+from grass.pygrass.raster import RasterRow
+from grass.pygrass.gis.region import Region
+
+# number of values read at once by a process
+BLOCK_VALUES = 4194304
+# size of the header of the .npy files, the shape is written at the end
+NPY_HEADER = 128
+# number of blocks per process read ahead of the writer
+BLOCKS_AHEAD = 2
+
+# the maps opened once by each process
+rasters = []
+
+
+def open_maps(map_ids):
+    """Open all the maps for reading, used as initializer of the processes"""
+    for map_id in map_ids:
+        name, mapset = map_id.split('@')
+        raster = RasterRow(name, mapset)
+        raster.open('r')
+        rasters.append(raster)
+
+
+def close_maps():
+    while rasters:
+        rasters.pop().close()
+
+
+def read_block(args):
+    """Read the rows from start to stop of all the maps
+
+    Return a (cells, maps) float64 array, null cells are NaN
+    """
+    start, stop, cols = args
+    values = np.empty((stop - start, cols, len(rasters)))
+    for m, raster in enumerate(rasters):
+        for row in range(start, stop):
+            buff = raster.get_row(row)
+            values[row - start, :, m] = buff
+            if raster.mtype == 'CELL':
+                values[row - start, buff == -2147483648, m] = np.nan
+    return values.reshape(-1, len(rasters))
+
+
+def read_blocks(pool, jobs, window):
+    """Read the blocks in parallel and yield them in order
+
+    At most window blocks are read ahead of the one yielded, so that
+    a slow writer does not keep all the blocks in memory
+    """
+    pending = deque()
+    jobs = iter(jobs)
+    for job in jobs:
+        pending.append(pool.apply_async(read_block, (job,)))
+        if len(pending) >= window:
+            break
+    while pending:
+        values = pending.popleft().get()
+        for job in jobs:
+            pending.append(pool.apply_async(read_block, (job,)))
+            break
+        yield values
+
+
+def npy_header(dtype, count):
+    """Return the header of a one dimensional .npy file of a fixed size"""
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+        np.lib.format.dtype_to_descr(np.dtype(dtype)), count)
+    header = header.ljust(NPY_HEADER - 11) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + \
+        header.encode('latin1')
+
+
+class NpyColumn(object):
+    """A column written block by block to a .npy file"""
+    def __init__(self, path, dtype):
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+        self.fd = open(path, 'wb')
+        self.fd.write(npy_header(self.dtype, 0))
+
+    def write(self, values):
+        self.fd.write(np.ascontiguousarray(values, dtype=self.dtype).tobytes())
+        self.count += len(values)
+
+    def close(self):
+        self.fd.seek(0)
+        self.fd.write(npy_header(self.dtype, self.count))
+        self.fd.close()
+
+
+class NpyWriter(object):
+    """Write the table as a directory with one .npy file per column"""
+    def __init__(self, path, maps, layout):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.layout = layout
+        self.columns = [NpyColumn(os.path.join(path, 'x.npy'), np.float64),
+                        NpyColumn(os.path.join(path, 'y.npy'), np.float64)]
+        if layout == 'wide':
+            for mapp in maps:
+                self.columns.append(NpyColumn(
+                    os.path.join(path, '{}.npy'.format(mapp.get_name())),
+                    np.float64))
+        else:
+            self.columns.append(NpyColumn(os.path.join(path, 'map.npy'),
+                                          np.int32))
+            self.columns.append(NpyColumn(os.path.join(path, 'value.npy'),
+                                          np.float64))
+        # the maps and their time stamps, in the order of the columns or
+        # of the indexes of map.npy
+        with open(os.path.join(path, 'maps.txt'), 'w') as fmaps:
+            for index, mapp in enumerate(maps):
+                start, end = mapp.get_temporal_extent_as_tuple()
+                fmaps.write("{}|{}|{}|{}\n".format(index, mapp.get_id(),
+                                                   start, end))
+
+    def write(self, x, y, values):
+        nmaps = values.shape[1]
+        if self.layout == 'wide':
+            self.columns[0].write(x)
+            self.columns[1].write(y)
+            for m in range(nmaps):
+                self.columns[m + 2].write(values[:, m])
+        else:
+            self.columns[0].write(np.repeat(x, nmaps))
+            self.columns[1].write(np.repeat(y, nmaps))
+            self.columns[2].write(np.tile(np.arange(nmaps), len(x)))
+            self.columns[3].write(values.reshape(-1))
+
+    def close(self):
+        for column in self.columns:
+            column.close()
+
+
+class TextWriter(object):
+    """Write the table as delimited text"""
+    def __init__(self, path, maps, layout, sep, mtypes):
+        if path == '-':
+            self.fd = sys.stdout
+        else:
+            self.fd = open(path, 'w')
+        self.layout = layout
+        self.sep = sep
+        self.names = [mapp.get_name() for mapp in maps]
+        formats = {'CELL': '%d', 'FCELL': '%.7g', 'DCELL': '%.15g'}
+        self.formats = [formats[mtype] for mtype in mtypes]
+
+    def _format(self, values, m):
+        """Format the values of a map, null cells as '*'"""
+        nulls = np.isnan(values)
+        return np.where(nulls, '*', np.char.mod(self.formats[m],
+                                                np.where(nulls, 0, values)))
+
+    def write(self, x, y, values):
+        if len(x) == 0:
+            return
+        sep = self.sep
+        nmaps = values.shape[1]
+        coor = np.char.add(np.char.add(np.char.mod('%.15g', x), sep),
+                           np.char.mod('%.15g', y))
+        formatted = [self._format(values[:, m], m) for m in range(nmaps)]
+        if self.layout == 'wide':
+            lines = coor
+            for column in formatted:
+                lines = np.char.add(np.char.add(lines, sep), column)
+        else:
+            # one line per cell and map, cell by cell
+            lines = np.char.add(np.char.add(np.repeat(coor, nmaps), sep),
+                                np.tile(np.array(self.names), len(x)))
+            lines = np.char.add(np.char.add(lines, sep),
+                                np.stack(formatted, axis=1).reshape(-1))
+        self.fd.write('\n'.join(lines.tolist()) + '\n')
+
+    def close(self):
+        if self.fd is not sys.stdout:
+            self.fd.close()
 
 
 def main(options, flags):
     strds = options["strds"]
     out_name = options["output"]
     where = options["where"]
-    sep = options["separator"]
-    donodata = ''
-    if flags['i']:
-        donodata = 'i'
+    sep = gscript.separator(options["separator"])
+    out_format = options["format"]
+    layout = options["layout"]
+    nprocs = int(options["nprocs"])
     # Make sure the temporal database exists
     tgis.init()
     # We need a database interface
@@ -63,22 +282,71 @@ def main(options, flags):
     dbif.connect()
 
     sp = tgis.open_old_stds(strds, "strds", dbif)
-    maps = sp.get_registered_maps_as_objects(where, "start_time", None)
+    maps = sp.get_registered_maps_as_objects(where, "start_time", dbif)
+    dbif.close()
     if maps is None:
         gscript.fatal(_("Space time raster dataset {st} seems to be "
                         "empty".format(st=strds)))
         return 1
-    mapnames = [mapp.get_name() for mapp in maps]
-    try:
-        gscript.run_command("r.out.xyz", input=','.join(mapnames),
-                            output=out_name, separator=sep, flags=donodata,
-                            overwrite=gscript.overwrite())
-        gscript.message(_("Space time raster dataset {st} exported to "
-                          "{pa}".format(st=strds, pa=out_name)))
-    except:
-        gscript.fatal(_("Unable to export space time raster dataset "
-                        "{st}".format(st=strds)))
-        return 1
+    if out_format == 'npy' and out_name == '-':
+        gscript.fatal(_("The npy format requires the 'output' option"))
+    if out_name != '-' and os.path.exists(out_name) and \
+            not gscript.overwrite():
+        gscript.fatal(_("Output <{pa}> already exists".format(pa=out_name)))
+
+    map_ids = [mapp.get_id() for mapp in maps]
+    mtypes = []
+    for map_id in map_ids:
+        name, mapset = map_id.split('@')
+        raster = RasterRow(name, mapset)
+        raster.open('r')
+        mtypes.append(raster.mtype)
+        raster.close()
+
+    if out_format == 'npy':
+        writer = NpyWriter(out_name, maps, layout)
+    else:
+        writer = TextWriter(out_name, maps, layout, sep, mtypes)
+
+    region = Region()
+    height = max(1, BLOCK_VALUES // (region.cols * len(map_ids)))
+    blocks = [(start, min(start + height, region.rows))
+              for start in range(0, region.rows, height)]
+    jobs = [(start, stop, region.cols) for start, stop in blocks]
+    if nprocs > 1:
+        pool = Pool(nprocs, initializer=open_maps, initargs=(map_ids,))
+        results = read_blocks(pool, jobs, nprocs * BLOCKS_AHEAD)
+    else:
+        open_maps(map_ids)
+        results = (read_block(job) for job in jobs)
+
+    xcoor = region.west + (np.arange(region.cols) + 0.5) * region.ewres
+    for (start, stop), values in zip(blocks, results):
+        rows = np.arange(start, stop)
+        x = np.tile(xcoor, len(rows))
+        y = np.repeat(region.north - (rows + 0.5) * region.nsres,
+                      region.cols)
+        nulls = np.isnan(values)
+        if flags['n']:
+            keep = ~nulls.all(axis=1)
+        elif not flags['i']:
+            keep = ~nulls.any(axis=1)
+        else:
+            keep = None
+        if keep is not None:
+            x = x[keep]
+            y = y[keep]
+            values = values[keep]
+        writer.write(x, y, values)
+        gscript.percent(stop, region.rows, 1)
+    if nprocs > 1:
+        pool.close()
+        pool.join()
+    else:
+        close_maps()
+    writer.close()
+    gscript.message(_("Space time raster dataset {st} exported to "
+                      "{pa}".format(st=strds, pa=out_name)))
 
 
 if __name__ == "__main__":
@@ -113,6 +113,8 @@
 
 from datetime import datetime
 from datetime import timedelta
+from bisect import bisect_left
+from multiprocessing import Pool
 from subprocess import PIPE as PI
 import numpy as np
 import grass.script as gscript
@@ -120,41 +122,127 @@ from grass.exceptions import CalledModuleError
 
 
 def return_value(vals, met):
-    """Return the value according the choosen method"""
+    """Return the value according the choosen method
+
+    vals is a (maps, points) array, the value is computed for each point
+    """
     if met == 'average':
-        return vals.mean()
+        return vals.mean(axis=0)
     elif met == 'median':
-        return np.median(vals)
+        return np.median(vals, axis=0)
     elif met == 'mode':
         try:
             from scipy import stats
-            m = stats.mode(vals)
-            return m.mode[0]
+            m = stats.mode(vals, axis=0)
+            return np.asarray(m.mode).reshape(-1)
         except ImportError:
             gscript.fatal(_("For method 'mode' you need to install scipy"))
     elif met == 'minimum':
-        return vals.min()
+        return vals.min(axis=0)
     elif met == 'maximum':
-        return vals.max()
+        return vals.max(axis=0)
     elif met == 'stddev':
-        return vals.std()
+        return vals.std(axis=0)
     elif met == 'sum':
-        return vals.sum()
+        return vals.sum(axis=0)
     elif met == 'variance':
-        return vals.var()
+        return vals.var(axis=0)
     elif met == 'quart1':
-        return np.percentile(vals, 25)
+        return np.percentile(vals, 25, axis=0)
     elif met == 'quart3':
-        return np.percentile(vals, 75)
+        return np.percentile(vals, 75, axis=0)
     elif met == 'perc90':
-        return np.percentile(vals, 90)
+        return np.percentile(vals, 90, axis=0)
     elif met == 'quantile':
-        return 
+        return np.full(vals.shape[1], None, dtype=object)
+
+
+class CumulativeSums(object):
+    """Cumulative sums over the time ordered samples of all the points
+
+    The sum, average, variance and standard deviation of the samples of
+    any range of consecutive maps are computed from the difference of two
+    cumulative sums; the squares are accumulated after subtracting the
+    mean of each point to limit the loss of precision.
+    """
+    METHODS = ('average', 'sum', 'variance', 'stddev')
+
+    def __init__(self, samples):
+        filled = np.where(np.isnan(samples), 0, samples)
+        valid = (~np.isnan(samples)).sum(axis=0)
+        self.shift = filled.sum(axis=0) / np.maximum(valid, 1)
+        shifted = np.where(np.isnan(samples), 0, samples - self.shift)
+        self.sums = self._cumsum(filled)
+        self.shifted_sums = self._cumsum(shifted)
+        self.squares = self._cumsum(shifted ** 2)
+        self.nulls = self._cumsum(np.isnan(samples).astype(np.int64))
+
+    @staticmethod
+    def _cumsum(values):
+        cumsum = np.zeros((values.shape[0] + 1, values.shape[1]),
+                          dtype=values.dtype)
+        np.cumsum(values, axis=0, out=cumsum[1:])
+        return cumsum
+
+    def hasnull(self, first, last):
+        """Return for each point whether a sample of the maps first to
+        last - 1 is null"""
+        return (self.nulls[last] - self.nulls[first]) > 0
+
+    def value(self, first, last, met):
+        """Return the value of a method for the maps first to last - 1"""
+        count = float(last - first)
+        if met == 'sum':
+            return self.sums[last] - self.sums[first]
+        elif met == 'average':
+            return (self.sums[last] - self.sums[first]) / count
+        mean = (self.shifted_sums[last] - self.shifted_sums[first]) / count
+        var = np.maximum((self.squares[last] - self.squares[first]) / count -
+                         mean ** 2, 0)
+        if met == 'variance':
+            return var
+        return np.sqrt(var)
+
+
+def sample_map(args):
+    """Sample a raster map at the given cell rows and columns
+
+    Each raster row holding points is read only once, null cells are NaN
+    """
+    from grass.pygrass.raster import RasterRow
+
+    map_id, rows, cols = args
+    name, mapset = map_id.split('@')
+    raster = RasterRow(name, mapset)
+    raster.open('r')
+    values = np.full(len(rows), np.nan)
+    order = np.argsort(rows, kind='mergesort')
+    uniq, starts = np.unique(rows[order], return_index=True)
+    stops = np.append(starts[1:], len(order))
+    for row, start, stop in zip(uniq, starts, stops):
+        buff = raster.get_row(int(row))
+        idx = order[start:stop]
+        values[idx] = buff[cols[idx]]
+        if raster.mtype == 'CELL':
+            values[idx[buff[cols[idx]] == -2147483648]] = np.nan
+    raster.close()
+    return values
+
+
+def select_maps(starts, ends, lower, upper):
+    """Return the positions of the maps with start time >= lower and end
+    time < upper, maps are sorted by start time"""
+    first = bisect_left(starts, lower)
+    last = bisect_left(starts, upper)
+    return [i for i in range(first, last)
+            if ends[i] is not None and ends[i] < upper]
+
 
 def main(options, flags):
     import grass.pygrass.modules as pymod
     import grass.temporal as tgis
     from grass.pygrass.vector import VectorTopo
+    from grass.pygrass.gis.region import Region
 
     invect = options["input"]
     if invect.find('@') != -1:
@@ -172,6 +260,7 @@ def main(options, flags):
     gran = options["granularity"]
     dateformat = options["date_format"]
     separator = gscript.separator(options["separator"])
+    nprocs = int(options["nprocs"])
 
     stdout = False
     if output != '-' and flags['u']:
@@ -236,6 +325,18 @@ def main(options, flags):
             mydates = dates.outputs["stdout"].value.splitlines()
         except CalledModuleError:
             gscript.fatal(_("db.select return an error"))
+        # the features of all the dates at once
+        try:
+            qfeat = pymod.Module("db.select", flags='c', stdout_=PI,
+                                 stderr_=PI, sql="SELECT DISTINCT cat, {dc} "
+                                 "from {vmap} order by cat".format(
+                                     vmap=invect, dc=incol))
+        except CalledModuleError:
+            gscript.fatal(_("db.select return an error"))
+        datefeats = {}
+        for line in qfeat.outputs["stdout"].value.splitlines():
+            cat, data = line.split('|', 1)
+            datefeats.setdefault(data, []).append(cat)
     elif indate:
         mydates = [indate]
         pymap = VectorTopo(invect)
@@ -253,97 +354,137 @@ def main(options, flags):
         qfeat = pymod.Module("v.category", stdout_=PI, stderr_=PI,
                              input=invect, option='print')
         myfeats = qfeat.outputs["stdout"].value.splitlines()
-    
-    if stdout:
-        outtxt = ''
+
+    # Time ordered maps of the STRDS
+    maps = sp.get_registered_maps(columns="id,start_time,end_time",
+                                  order="start_time", dbif=dbif)
+    dbif.close()
+    map_ids = [row[0] for row in maps]
+    starts = [row[1] for row in maps]
+    ends = [row[2] for row in maps]
+
+    # Query windows of all the dates
+    windows = []
     for data in mydates:
         if sp.get_temporal_type() == 'absolute':
             fdata = datetime.strptime(data, dateformat)
         else:
             fdata = int(data)
         if flags['a']:
-            sdata = fdata + td
-            mwhere="start_time >= '{inn}' and end_time < " \
-                   "'{out}'".format(inn=fdata, out=sdata)
+            windows.append(select_maps(starts, ends, fdata, fdata + td))
         else:
-            sdata = fdata - td
-            mwhere="start_time >= '{inn}' and end_time < " \
-                   "'{out}'".format(inn=sdata, out=fdata)
-        lines = None
-        try:
-            r_what = pymod.Module("t.rast.what", points=invect, strds=strds,
-                                  layout='timerow', separator=separator,
-                                  flags="v", where=mwhere, quiet=True,
-                                  stdout_=PI, stderr_=PI)
-            lines = r_what.outputs["stdout"].value.splitlines()
-        except CalledModuleError:
-            pass
+            windows.append(select_maps(starts, ends, fdata - td, fdata))
+
+    # Points of the vector map and their cells in the current region
+    pymap = VectorTopo(invect)
+    pymap.open('r')
+    points = [(str(point.cat), point.x, point.y)
+              for point in pymap.viter('points')]
+    pymap.close()
+    region = Region()
+    xs = np.array([point[1] for point in points], dtype=np.float64)
+    ys = np.array([point[2] for point in points], dtype=np.float64)
+    prows = np.floor((region.north - ys) / region.nsres).astype(np.int64)
+    pcols = np.floor((xs - region.west) / region.ewres).astype(np.int64)
+    inside = np.nonzero((prows >= 0) & (prows < region.rows) &
+                        (pcols >= 0) & (pcols < region.cols))[0]
+
+    # Read every map used by any window once, sampling all the points
+    needed = sorted(set(i for window in windows for i in window))
+    position = dict((i, n) for n, i in enumerate(needed))
+    jobs = [(map_ids[i], prows[inside], pcols[inside]) for i in needed]
+    if nprocs > 1 and len(jobs) > 1:
+        pool = Pool(nprocs)
+        sampled = pool.map(sample_map, jobs)
+        pool.close()
+        pool.join()
+    else:
+        sampled = [sample_map(job) for job in jobs]
+    samples = np.full((len(needed), len(points)), np.nan)
+    for n, values in enumerate(sampled):
+        samples[n, inside] = values
+    cumulative = CumulativeSums(samples)
+
+    if stdout:
+        outtxt = ''
+    else:
+        dbinfo = gscript.vector_db(output)[1]
+        sqls = []
+    for data, window in zip(mydates, windows):
         if incol:
-            try:
-                qfeat = pymod.Module("db.select", flags='c', stdout_=PI,
-                                     stderr_=PI, sql="SELECT DISTINCT cat from"
-                                     " {vmap} where {dc}='{da}' order by "
-                                     "cat".format(vmap=invect, da=data,
-                                                  dc=incol))
-                myfeats = qfeat.outputs["stdout"].value.splitlines()
-            except CalledModuleError:
-                gscript.fatal(_("db.select returned an error for date "
-                                "{da}".format(da=data)))
-        if not lines and stdout:
+            myfeats = datefeats.get(data, [])
+        if not window and stdout:
             for feat in myfeats:
                 outtxt += "{di}{sep}{da}".format(di=feat, da=data,
                                                    sep=separator)
                 for n in range(len(mets)):
                     outtxt += "{sep}{val}".format(val='*', sep=separator)
                 outtxt += "\n"
-        if not lines:
+        if not window:
             continue
-        x=0
-        for line in lines:
-            vals = line.split(separator)
-            if vals[0] in myfeats:
-                try:
-                    nvals = np.array(vals[4:]).astype(np.float)
-                except ValueError:
-                    if stdout:
-                        outtxt += "{di}{sep}{da}".format(di=vals[0],
-                                                         da=data,
-                                                         sep=separator)
-                        for n in range(len(mets)):
-                            outtxt += "{sep}{val}".format(val='*',
-                                                          sep=separator)
-                        outtxt += "\n"
-                    continue
+        window = [position[i] for i in window]
+        first = window[0]
+        last = window[-1] + 1
+        consecutive = (last - first) == len(window)
+        if consecutive:
+            nulls = cumulative.hasnull(first, last)
+        else:
+            nulls = np.isnan(samples[window]).any(axis=0)
+        results = []
+        for met in mets:
+            if consecutive and met in CumulativeSums.METHODS:
+                results.append(cumulative.value(first, last, met))
+            else:
+                results.append(return_value(samples[window], met))
+        feats = set(myfeats)
+        for p, (cat, x, y) in enumerate(points):
+            if cat not in feats:
+                continue
+            if nulls[p]:
                 if stdout:
-                    outtxt += "{di}{sep}{da}".format(di=vals[0], da=data,
+                    outtxt += "{di}{sep}{da}".format(di=cat, da=data,
                                                      sep=separator)
-                for n in range(len(mets)):
-                    result =  return_value(nvals, mets[n])
-                    if stdout:
-                        outtxt += "{sep}{val}".format(val=result,
+                    for n in range(len(mets)):
+                        outtxt += "{sep}{val}".format(val='*',
                                                       sep=separator)
-                    else:
-                        try:
-                            if incol:
-                                pymod.Module("v.db.update", map=output,
-                                             column=cols[n], value=str(result),
-                                             where="{dc}='{da}' AND cat="
-                                             "{ca}".format(da=data, ca=vals[0],
-                                                           dc=incol))
-                            else:
-                                pymod.Module("v.db.update", map=output,
-                                             column=cols[n], value=str(result),
-                                             where="cat={ca}".format(ca=vals[0]))
-                        except CalledModuleError:
-                            gscript.fatal(_("v.db.update return an error"))
-                if stdout:
                     outtxt += "\n"
-                if x == len(myfeats):
-                    break
+                continue
+            if stdout:
+                outtxt += "{di}{sep}{da}".format(di=cat, da=data,
+                                                 sep=separator)
+                for n in range(len(mets)):
+                    outtxt += "{sep}{val}".format(val=results[n][p],
+                                                  sep=separator)
+                outtxt += "\n"
+            else:
+                values = ", ".join("{col}={val}".format(col=cols[n],
+                                                        val=results[n][p])
+                                   for n in range(len(mets)))
+                if incol:
+                    sqls.append("UPDATE {tab} SET {va} WHERE {dc}='{da}' "
+                                "AND cat={ca};\n".format(tab=dbinfo['table'],
+                                                         va=values, dc=incol,
+                                                         da=data, ca=cat))
                 else:
-                    x += 1
+                    sqls.append("UPDATE {tab} SET {va} WHERE "
+                                "cat={ca};\n".format(tab=dbinfo['table'],
+                                                     va=values, ca=cat))
     if stdout:
         print(outtxt)
+    elif sqls:
+        # write all the values in a single transaction
+        update_sql = gscript.tempfile()
+        with open(update_sql, 'w') as fsql:
+            fsql.write('BEGIN TRANSACTION;\n')
+            for sql in sqls:
+                fsql.write(sql)
+            fsql.write('END TRANSACTION;')
+        try:
+            gscript.run_command('db.execute', input=update_sql,
+                                database=dbinfo['database'],
+                                driver=dbinfo['driver'], quiet=True)
+        except CalledModuleError:
+            gscript.fatal(_("db.execute return an error"))
 
 if __name__ == "__main__":
     options, flags = gscript.parser()
@@ -147,6 +147,25 @@ A_average
 """
         self.assertLooksLike(text, t_rast_what.outputs.stdout)
 
+    def test_update_date_column(self):
+        """Testing c flag with date_column option and more methods"""
+        self.assertModule(SimpleModule("t.rast.what.aggr", flags="c",
+                                       strds="A", input="points",
+                                       date_column="data", verbose=True,
+                                       granularity="3 months",
+                                       method=["minimum", "maximum"],
+                                       overwrite=True))
+        dbvals = SimpleModule("v.db.select", map="points",
+                              columns="cat,A_minimum,A_maximum")
+        self.assertModule(dbvals)
+        text="""cat|A_minimum|A_maximum
+1|300|400
+2|200|300
+3|400|400
+
+"""
+        self.assertLooksLike(text, dbvals.outputs.stdout)
+
 
 class TestRasterWhatFails(TestCase):
 
@@ -78,16 +78,72 @@
 ##%end
 
 import sys
-import copy
 import csv
+import math
+from bisect import bisect_right
 import grass.script as gscript
-from grass.script import core as gcore
 import grass.temporal as tgis
-import grass.pygrass.modules as pymod
+from grass.pygrass.raster import RasterRow
+from grass.pygrass.gis.region import Region
 
 
 ############################################################################
 
+def find_maps(starts, max_ends, ends, timestamp):
+    """Return the indexes of the maps whose time interval contains the
+    timestamp, in start time order
+
+    starts and ends are the start and end times of the maps sorted by start
+    time, max_ends[i] is the maximum of ends[0:i+1]. A map matches if
+    start <= timestamp < end.
+    """
+    matches = []
+    i = bisect_right(starts, timestamp) - 1
+    # go back as long as an earlier map may still end after the timestamp
+    while i >= 0 and max_ends[i] is not None and max_ends[i] > timestamp:
+        if ends[i] is not None and ends[i] > timestamp:
+            matches.append(i)
+        i -= 1
+    matches.reverse()
+    return matches
+
+
+def sample_map(map_id, points, region, null_value):
+    """Sample a raster map at a list of (x, y) coordinates
+
+    Each raster row that contains points is read only once. Returns the
+    values as strings formatted like r.what, null_value for null cells and
+    points outside of the region.
+    """
+    name, mapset = map_id.split("@")
+    raster = RasterRow(name, mapset)
+    raster.open("r")
+    mtype = raster.mtype
+
+    values = [null_value] * len(points)
+    by_row = {}
+    for i, (x, y) in enumerate(points):
+        row = int(math.floor((region.north - y) / region.nsres))
+        col = int(math.floor((x - region.west) / region.ewres))
+        if 0 <= row < region.rows and 0 <= col < region.cols:
+            by_row.setdefault(row, []).append((i, col))
+
+    for row in sorted(by_row):
+        buff = raster.get_row(row)
+        for i, col in by_row[row]:
+            value = buff[col]
+            if mtype == "CELL":
+                if value != -2147483648:
+                    values[i] = "%d" % value
+            elif not math.isnan(value):
+                if mtype == "FCELL":
+                    values[i] = "%.7g" % value
+                else:
+                    values[i] = "%.15g" % value
+    raster.close()
+    return values
+
+
 def main(options, flags):
 
     # Get the options
@@ -97,6 +153,7 @@ def main(options, flags):
     where = options["where"]
     null_value = options["null_value"]
     separator = options["separator"]
+    skip = int(options["skip"])
 
     write_header = flags["n"]
 
@@ -104,8 +161,6 @@ def main(options, flags):
     #output_color = flags["r"]
     #output_cat = flags["i"]
 
-    overwrite = gscript.overwrite()
-
     # Make sure the temporal database exists
     tgis.init()
     # We need a database interface
@@ -126,32 +181,68 @@ def main(options, flags):
     if separator == "newline":
         separator = "\n"
 
-
-    r_what = gcore.read_command("r.what", map="dummy",
-                                    output="-",
-                                    separator=separator,
-                                    quiet=True)
-    if len(s) == 0:
-        gcore.fatal(_('No data returned from query'))
-
-    reader = csv.reader(open(csv_file, "r"), delimiter=separator)
-
+    # Load the time intervals of all the maps at once
+    maps = sp.get_registered_maps(columns="id,start_time,end_time",
+                                  where=where, order="start_time",
+                                  dbif=dbif)
+    dbif.close()
+    if not maps:
+        gscript.fatal(_("Space time raster dataset <%s> is empty") % strds)
+
+    map_ids = [entry[0] for entry in maps]
+    starts = [entry[1] for entry in maps]
+    ends = [entry[2] for entry in maps]
+    max_ends = []
+    max_end = None
+    for end in ends:
+        if end is not None and (max_end is None or end > max_end):
+            max_end = end
+        max_ends.append(max_end)
+
+    # Resolve the maps of all the rows and group the points by map
+    lines = []
+    samples = {}
+    csv_fd = open(csv_file, "r")
+    reader = csv.reader(csv_fd, delimiter=separator)
     for line in reader:
+        if reader.line_num <= skip:
+            continue
         id_, x, y, timestamp = line
-
         start = tgis.string_to_datetime(timestamp)
-        where = "start_time <= \'" + str(start) + "\' AND end_time > \'" + str(start) + "\'"
-        rows = sp.get_registered_maps(columns="id", where=where,
-                                      dbif=dbif)
-        for entry in rows:
-            r_what.inputs.map = entry[0]
-            r_what.inputs.coordinates = [x,y]
-            r_what.run()
-            out = "%s%s%s"%(id_, separator, r_what.outputs.stdout)
-
-            sys.stdout.write(out)
-
-    dbif.close()
+        matches = []
+        for index in find_maps(starts, max_ends, ends, start):
+            group = samples.setdefault(index, ([], []))
+            group[0].append((float(x), float(y)))
+            group[1].append((len(lines), len(matches)))
+            matches.append(None)
+        lines.append((id_, x, y, matches))
+    csv_fd.close()
+
+    # Open each map once and sample all its points
+    region = Region()
+    count = 0
+    for index in sorted(samples):
+        points, positions = samples[index]
+        values = sample_map(map_ids[index], points, region, null_value)
+        for (line, match), value in zip(positions, values):
+            lines[line][3][match] = value
+        count += 1
+        gscript.percent(count, len(samples), 1)
+
+    # Write the results in input order
+    if output == "-":
+        out_fd = sys.stdout
+    else:
+        out_fd = open(output, "w")
+    if write_header:
+        out_fd.write(separator.join(["id", "x", "y", "site_name", "value"]))
+        out_fd.write("\n")
+    for id_, x, y, matches in lines:
+        for value in matches:
+            out_fd.write(separator.join([id_, x, y, "", value]))
+            out_fd.write("\n")
+    if out_fd is not sys.stdout:
+        out_fd.close()
 
 
 
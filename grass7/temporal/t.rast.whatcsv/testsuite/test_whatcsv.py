@@ -32,6 +32,14 @@ class TestRasterWhatCSV(TestCase):
         csv_file.write("4|115.0043586274|36.3593955783|2001-11-01 00:00:00\n")
         csv_file.close()
 
+        csv_file = open("test_skip.csv", "w")
+        csv_file.write("id|x|y|timestamp\n")
+        csv_file.write("1|115.0043586274|36.3593955783|2001-11-01 00:00:00\n")
+        csv_file.write("2|79.6816763826|45.2391522853|2003-01-01 00:00:00\n")
+        csv_file.write("3|97.4892579600|79.2347263950|2001-01-01 00:00:00\n")
+        csv_file.write("4|500.0|500.0|2001-04-01 00:00:00\n")
+        csv_file.close()
+
         cls.runModule("t.create",  type="strds",  temporaltype="absolute",
                                  output="A",  title="A test",  description="A test",
                                  overwrite=True)
@@ -58,6 +66,20 @@ class TestRasterWhatCSV(TestCase):
 2|79.6816763826|45.2391522853||200
 3|97.4892579600|79.2347263950||300
 4|115.0043586274|36.3593955783||400
+"""
+        self.assertLooksLike(text,  t_rast_whatcsv.outputs.stdout)
+
+    def test_skip_unmatched(self):
+        """Rows without a map are not written, points outside of the region
+        get the null value, the input order is kept"""
+        t_rast_whatcsv = SimpleModule("t.rast.whatcsv",  strds="A",
+                                      csv="test_skip.csv", overwrite=True,
+                                      skip=1, null_value="*", verbose=True)
+        self.assertModule(t_rast_whatcsv)
+
+        text="""1|115.0043586274|36.3593955783||400
+3|97.4892579600|79.2347263950||100
+4|500.0|500.0||*
 """
         self.assertLooksLike(text,  t_rast_whatcsv.outputs.stdout)
 
@@ -94,8 +94,9 @@ To Dos:
 #%option
 #% key: percentile
 #% type: integer
-#% description: Percentile to calculate
+#% description: Percentile(s) to calculate
 #% options: 0-100
+#% multiple: yes
 #% required : no
 #%end
 
@@ -134,18 +135,13 @@ import sys
 import os
 import atexit
 import math
-from subprocess import PIPE
+import numpy as np
 import grass.script as grass
 from grass.pygrass.vector import VectorTopo
 from grass.pygrass.raster.abstract import RasterAbstractBase
 from grass.pygrass.raster import RasterRow
 from grass.pygrass.gis import Mapset
-from grass.pygrass.vector.geometry import Boundary
-from grass.pygrass.vector.geometry import Centroid
 from grass.pygrass.gis.region import Region
-#from grass.pygrass.vector.table import *
-from grass.pygrass.modules.interface.module import Module
-from itertools import chain
 
 if not "GISBASE" in os.environ.keys():
     grass.message("You must be in GRASS GIS to run this program.")
@@ -153,11 +149,12 @@ if not "GISBASE" in os.environ.keys():
 
 TMP_MAPS = []
 
+# Vector types as named by the type option and by GRASS modules
+GEOMETRY_TYPES = {'points': 'point', 'lines': 'line', 'areas': 'area'}
+
 def cleanup():
     """Remove temporary data
     """
-    #remove temporary region file
-    grass.del_temp_region()
     try:
         grass.run_command('g.remove', flags='f', name=TMP_MAPS,
                           quiet=True, type=['vector', 'raster'],
@@ -165,60 +162,6 @@ def cleanup():
     except:
         pass
 
-    if RasterRow("MASK", Mapset().name).exist():
-        grass.run_command("r.mask", flags="r", quiet=True)
-    reset_mask()
-
-
-def unset_mask():
-    """Deactivate user mask"""
-    if RasterRow("MASK", Mapset().name).exist():
-        grass.run_command(
-            "g.rename", quiet=True, raster="MASK,{}_MASK".format(tmp_map)
-        )
-
-
-def reset_mask():
-    """Re-activate user mask"""
-    if RasterRow("{}_MASK".format(tmp_map)).exist():
-        grass.run_command(
-            "g.rename", quiet=True, raster="{}_MASK,MASK".format(tmp_map)
-        )
-
-
-def align_current(region, bbox):
-    """Align current region to bounding box
-
-    :param region: PyGRASS Region object
-    :param bbox: PyGRASS Bbox object
-    :returns: adjusted PyGRASS Region object
-    :type region: PyGRASS Region object
-    :type bbox: PyGRASS Bbox object
-    :rtype: dict
-
-    :Example:
-
-    >>> align_current(region, bbox)
-    region
-    """
-    north = region.north
-    east = region.east
-    west = region.west
-    south = region.south
-    nsres = region.nsres
-    ewres = region.ewres
-
-    region.north = north - (math.floor((north - bbox.north) / nsres)
-                            * nsres)
-    region.south = south - (math.ceil((south - bbox.south) / nsres)
-                            * nsres)
-    region.east = east - (math.floor((east - bbox.east) / ewres)
-                          * ewres)
-    region.west = west - (math.ceil((west - bbox.west) / ewres)
-                          * ewres)
-
-    return region
-
 
 def random_name(length):
     """Generate a random name of length "length" starting with a letter
@@ -244,49 +187,305 @@ def random_name(length):
     return randomname
 
 
-def raster_type(raster, tabulate, use_lable):
-    """Check raster map type (int or double) and return categories for int maps
+def raster_type(raster):
+    """Check raster map type (int or double)
 
     :param raster: name of the raster map to check
     :type raster: string
-    :param tabulate: check categories for tabulation
-    :type tabulate: bool
-    :param use_lable: use label strings instead of category numbers
-    :type use_lable: bool
-    :returns: string with raster map type and list of categories with lables
-    :rmap_type: string
-    :rcats: list of category tuples
+    :returns: string with raster map type
+    :rtype: string
+
     :Example:
 
     >>> raster_type('elevation')
-    'double precision', []
+    'double precision'
     """
     r_map = RasterRow(raster)
     r_map.open()
     if not r_map.has_cats() and r_map.mtype != "CELL":
         rmap_type = 'double precision'
-        rcats = []
     else:
         rmap_type = 'int'
-        rcats = []
-        if tabulate:
-            rcats = r_map.cats
-            r_map.close()
-            if not rcats:
-                rcats = []
-            if len(rcats) == 0:
-                rcats = grass.read_command("r.category", map=raster).rstrip('\n').split('\n')
-                rcats = [tuple((rcat.split('\t')[1], rcat.split('\t')[1], None)) for rcat in rcats]
-            cat_list = [rcat[0] for rcat in rcats]
-            lable_list = [rcat[1] for rcat in rcats]
-            if use_lable:
-                racts = lable_list if len(set(cat_list)) == len(set(lable_list)) else cat_list
+    r_map.close()
+
+    return rmap_type
+
+
+def read_raster(raster, dtype=np.float64):
+    """Read a raster map within the current region (and MASK) into an array
+
+    :param raster: name of the raster map to read
+    :type raster: string
+    :param dtype: data type of the array, NULL cells are NaN in float
+                  arrays and -2147483648 in integer arrays
+    :type dtype: numpy dtype
+    :returns: array with the values of the raster map
+    :rtype: numpy array
+    """
+    region = Region()
+    array = np.empty((region.rows, region.cols), dtype=dtype)
+    r_map = RasterRow(raster)
+    r_map.open()
+    for row in range(region.rows):
+        values = r_map.get_row(row)
+        if r_map.mtype == 'CELL' and np.issubdtype(dtype, np.floating):
+            nulls = values == -2147483648
+            values = values.astype(dtype)
+            values[nulls] = np.nan
+        array[row] = values
+    r_map.close()
+
+    return array
+
+
+def feature_extents(in_vect, types):
+    """Get the extent of the geometries of every category
+
+    :param in_vect: opened PyGRASS VectorTopo object
+    :param types: vector types to work on
+    :type types: list
+    :returns: dictionary with category as key and a list of west, south,
+              east, north as value
+    :rtype: dict
+    """
+    extents = {}
+    for geom_type in types:
+        if in_vect.number_of(geom_type) == 0:
+            continue
+        for geom in in_vect.viter(geom_type):
+            cat = geom.cat
+            if cat is None:
+                continue
+            if geom_type == 'points':
+                west = east = geom.x
+                south = north = geom.y
             else:
-                racts = cat_list
+                bbox = geom.bbox()
+                west, south, east, north = (bbox.west, bbox.south,
+                                            bbox.east, bbox.north)
+            if cat in extents:
+                extent = extents[cat]
+                extents[cat] = [min(extent[0], west), min(extent[1], south),
+                                max(extent[2], east), max(extent[3], north)]
+            else:
+                extents[cat] = [west, south, east, north]
+
+    return extents
+
+
+def group_features(extents, distance):
+    """Split categories into groups which buffers do not overlap
+
+    Buffers of two categories can only overlap if their extents grown
+    by the buffer distance do. Categories are assigned greedily to the
+    first group without such a neighbour, neighbours are looked up in
+    a grid of buckets.
+
+    :param extents: dictionary with category as key and extent as value
+    :type extents: dict
+    :param distance: largest buffer distance
+    :type distance: float
+    :returns: list of lists of categories
+    :rtype: list
+    """
+    grown = {}
+    for cat, (west, south, east, north) in extents.items():
+        grown[cat] = (west - distance, south - distance,
+                      east + distance, north + distance)
+    sizes = sorted(max(e[2] - e[0], e[3] - e[1]) for e in grown.values())
+    size = max(sizes[len(sizes) // 2], 1e-9) if sizes else 1.
+
+    buckets = {}
+    group_of = {}
+    groups = []
+    for cat in sorted(grown):
+        west, south, east, north = grown[cat]
+        keys = [(col, row)
+                for col in range(int(math.floor(west / size)),
+                                 int(math.floor(east / size)) + 1)
+                for row in range(int(math.floor(south / size)),
+                                 int(math.floor(north / size)) + 1)]
+        taken = set()
+        for key in keys:
+            for other in buckets.get(key, []):
+                o_west, o_south, o_east, o_north = grown[other]
+                if (o_west <= east and west <= o_east and
+                        o_south <= north and south <= o_north):
+                    taken.add(group_of[other])
+        group = 0
+        while group in taken:
+            group += 1
+        if group == len(groups):
+            groups.append([])
+        groups[group].append(cat)
+        group_of[cat] = group
+        for key in keys:
+            buckets.setdefault(key, []).append(cat)
+
+    return groups
+
+
+def rasterize_buffers(in_vector, layer, types, groups, buffers):
+    """Rasterize the buffers of all geometries into sparse cell lists
+
+    Every group of non-overlapping buffers is rasterized once per
+    buffer distance with v.to.rast. Buffers of different groups may
+    overlap as the cells are collected into lists of cell indices and
+    categories instead of a single label map.
+
+    :param in_vector: name of the input vector map
+    :param layer: layer of the categories
+    :param types: vector types to work on
+    :param groups: list of lists of categories
+    :param buffers: list of buffer distances
+    :returns: dictionary with buffer distance as key and a tuple with
+              arrays of cell indices and categories as value
+    :rtype: dict
+    """
+    v_types = [GEOMETRY_TYPES[geom_type] for geom_type in types]
+    group_map = '{}_group'.format(tmp_map)
+    buffer_map = '{}_buffer'.format(tmp_map)
+    label_map = '{}_labels'.format(tmp_map)
+    TMP_MAPS.extend([group_map, buffer_map, label_map])
+    cats_file = grass.tempfile()
+
+    cells = dict((buf, ([], [])) for buf in buffers)
+    for n_group, group in enumerate(groups):
+        with open(cats_file, 'w') as cats:
+            cats.write('\n'.join(str(cat) for cat in group))
+        grass.run_command('v.extract', input=in_vector, layer=layer,
+                          type=v_types, file=cats_file, output=group_map,
+                          flags='t', overwrite=True, quiet=True)
+        for buf in buffers:
+            if buf <= 0:
+                grass.run_command('v.to.rast', input=group_map, layer=layer,
+                                  type=v_types, use='cat', output=label_map,
+                                  overwrite=True, quiet=True)
+            else:
+                grass.run_command('v.buffer', input=group_map, layer=layer,
+                                  type=v_types, distance=buf,
+                                  output=buffer_map, flags='t',
+                                  overwrite=True, quiet=True)
+                grass.run_command('v.to.rast', input=buffer_map, layer=layer,
+                                  type='area', use='cat', output=label_map,
+                                  overwrite=True, quiet=True)
+            labels = read_raster(label_map, dtype=np.int32).ravel()
+            inside = np.flatnonzero(labels != -2147483648)
+            cells[buf][0].append(inside)
+            cells[buf][1].append(labels[inside])
+        grass.percent(n_group + 1, len(groups), 1)
+
+    for buf in buffers:
+        indices, cats = cells[buf]
+        if indices:
+            cells[buf] = (np.concatenate(indices), np.concatenate(cats))
         else:
-            r_map.close()
+            cells[buf] = (np.array([], dtype=int), np.array([], dtype=int))
+
+    return cells
+
+
+def univariate_stats(values, index, count, percentiles):
+    """Compute univariate statistics for groups of cells at once
+
+    Quartiles and percentiles are taken from the sorted values of every
+    group the way r.univar -e does.
+
+    :param values: values of the cells with NaN for NULL
+    :param index: group index of every cell
+    :param count: number of groups
+    :param percentiles: list of percentiles to compute
+    :returns: dictionary with statistic as key and an array with one
+              value per group (NaN for groups without data) as value
+    :rtype: dict
+    """
+    valid = ~np.isnan(values)
+    number_null = np.bincount(index[~valid], minlength=count)
+    values = values[valid]
+    index = index[valid]
+    number = np.bincount(index, minlength=count)
+    has_data = number > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total = np.bincount(index, weights=values, minlength=count)
+        mean = np.where(has_data, total / number, np.nan)
+        average_abs = np.bincount(index, weights=np.abs(values),
+                                  minlength=count) / number
+        deviations = values - mean[index]
+        variance = np.bincount(index, weights=deviations * deviations,
+                               minlength=count) / number
+        stddev = np.sqrt(variance)
+        coeff_var = 100. * stddev / mean
+
+    # Sort values within groups for order statistics
+    values = values[np.lexsort((values, index))]
+    starts = np.cumsum(number) - number
+
+    def order_statistic(position):
+        result = np.full(count, np.nan)
+        position = np.clip(position, 0, number - 1)
+        result[has_data] = values[starts[has_data] + position[has_data]]
+        return result
+
+    def quantile(p):
+        """Quantile p of every group as computed by r.univar -e"""
+        return order_statistic(
+            np.clip(np.floor(number * p - 0.5), 0, number - 1).astype(int))
+
+    minimum = order_statistic(np.zeros(count, dtype=int))
+    maximum = order_statistic(number - 1)
+    middle = number // 2
+    median = np.where(number % 2 == 1, order_statistic(middle),
+                      (order_statistic(middle - 1) +
+                       order_statistic(middle)) / 2.)
+
+    stats = {'number': number,
+             'number_null': number_null,
+             'minimum': minimum,
+             'maximum': maximum,
+             'range': maximum - minimum,
+             'sum': np.where(has_data, total, np.nan),
+             'average': mean,
+             'average_abs': average_abs,
+             'stddev': stddev,
+             'variance': variance,
+             'coeff_var': coeff_var,
+             'first_quartile': quantile(0.25),
+             'median': median,
+             'third_quartile': quantile(0.75)}
+    for perc in percentiles:
+        stats[perc] = quantile(perc / 100.)
+
+    return stats
+
+
+def tabulate_stats(values, index, count):
+    """Count the cells of every raster category for groups of cells at once
+
+    :param values: integer values of the cells with NaN for NULL
+    :param index: group index of every cell
+    :param count: number of groups
+    :returns: array of categories, array of cell counts per group and
+              category and array of NULL cell counts per group
+    :rtype: tuple
+    """
+    valid = ~np.isnan(values)
+    nulls = np.bincount(index[~valid], minlength=count)
+    categories, cat_index = np.unique(values[valid].astype(np.int64),
+                                      return_inverse=True)
+    n_cats = len(categories)
+    counts = np.bincount(index[valid] * n_cats + cat_index,
+                         minlength=count * n_cats).reshape(count, n_cats)
+
+    return categories, counts, nulls
 
-    return rmap_type, rcats
+
+def format_value(value, column_type):
+    """Format a statistic for SQL or text output, None for missing values"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if column_type == 'int':
+        return str(int(value))
+    return repr(float(value))
 
 
 def main():
@@ -298,9 +497,8 @@ def main():
     raster_maps = options['raster'].split(',')   # raster file(s) to extract from
     output = options['output']
     methods = tuple(options['methods'].split(','))
-    percentile = None if options['percentile'] == '' else map(float, options['percentile'].split(','))
+    percentile = None if options['percentile'] == '' else [float(perc) for perc in options['percentile'].split(',')]
     column_prefix = tuple(options['column_prefix'].split(','))
-    buffers = options['buffers'].split(',')
     types = options['type'].split(',')
     layer = options['layer']
     sep = options['separator']
@@ -308,9 +506,8 @@ def main():
     tabulate = flags['t']
     percent = flags['p']
     remove = flags['r']
-    use_lable = False
 
-    empty_buffer_warning = 'No data in raster map {} within buffer {} around geometry {}'
+    empty_buffer_warning = 'No data in raster map {} within buffer {} around {} geometries'
 
     # Do checks using pygrass
     for rmap in raster_maps:
@@ -318,23 +515,10 @@ def main():
         if not r_map.exist():
             grass.fatal('Could not find raster map {}.'.format(rmap))
 
-    user_mask = False
-    m_map = RasterAbstractBase('MASK', Mapset().name)
-    if m_map.exist():
-        grass.warning("Current MASK is temporarily renamed.")
-        user_mask = True
-        unset_mask()
-
     invect = VectorTopo(in_vector)
     if not invect.exist():
         grass.fatal("Vector file {} does not exist".format(in_vector))
 
-    if output:
-        if output == '-':
-            out = None
-        else:
-            out = open(output, 'w')
-
     # Check if input map is in current mapset (and thus editable)
     if in_mapset and unicode(in_mapset) != unicode(Mapset()):
         grass.fatal("Input vector map is not in current mapset and cannot be modified. \
@@ -358,345 +542,179 @@ def main():
     # int: statistic produces allways integer precision
     # double: statistic produces allways floating point precision
     # map_type: precision f statistic depends on map type
-    int_dict = {'number': (0, 'int', 'n'),
-                'number_null': (1, 'int', 'null_cells'),
-                'minimum': (3, 'map_type', 'min'),
-                'maximum': (4, 'map_type', 'max'),
-                'range': (5, 'map_type', 'range'),
-                'average': (6, 'double', 'mean'),
-                'average_abs': (7, 'double', 'mean_of_abs'),
-                'stddev': (8, 'double', 'stddev'),
-                'variance': (9, 'double', 'variance'),
-                'coeff_var': (10, 'double', 'coeff_var'),
-                'sum': (11, 'map_type', 'sum'),
-                'first_quartile': (12, 'map_type', 'first_quartile'),
-                'median': (13, 'map_type', 'median'),
-                'third_quartile': (14, 'map_type', 'third_quartile'),
-                'percentile': (15, 'map_type', 'percentile')}
+    int_dict = {'number': ('int', 'n'),
+                'number_null': ('int', 'null_cells'),
+                'minimum': ('map_type', 'min'),
+                'maximum': ('map_type', 'max'),
+                'range': ('map_type', 'range'),
+                'average': ('double', 'mean'),
+                'average_abs': ('double', 'mean_of_abs'),
+                'stddev': ('double', 'stddev'),
+                'variance': ('double', 'variance'),
+                'coeff_var': ('double', 'coeff_var'),
+                'sum': ('map_type', 'sum'),
+                'first_quartile': ('map_type', 'first_quartile'),
+                'median': ('map_type', 'median'),
+                'third_quartile': ('map_type', 'third_quartile'),
+                'percentile': ('map_type', 'percentile')}
 
     if len(raster_maps) != len(column_prefix):
         grass.fatal('Number of maps and number of column prefixes has to be equal!')
 
-    # Generate list of required column names and types
-    col_names = []
-    col_types = []
-    for p in column_prefix:
-        rmaptype, rcats = raster_type(raster_maps[column_prefix.index(p)], tabulate, use_lable)
-        for b in buffers:
-            b_str = str(b).replace('.', '_')
-            if tabulate:
-                if rmaptype == 'double precision':
-                    grass.fatal('{} has floating point precision. Can only tabulate integer maps'.format(raster_maps[column_prefix.index(p)]))
-                col_names.append('{}_{}_b{}'.format(p, 'ncats', b_str))
-                col_types.append('int')
-                col_names.append('{}_{}_b{}'.format(p, 'mode', b_str))
-                col_types.append('int')
-                col_names.append('{}_{}_b{}'.format(p, 'null', b_str))
-                col_types.append('double precision')
-                col_names.append('{}_{}_b{}'.format(p, 'area_tot', b_str))
-                col_types.append('double precision')
-                for rcat in rcats:
-                    if use_lable:
-                        rcat = rcat[1].replace(" ", "_")
-                    else:
-                        rcat = rcat[0]
-                    col_names.append('{}_{}_b{}'.format(p, rcat, b_str))
-                    col_types.append('double precision')
-            else:
-                for m in methods:
-                    col_names.append('{}_{}_b{}'.format(p, int_dict[m][2], b_str))
-                    col_types.append(rmaptype if int_dict[m][1] == 'map_type' else int_dict[m][1])
-                if percentile:
-                    for perc in percentile:
-                        col_names.append('{}_percentile_{}_b{}'.format(p,
-                                                                       int(perc) if (perc).is_integer() else perc,
-                                                                       b_str))
-                        col_types.append(rmaptype if int_dict[m][1] == 'map_type' else int_dict[m][1])
+    rmap_types = [raster_type(rmap) for rmap in raster_maps]
+    if tabulate:
+        for rmap, rmap_type in zip(raster_maps, rmap_types):
+            if rmap_type == 'double precision':
+                grass.fatal('{} has floating point precision. Can only tabulate integer maps'.format(rmap))
 
     # Open input vector map
     in_vect = VectorTopo(in_vector, layer=layer)
     in_vect.open(mode='r')
 
-    # Get name for temporary map
-    TMP_MAPS.append(tmp_map)
-
-    # Setup stats collectors
-    if tabulate:
-        # Collector for raster category statistics
-        stats = Module('r.stats', run_=False, stdout_=PIPE)
-        stats.inputs.sort = 'desc'
-        stats.inputs.null_value = 'null'
-        stats.flags.quiet = True
-        if percent:
-            stats.flags.p = True
-            stats.flags.n = True
-        else:
-            stats.flags.a = True
-    else:
-        # Collector for univariat statistics
-        univar = Module('r.univar', run_=False, stdout_=PIPE)
-        univar.inputs.separator = sep
-        univar.flags.g = True
-        univar.flags.quiet = True
-
-        # Add extended statistics if requested
-        if set(methods).intersection(set(['first_quartile',
-                                          'median', 'third_quartile'])):
-            univar.flags.e = True
-
-        if percentile is not None:
-            univar.flags.e = True
-            univar.inputs.percentile = percentile
+    # Rasterize the buffers of all geometries
+    extents = feature_extents(in_vect, types)
+    region = Region()
+    tolerance = max(region.nsres, region.ewres)
+    groups = group_features(extents, max(buffers) + tolerance)
+    grass.verbose('Rasterizing buffers of {} geometries in {} groups'.format(
+        len(extents), len(groups)))
+    cells = rasterize_buffers(in_vector, layer, types, groups, buffers)
+    cell_area = region.nsres * region.ewres
+
+    # Compute statistics for every raster map and buffer distance
+    results = []
+    for rmap, prefix, rmap_type in zip(raster_maps, column_prefix, rmap_types):
+        values = read_raster(rmap).ravel()
+        for buf in buffers:
+            b_str = str(buf).replace('.', '_')
+            indices, labels = cells[buf]
+            cats, index = np.unique(labels, return_inverse=True)
+            count = len(cats)
+            buf_values = values[indices]
+            # results are collected as (statistic, column, type, values)
+            buf_results = []
 
-    # Check if attribute table exists
-    if not output:
-        if not in_vect.table:
-            grass.fatal('No attribute table found for vector map {}'.format(in_vect))
-
-        # Modify table as needed
-        tab = in_vect.table
-        tab_name = tab.name
-        tab_cols = tab.columns
-
-        # Add required columns
-        existing_cols = list(set(tab_cols.names()).intersection(col_names))
-        if len(existing_cols) > 0:
-            if not update:
-                grass.fatal('Column(s) {} already exist! Please use the u-flag \
-                            if you want to update values in those columns'.format(','.join(existing_cols)))
+            if tabulate:
+                categories, counts, nulls = tabulate_stats(buf_values, index, count)
+                totals = counts.sum(axis=1)
+                has_data = totals > 0
+                if not has_data.all():
+                    grass.warning(empty_buffer_warning.format(rmap, buf, np.sum(~has_data)))
+                mode = np.where(has_data,
+                                categories[np.argmax(counts, axis=1)] if len(categories) else 0,
+                                np.nan)
+                buf_results.append(('ncats', '{}_{}_b{}'.format(prefix, 'ncats', b_str),
+                                    'int', np.sum(counts > 0, axis=1)))
+                buf_results.append(('mode', '{}_{}_b{}'.format(prefix, 'mode', b_str),
+                                    'int', mode))
+                if percent:
+                    with np.errstate(divide='ignore', invalid='ignore'):
+                        areas = 100. * counts / totals[:, np.newaxis]
+                else:
+                    areas = counts * cell_area
+                    buf_results.append(('null', '{}_{}_b{}'.format(prefix, 'null', b_str),
+                                        'double precision', nulls * cell_area))
+                    buf_results.append(('area_tot', '{}_{}_b{}'.format(prefix, 'area_tot', b_str),
+                                        'double precision', totals * cell_area))
+                for i, rcat in enumerate(categories):
+                    buf_results.append(('area {}'.format(rcat),
+                                        '{}_{}_b{}'.format(prefix, rcat, b_str),
+                                        'double precision', areas[:, i]))
             else:
-                grass.warning('Column(s) {} already exist!'.format(','.join(existing_cols)))
-        for e in existing_cols:
-            idx = col_names.index(e)
-            del col_names[idx]
-            del col_types[idx]
-        tab_cols.add(col_names, col_types)
-
-        conn = tab.conn
-        cur = conn.cursor()
-
-        sql_str_start = 'UPDATE {} SET '.format(tab_name)
+                stats = univariate_stats(buf_values, index, count, percentile or [])
+                if not np.all(stats['number'] > 0):
+                    grass.warning(empty_buffer_warning.format(rmap, buf, np.sum(stats['number'] == 0)))
+                for m in methods:
+                    col_type = rmap_type if int_dict[m][0] == 'map_type' else int_dict[m][0]
+                    buf_results.append((m, '{}_{}_b{}'.format(prefix, int_dict[m][1], b_str),
+                                        col_type, stats[m]))
+                for perc in percentile or []:
+                    perc_str = int(perc) if perc.is_integer() else perc
+                    buf_results.append(('percentile_{}'.format(perc_str),
+                                        '{}_percentile_{}_b{}'.format(prefix, perc_str, b_str),
+                                        rmap_type, stats[perc]))
+
+            for statistic, col_name, col_type, stat_values in buf_results:
+                results.append((prefix, buf, statistic, col_name, col_type,
+                                cats, stat_values))
+
+    # Collect the formatted values of every category
+    all_cats = sorted(extents)
+    col_names = []
+    col_types = []
+    rows = dict((cat, []) for cat in all_cats)
+    has_values = set()
+    for prefix, buf, statistic, col_name, col_type, cats, values in results:
+        if col_name not in col_names:
+            col_names.append(col_name)
+            col_types.append(col_type)
+        for cat, value in zip(cats.tolist(), values.tolist()):
+            value = format_value(value, col_type)
+            if cat in rows and value is not None:
+                rows[cat].append((prefix, buf, statistic, col_name, value))
+                has_values.add(col_name)
 
-    elif output == '-':
-        print('cat{0}raster_map{0}buffer{0}statistic{0}value'.format(sep))
-    else:
+    if output:
+        if output == '-':
+            out = sys.stdout
+        else:
+            out = open(output, 'w')
         out.write('cat{0}raster_map{0}buffer{0}statistic{0}value{1}'.format(sep, os.linesep))
+        for cat in all_cats:
+            for prefix, buf, statistic, col_name, value in rows[cat]:
+                out.write('{1}{0}{2}{0}{3}{0}{4}{0}{5}{6}'.format(
+                    sep, cat, prefix, buf, statistic, value, os.linesep))
+        if output != '-':
+            out.close()
+        in_vect.close()
+        return
 
-
-    # Get computational region
-    grass.use_temp_region()
-    r = Region()
-    r.read()
-
-    # Adjust region extent to buffer around geometry
-    #reg = deepcopy(r)
-
-    # Create iterator for geometries of all selected types
-    geoms = chain()
-    geoms_n = 0
-    n_geom = 1
-    for geom_type in types:
-        geoms_n += in_vect.number_of(geom_type)
-        if in_vect.number_of(geom_type) > 0:
-            geoms = chain(in_vect.viter(geom_type))
-
-    # Loop over geometries
-    for geom in geoms:
-        # Get cat
-        cat = geom.cat
-
-        # Add where clause to UPDATE statement
-        sql_str_end = ' WHERE cat = {};'.format(cat)
-
-        # Loop over ser provided buffer distances
-        for buf in buffers:
-            b_str = str(buf).replace('.', '_')
-            # Buffer geometry
-            if buf <= 0:
-                buffer_geom = geom
-            else:
-                buffer_geom = geom.buffer(buf)
-            # Create temporary vector map with buffered geometry
-            tmp_vect = VectorTopo(tmp_map, quiet=True)
-            tmp_vect.open(mode='w')
-            #print(int(cat))
-            tmp_vect.write(Boundary(points=buffer_geom[0].to_list()))
-            # , c_cats=int(cat), set_cats=True
-            tmp_vect.write(Centroid(x=buffer_geom[1].x,
-                                    y=buffer_geom[1].y), cat=int(cat))
-
-            #################################################
-            # How to silence VectorTopo???
-            #################################################
-
-            # Save current stdout
-            #original = sys.stdout
-
-            #f = open(os.devnull, 'w')
-            #with open('output.txt', 'w') as f:
-            #sys.stdout = io.BytesIO()
-            #sys.stdout.fileno() = os.devnull
-            #sys.stderr = f
-            #os.environ.update(dict(GRASS_VERBOSE='0'))
-            tmp_vect.close(build=False)
-            grass.run_command('v.build', map=tmp_map, quiet=True)
-            #os.environ.update(dict(GRASS_VERBOSE='1'))
-
-            #reg = Region()
-            #reg.read()
-            #r.from_vect(tmp_map)
-            r = align_current(r, buffer_geom[0].bbox())
-            r.write()
-
-            # Check if the following is needed
-            # needed specially with r.stats -p
-            #grass.run_command('g.region', vector=tmp_map, flags='a')
-
-            # Create a MASK from buffered geometry
-            if user_mask:
-                grass.run_command('v.to.rast', input=tmp_map,
-                                  output=tmp_map, use='val',
-                                  value=int(cat), quiet=True)
-                mc_expression = "MASK=if(!isnull({0}) && !isnull({0}_MASK), {1}, null())".format(tmp_map, cat)
-                grass.run_command('r.mapcalc', expression=mc_expression, quiet=True)
-            else:
-                grass.run_command('v.to.rast', input=tmp_map,
-                                  output='MASK', use='val',
-                                  value=int(cat), quiet=True)
-
-            #reg.write()
-
-            updates = []
-            # Compute statistics for every raster map
-            for rm in range(len(raster_maps)):
-                rmap = raster_maps[rm]
-                prefix = column_prefix[rm]
-
-                if tabulate:
-                    # Get statistics on occurrence of raster categories within buffer
-                    stats.inputs.input = rmap
-                    stats.run()
-                    t_stats = stats.outputs['stdout'].value.rstrip(os.linesep).replace(' ', '_b{} = '.format(b_str)).split(os.linesep)
-
-                    if t_stats[0].split('_b{} = '.format(b_str))[0].split('_')[-1] != 'null':
-                        mode = t_stats[0].split('_b{} = '.format(b_str))[0].split('_')[-1]
-                    elif len(t_stats) == 1:
-                        mode = 'NULL'
-                    else:
-                        mode = t_stats[1].split('_b{} = '.format(b_str))[0].split('_')[-1]
-
-                    if not output:
-                        updates.append('\t{}_{}_b{} = {}'.format(prefix, 'ncats', b_str, len(t_stats)))
-                        updates.append('\t{}_{}_b{} = {}'.format(prefix, 'mode', b_str, mode))
-
-                        area_tot = 0
-                        for l in t_stats:
-                            updates.append('\t{}_{}'.format(prefix, l.rstrip('%')))
-                            if l.split('_b{} ='.format(b_str))[0].split('_')[-1] != 'null':
-                                area_tot = area_tot + float(l.rstrip('%').split('= ')[1])
-                        if not percent:
-                            updates.append('\t{}_{}_b{} = {}'.format(prefix, 'area_tot', b_str, area_tot))
-
-                    else:
-                        out_str = '{1}{0}{2}{0}{3}{0}{4}{0}{5}{6}'.format(sep, cat, prefix, buf, 'ncats', len(t_stats), os.linesep)
-                        out_str += '{1}{0}{2}{0}{3}{0}{4}{0}{5}{6}'.format(sep, cat, prefix, buf, 'mode', mode, os.linesep)
-                        area_tot = 0
-                        if not t_stats[0]:
-                            grass.warning(empty_buffer_warning.format(rmap, buf, cat))
-                            continue
-                        for l in t_stats:
-                            rcat = l.split('_b{} ='.format(b_str))[0].split('_')[-1]
-                            area = l.split('= ')[1]
-                            out_str += '{1}{0}{2}{0}{3}{0}{4}{0}{5}{6}'.format(sep, cat, prefix, buf, 'area {}'.format(rcat), area, os.linesep)
-                            if rcat != 'null':
-                                area_tot = area_tot + float(l.rstrip('%').split('= ')[1])
-                        out_str += '{1}{0}{2}{0}{3}{0}{4}{0}{5}{6}'.format(sep, cat, prefix, buf, 'area_tot', area_tot, os.linesep)
-
-                        if output == '-':
-                            print(out_str.rstrip(os.linesep))
-                        else:
-                            out.write(out_str)
-
-                else:
-                    # Get univariate statistics within buffer
-                    univar.inputs.map = rmap
-                    univar.run()
-                    u_stats = univar.outputs['stdout'].value.rstrip(os.linesep).replace('=', '_b{} = '.format(b_str)).split(os.linesep)
-
-                    # Test if u_stats is empty and give warning
-                    # Needs to be adjusted to number of requested stats?
-                    if (percentile and len(u_stats) < 14) or (univar.flags.e and len(u_stats) < 13) or len(u_stats) < 12:
-                        grass.warning(empty_buffer_warning.format(rmap, buf, cat))
-                        break
-
-                    # Extract statistics for selected methods
-                    for m in methods:
-                        if not output:
-                            # Add to list of UPDATE statements
-                            updates.append('\t{}_{}'.format(prefix,
-                                                                     u_stats[int_dict[m][0]]))
-                        else:
-                            out_str = '{1}{0}{2}{0}{3}{0}{4}{0}{5}'.format(sep, cat, prefix, buf, m, u_stats[int_dict[m][0]].split('= ')[1])
-                            if output == '-':
-                                print(out_str)
-                            else:
-                                out.write("{}{}".format(out_str, os.linesep))
-
-                    if percentile:
-                        perc_count = 0
-                        for perc in percentile:
-                            if not output:
-                                updates.append('{}_percentile_{}_b{} = {}'.format(p,
-                                                                                  int(perc) if (perc).is_integer() else perc,
-                                                                                  b_str, u_stats[15+perc_count].split('= ')[1]))
-                            else:
-                                out_str = '{1}{0}{2}{0}{3}{0}{4}{0}{5}'.format(sep, cat, prefix, buf, 'percentile_{}'.format(int(perc) if (perc).is_integer() else perc), u_stats[15+perc_count].split('= ')[1])
-                                if output == '-':
-                                    print(out_str)
-                                else:
-                                    out.write(out_str)
-                            perc_count = perc_count + 1
-
-            if not output and len(updates) > 0:
-                cur.execute('{}{}{}'.format(sql_str_start,
-                                            ',\n'.join(updates),
-                                            sql_str_end))
-
-            # Remove temporary maps
-            #, stderr=os.devnull, stdout_=os.devnull)
-            grass.run_command('g.remove', flags='f', type='raster',
-                              name='MASK', quiet=True)
-            grass.run_command('g.remove', flags='f', type='vector',
-                              name=tmp_map, quiet=True)
-
-        # Give progress information
-        grass.percent(n_geom, geoms_n, 1)
-        n_geom = n_geom + 1
-
-        if not output:
-            conn.commit()
-
-    # Close cursor and DB connection
-    if not output and not output == "-":
-        cur.close()
-        conn.close()
-        # Update history
-        grass.vector.vector_history(in_vector)
-    elif output != "-":
-        # write results to file
-        out.close()
+    # Check if attribute table exists
+    if not in_vect.table:
+        grass.fatal('No attribute table found for vector map {}'.format(in_vect))
+
+    # Modify table as needed
+    tab = in_vect.table
+    tab_name = tab.name
+    tab_cols = tab.columns
+
+    # Add required columns
+    existing_cols = list(set(tab_cols.names()).intersection(col_names))
+    if len(existing_cols) > 0:
+        if not update:
+            grass.fatal('Column(s) {} already exist! Please use the u-flag \
+                        if you want to update values in those columns'.format(','.join(existing_cols)))
+        else:
+            grass.warning('Column(s) {} already exist!'.format(','.join(existing_cols)))
+    new_cols = [(name, col_type) for name, col_type in zip(col_names, col_types)
+                if name not in existing_cols]
+    if new_cols:
+        tab_cols.add([name for name, col_type in new_cols],
+                     [col_type for name, col_type in new_cols])
+
+    # Write all results in one transaction
+    conn = tab.conn
+    cur = conn.cursor()
+    for cat in all_cats:
+        updates = ['{} = {}'.format(col_name, value)
+                   for prefix, buf, statistic, col_name, value in rows[cat]]
+        if updates:
+            cur.execute('UPDATE {} SET {} WHERE cat = {};'.format(
+                tab_name, ', '.join(updates), cat))
+    conn.commit()
+    cur.close()
+    conn.close()
+    in_vect.close()
+
+    # Update history
+    grass.vector.vector_history(in_vector)
 
     if remove:
-        dropcols = []
-        selectnum = 'select count({}) from {}'
-        for i in col_names:
-            thisrow = grass.read_command('db.select', flags='c',
-                                         sql=selectnum.format(i, in_vector))
-            if int(thisrow) == 0:
-                dropcols.append(i)
+        dropcols = [name for name in col_names if name not in has_values]
         grass.debug("Columns to delete: {}".format(', '.join(dropcols)),
                     debug=2)
-        grass.run_command('v.db.dropcolumn', map=in_vector, columns=dropcols)
+        if dropcols:
+            grass.run_command('v.db.dropcolumn', map=in_vector, columns=dropcols)
 
 
 # Run the module
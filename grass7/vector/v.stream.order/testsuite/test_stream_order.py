@@ -128,6 +128,27 @@ class TestStreamOrder(TestCase):
         self.assertEqual(v.read(7).attrs["scheidegger"], 8)
         v.close()
 
+    def test_recursionlimit(self):
+        # The deprecated recursion limit is ignored
+        self.assertModule("v.stream.order", input="stream_network",
+                          points="stream_network_outlets",
+                          output="stream_network_order_test_recursionlimit",
+                          threshold=25,
+                          order=["strahler", "shreve"],
+                          recursionlimit=0,
+                          overwrite=True,  verbose=True)
+
+        v = VectorTopo(name="stream_network_order_test_recursionlimit",
+                       mapset="")
+        v.open(mode="r")
+        self.assertTrue(v.exist(), True)
+        self.assertEqual(v.num_primitive_of("line"), 101)
+        # feature 4
+        self.assertEqual(v.read(4).attrs.cat, 41)
+        self.assertEqual(v.read(4).attrs["strahler"], 4)
+        self.assertEqual(v.read(4).attrs["shreve"], 32)
+        v.close()
+
 
 class TestStreamOrderFails(TestCase):
 
@@ -166,15 +187,6 @@ class TestStreamOrderFails(TestCase):
                               order=["strahler", "shreve", "drwal", "scheidegger"],
                               overwrite=True,  verbose=True)
                               
-    def test_error_handling_4(self):
-        # Recursion limit is below 1000
-        self.assertModuleFail("v.stream.order", input="stream_network",
-                              points="stream_network_outlets",
-                              output="stream_network_order", threshold=25,
-                              order=["strahler", "shreve", "drwal", "scheidegger"],
-                              recursionlimit=0,
-                              overwrite=True,  verbose=True)
-                              
     def test_error_handling_5(self):
         # Horton order is not implemented
         self.assertModuleFail("v.stream.order", input="stream_network",
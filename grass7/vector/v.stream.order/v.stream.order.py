@@ -66,16 +66,17 @@
 #%option
 #% key: recursionlimit
 #% type: integer
-#% description:The Python recursion limit that should be used (Python default is 1000)
+#% description: Deprecated, the stream networks are traversed iteratively
 #% required : no
-#% answer: 10000
 #% multiple: no
 #%end
 
 import os
-import sys
+import ctypes
+import numpy
 from grass.script import core as grass
 from grass.pygrass.vector import VectorTopo
+import grass.lib.vector as libvect
 import math
 
 # for Python 3 compatibility
@@ -97,185 +98,184 @@ ORDER_DICT = {ORDER_STRAHLER: "strahler",
               ORDER_HORTON: "horton"}
 
 
-class GraphEdge(object):
-    """
-    This class defines a single edge of the stream network graph
+def read_network_topology(vector):
     """
+    Read the start and end node of each line of the stream network
+    vector map and the lines at each node in compressed sparse
+    row (CSR) format
 
-    def __init__(self, id_, id_pol, start, end,
-                 start_edges, end_edges,
-                 reverse=False):
-        self.id = id_  # Line id
-        self.id_pol = id_pol  # Polarity of line positive integer or negative integer
-        self.start = start  # Start Node id
-        self.end = end  # End Node id
-        self.start_edges = start_edges  # A list of edge ids at the start node
-        self.end_edges = end_edges  # A list of edge ids at the end node
-        self.reverse = reverse  # If the edge should be reversed
-        self.stream_order = {ORDER_STRAHLER: 0,
-                             ORDER_SHREVE: 0,
-                             ORDER_SCHEIDEGGER: 0,
-                             ORDER_DRWAL: 0}  # stream_order for each algorithm
-
-    def __str__(self):
-        return "Line id: %i (%i) start node: %i " \
-               "end node: %i num start edges %i " \
-               "num end edges %i   reverse: %s stream_order: %s" % (self.id, self.id_pol,
-                                                                    self.start, self.end,
-                                                                    len(self.start_edges),
-                                                                    len(self.end_edges),
-                                                                    self.reverse, str(self.stream_order))
-
-
-class GraphNode(object):
+    :param vector: The opened vector input file
+    :return: A tuple of numpy arrays (start, end, indptr, node_lines),
+             start and end are indexed by line id, the ids of the
+             lines at node n are node_lines[indptr[n]:indptr[n + 1]]
     """
-    This class defines a single node of the node network graph
+    c_mapinfo = vector.c_mapinfo
+    num_lines = libvect.Vect_get_num_lines(c_mapinfo)
+    num_nodes = libvect.Vect_get_num_nodes(c_mapinfo)
+
+    start = numpy.full(num_lines + 1, -1, dtype=numpy.int64)
+    end = numpy.full(num_lines + 1, -1, dtype=numpy.int64)
+    n1 = ctypes.c_int()
+    n2 = ctypes.c_int()
+    for line_id in xrange(1, num_lines + 1):
+        if libvect.Vect_get_line_type(c_mapinfo, line_id) & libvect.GV_LINES:
+            libvect.Vect_get_line_nodes(c_mapinfo, line_id,
+                                        ctypes.byref(n1), ctypes.byref(n2))
+            start[line_id] = n1.value
+            end[line_id] = n2.value
+
+    indptr = numpy.zeros(num_nodes + 2, dtype=numpy.int64)
+    node_lines = []
+    for node_id in xrange(1, num_nodes + 1):
+        num_node_lines = libvect.Vect_get_node_n_lines(c_mapinfo, node_id)
+        for i in xrange(num_node_lines):
+            node_lines.append(abs(libvect.Vect_get_node_line(c_mapinfo,
+                                                             node_id, i)))
+        indptr[node_id + 1] = indptr[node_id] + num_node_lines
+    indptr[num_nodes + 1:] = len(node_lines)
+
+    return start, end, indptr, numpy.array(node_lines, dtype=numpy.int64)
+
+
+def traverse_network_lines(start_node, start, end, indptr, node_lines):
     """
+    Traverse a stream network with depth-first search from a node
+    and list the ids of its lines in the order they are discovered
+
+    :param start_node: The id of the start node
+    :param start: List of the start node of each line
+    :param end: List of the end node of each line
+    :param indptr: List of the positions of each node in node_lines
+    :param node_lines: List of the line ids at the nodes
+    :return: A list of line ids
+    """
+    lines = []
+    visited = set()
+    visited_nodes = set([start_node])
+
+    # Each stack entry is the node, the position of the current line
+    # at the node and the next node of that line to be checked
+    stack = [[start_node, 0, 0]]
+    while stack:
+        entry = stack[-1]
+        node, i, k = entry
+        if i == indptr[node + 1] - indptr[node]:
+            stack.pop()
+            continue
+        line_id = node_lines[indptr[node] + i]
+        if k == 0 and line_id not in visited:
+            visited.add(line_id)
+            lines.append(line_id)
+        if k < 2:
+            # For start and end node
+            entry[2] = k + 1
+            next_node = end[line_id] if k else start[line_id]
+            if next_node not in visited_nodes:
+                visited_nodes.add(next_node)
+                stack.append([next_node, 0, 0])
+        else:
+            entry[1] = i + 1
+            entry[2] = 0
 
-    def __init__(self, id_, edge_ids):
-        self.id = id_  # Node id
-        self.edge_ids = edge_ids  # Line ids
-
-    def __str__(self):
-        return "Node id: %i line ids: %s" % (self.id, self.edge_ids)
+    return lines
 
 
-def traverse_graph_create_stream_order(start_id,
-                                       edges,
-                                       checked_edges,
-                                       reversed_edges,
-                                       order_types=[ORDER_STRAHLER,
-                                                    ORDER_SHREVE]):
+def traverse_network_upstream(outlet_id, start, end, indptr, node_lines):
     """
-    Traverse the graph, reverse lines that are not in
-    the outflow direction and compute the required orders
-    
-    :param start_id: The id of the edge to start the traversing from
-    :param edges: A dictionary of edge objects
-    :param checked_edges: A list with edge ids that have been checked already
-    :param reversed_edges: A list of edges that have been checked for
-                           reversion and corrected if necessary
+    Traverse the network from the outlet line in upstream direction
+    with breadth-first search and detect the lines that are not in
+    the outflow direction.
+
+    The outlet line keeps its direction, its start node is the upstream
+    node. Each line is visited once, so lines in loops are assigned to
+    the first downstream line they are found from.
+
+    :param outlet_id: The id of the line at the outlet point
+    :param start: List of the start node of each line
+    :param end: List of the end node of each line
+    :param indptr: List of the positions of each node in node_lines
+    :param node_lines: List of the line ids at the nodes
+    :return: A tuple of numpy arrays with the line ids in traversal
+             order, their reverse flags and the positions of their
+             downstream lines (-1 for the outlet line)
+    """
+    visited = set([outlet_id])
+    lines = [outlet_id]
+    reverse = [False]
+    parent = [-1]
+    upstream_nodes = [start[outlet_id]]
+
+    i = 0
+    while i < len(lines):
+        node = upstream_nodes[i]
+        for line_id in node_lines[indptr[node]:indptr[node + 1]]:
+            if line_id not in visited:
+                visited.add(line_id)
+                # Reverse the line if it is not in the outflow direction
+                is_reversed = end[line_id] != node
+                lines.append(line_id)
+                reverse.append(is_reversed)
+                parent.append(i)
+                upstream_nodes.append(end[line_id] if is_reversed
+                                      else start[line_id])
+        i += 1
+
+    return (numpy.array(lines, dtype=numpy.int64),
+            numpy.array(reverse, dtype=bool),
+            numpy.array(parent, dtype=numpy.int64))
+
+
+def compute_stream_orders(parent, order_types):
+    """
+    Compute the stream orders of the lines in reverse traversal order,
+    so that all upstream lines are computed before their downstream line
+
+    :param parent: Positions of the downstream line of each line
+                   in traversal order, -1 for the outlet line
     :param order_types: The type of the ordering scheme as a list of ints
                       * ORDER_STRAHLER = 1
                       * ORDER_SHREVE = 2
                       * ORDER_SCHEIDEGGER = 3
                       * ORDER_DRWAL = 4
-                      * ORDER_HORTON = 5 -> Not correct implemented
-                      
-    :return:
+    :return: A dictionary with an array of orders for each order type
     """
-    current_edge = edges[start_id]
-
-    # Check for direction reversion
-    for edge_id in current_edge.start_edges:
-        if edge_id not in reversed_edges:
-            reversed_edges.append(edge_id)
-            edge = edges[edge_id]
-
-            # Reverse the edge if it is not in the outflow direction
-            if current_edge.start != edge.end:
-                start = edge.start
-                start_edges = edge.start_edges
-                edge.start = edge.end
-                edge.start_edges = edge.end_edges
-                edge.end = start
-                edge.end_edges = start_edges
-                edge.reverse = True
-
-    # Set the stream_order to one, if the edge is a leaf and return
-    if len(current_edge.start_edges) == 0:
-        for order in current_edge.stream_order:
-            current_edge.stream_order[order] = 1
-        return
-
-    stream_orders = {ORDER_STRAHLER: [],
-                     ORDER_SHREVE: [],
-                     ORDER_SCHEIDEGGER: [],
-                     ORDER_HORTON: [],
-                     ORDER_DRWAL: []}
-
-    # Traverse the graph if its not a leaf
-    for edge_id in current_edge.start_edges:
-        if edge_id not in checked_edges:
-            checked_edges.append(edge_id)
-            traverse_graph_create_stream_order(edge_id,
-                                               edges,
-                                               checked_edges,
-                                               reversed_edges,
-                                               order_types)
-
-        for order in order_types:
-            stream_orders[order].append(edges[edge_id].stream_order[order])
-
-    # Compute the stream orders
-    if ORDER_STRAHLER in order_types:
-        maximum = max(stream_orders[ORDER_STRAHLER])
-        if stream_orders[ORDER_STRAHLER].count(maximum) > 1:
-            current_edge.stream_order[ORDER_STRAHLER] = maximum + 1
+    num_lines = len(parent)
+    strahler = [0] * num_lines
+    shreve = [0] * num_lines
+    max_child = [0] * num_lines
+    num_max_child = [0] * num_lines
+
+    for i, p in zip(xrange(num_lines - 1, -1, -1), reversed(parent)):
+        # The stream order is one, if the line is a leaf
+        if max_child[i] == 0:
+            strahler[i] = 1
+            shreve[i] = 1
+        elif num_max_child[i] > 1:
+            strahler[i] = max_child[i] + 1
         else:
-            current_edge.stream_order[ORDER_STRAHLER] = maximum
+            strahler[i] = max_child[i]
+        if p >= 0:
+            if strahler[i] > max_child[p]:
+                max_child[p] = strahler[i]
+                num_max_child[p] = 1
+            elif strahler[i] == max_child[p]:
+                num_max_child[p] += 1
+            shreve[p] += shreve[i]
+
+    shreve = numpy.array(shreve, dtype=numpy.int64)
+    stream_orders = {}
+    if ORDER_STRAHLER in order_types:
+        stream_orders[ORDER_STRAHLER] = numpy.array(strahler, dtype=numpy.int64)
     if ORDER_SHREVE in order_types:
-        current_edge.stream_order[ORDER_SHREVE] = sum(stream_orders[ORDER_SHREVE])
+        stream_orders[ORDER_SHREVE] = shreve
+    # Orders derived from shreve algorithm
     if ORDER_SCHEIDEGGER in order_types:
-        current_edge.stream_order[ORDER_SCHEIDEGGER] = sum(stream_orders[ORDER_SCHEIDEGGER])
+        stream_orders[ORDER_SCHEIDEGGER] = 2 * shreve
     if ORDER_DRWAL in order_types:
-        current_edge.stream_order[ORDER_DRWAL] = sum(stream_orders[ORDER_DRWAL])
-    # Horton is wrong implemented
-    if ORDER_HORTON in order_types:
-        maximum = max(stream_orders[ORDER_HORTON])
-        current_edge.stream_order[ORDER_HORTON] = maximum + 1
-
-
-def traverse_network_create_graph(vector, start_node, graph_nodes, graph_edges):
-    """
-    Traverse a stream network vector map layer with depth-first search
-    and create a graphs structures for nodes and edges
-
-    :param vector: The opened vector input file
-    :param start_node: The start node object
-    :param graph_nodes: A dictionary of discovered nodes
-    :param graph_edges: A dictionary of Edge objects
-    :return:
-    """
+        stream_orders[ORDER_DRWAL] = \
+            numpy.floor(numpy.log2(shreve)).astype(numpy.int64) + 1
 
-    # Count line ids
-    edge_ids = start_node.ilines()
-
-    # For each line at that node
-    for line_id in edge_ids:
-
-        line_id_abs = abs(line_id)
-        line = vector.read(line_id_abs)
-        nodes = line.nodes()
-
-        # If the line id is not in the edge list, create a new entry
-        if line_id_abs not in graph_edges:
-            start_edges = [abs(lid) for lid in nodes[0].ilines()]
-            end_edges = [abs(lid) for lid in nodes[1].ilines()]
-
-            start_edges.remove(line_id_abs)
-            end_edges.remove(line_id_abs)
-
-            e = GraphEdge(line_id_abs,
-                          line_id,
-                          nodes[0].id,
-                          nodes[1].id,
-                          start_edges,
-                          end_edges,
-                          False)
-            graph_edges[line_id_abs] = e
-
-        # For start and end node
-        for node in nodes:
-            # If the node was not yet discovered, put it
-            # into the node dict and call traverse
-            if node.id not in graph_nodes:
-                graph_nodes[node.id] = GraphNode(node.id,
-                                                 [lid for lid in node.ilines()])
-                # Recursive call
-                traverse_network_create_graph(vector, node,
-                                              graph_nodes,
-                                              graph_edges)
+    return stream_orders
 
 
 def graph_to_vector(name, mapset, graphs,
@@ -287,6 +287,9 @@ def graph_to_vector(name, mapset, graphs,
     category and copy columns from the source stream network
     vector map if required.
 
+    The attributes of all lines are inserted at once after
+    the lines have been written.
+
     :param name: Name of the input stream vector map
     :param mapset: Mapset name of the input stream vector map
     :param graphs: The list of computed graphs
@@ -313,10 +316,17 @@ def graph_to_vector(name, mapset, graphs,
         for entry in copy_columns:
             cols.append((entry[1], entry[2]))
 
+        # Read the attribute table of the input map at once
+        key_index = streams.table.columns.names().index(streams.table.key)
+        input_rows = dict((row[key_index], row)
+                          for row in streams.table.execute().fetchall())
+
     out_streams = VectorTopo(output)
     grass.message(_("Writing vector map <%s>" % output))
     out_streams.open("w", tab_cols=cols)
 
+    rows = []
+    written = set()
     count = 0
     for graph in graphs:
         outlet_cat = outlet_cats[count]
@@ -325,47 +335,44 @@ def graph_to_vector(name, mapset, graphs,
         grass.message(_("Writing network %i from %i with "
                         "outlet category %i" % (count, len(graphs), outlet_cat)))
 
-        # Write each edge as line
-        for edge_id in graph:
-            edge = graph[edge_id]
+        orders = [graph["orders"][order].tolist() for order in order_types]
 
+        # Write each edge as line
+        for i, (edge_id, reverse) in enumerate(zip(graph["lines"].tolist(),
+                                                   graph["reversed"].tolist())):
             line = streams.read(edge_id)
             # Reverse the line if required
-            if edge.reverse is True:
+            if reverse is True:
                 line.reverse()
 
-            # Orders derived from shreve algorithm
-            if ORDER_SCHEIDEGGER in order_types:
-                edge.stream_order[ORDER_SCHEIDEGGER] *= 2
-            if ORDER_DRWAL in order_types:
-                if edge.stream_order[ORDER_DRWAL] != 0:
-                    edge.stream_order[ORDER_DRWAL] = \
-                        int(math.log(edge.stream_order[ORDER_DRWAL], 2) + 1)
-
-            # Create attributes
-            attrs = []
-            # Append the outlet point category
-            attrs.append(outlet_cat)
-            # Append the network id
-            attrs.append(count)
-            # The reverse flag
-            attrs.append(edge.reverse)
+            # Write the feature
+            out_streams.write(line, cat=edge_id)
+
+            # Lines that are part of several networks keep
+            # the attributes of the first network
+            if edge_id in written:
+                continue
+            written.add(edge_id)
+
+            # Create attributes: the category, the outlet point category,
+            # the network id and the reverse flag
+            attrs = [edge_id, outlet_cat, count, int(reverse)]
             # Then the stream orders defined at the command line
-            for order in order_types:
-                val = int(edge.stream_order[order])
+            for values in orders:
+                val = values[i]
                 if val == 0:
                     val = None
                 attrs.append(val)
             # Copy attributes from original streams if the table exists
             if copy_columns:
+                row = input_rows.get(line.cat)
                 for entry in copy_columns:
                     # First entry is the column index
-                    attrs.append(line.attrs.values()[entry[0]])
+                    attrs.append(row[entry[0]] if row else None)
+            rows.append(attrs)
 
-            # Write the feature
-            out_streams.write(line, cat=edge_id, attrs=attrs)
-
-    # Commit the database entries
+    # Insert and commit the database entries
+    out_streams.table.insert(rows, many=True)
     out_streams.table.conn.commit()
     # Close the input and output map
     out_streams.close()
@@ -457,6 +464,7 @@ def detect_compute_networks(vname, vmapset, pname, pmapset,
     start_nodes = []
     start_node_ids = []
     start_edges = []
+    outlet_nodes = []
     outlet_cats = []
 
     for point in p:
@@ -493,6 +501,7 @@ def detect_compute_networks(vname, vmapset, pname, pmapset,
 
             if line.id not in start_edges:
                 start_edges.append(line.id)
+                outlet_nodes.append(closest_node.id)
                 outlet_cats.append(point.cat)
             else:
                 grass.warning(_("Ignoring duplicated start edge"))
@@ -507,17 +516,9 @@ def detect_compute_networks(vname, vmapset, pname, pmapset,
         v.close()
         grass.fatal(_("Unable to find start nodes"))
 
-    # We create a graph representation for further computations
-    graphs = []
-
-    # Traverse each network from the outflow node on
-    for node in start_nodes:
-        graph_nodes = {}
-        graph_edges = {}
-        graph_nodes[node.id] = GraphNode(node.id, [lid for lid in node.ilines()])
-        traverse_network_create_graph(v, node, graph_nodes, graph_edges)
-        # For now we only use the edges graph
-        graphs.append(graph_edges)
+    # We create an array representation of the network topology
+    # for further computations
+    start, end, indptr, node_lines = read_network_topology(v)
 
     # Close the vector map, since we have our own graph representation
     v.close()
@@ -531,20 +532,39 @@ def detect_compute_networks(vname, vmapset, pname, pmapset,
         order_types.append(ORDER_SCHEIDEGGER)
     if order.find("drwal") >= 0:
         order_types.append(ORDER_DRWAL)
-    if order.find("horton") >= 0:
-        order_types.append(ORDER_HORTON)
     if order.find("shreve") >= 0:
         order_types.append(ORDER_SHREVE)
 
-    # Compute the stream orders
-    for i in xrange(len(start_edges)):
-        edge_id = start_edges[i]
-        checked_edges = []
-        reversed_edges = []
-        traverse_graph_create_stream_order(edge_id, graphs[i],
-                                           checked_edges,
-                                           reversed_edges,
-                                           order_types)
+    # Traverse each network from the outflow node on
+    # and compute the stream orders from the outflow edge on
+    graphs = []
+    position = numpy.full(len(start), -1, dtype=numpy.int64)
+    start_list, end_list = start.tolist(), end.tolist()
+    indptr, node_lines = indptr.tolist(), node_lines.tolist()
+    for edge_id, node_id in zip(start_edges, outlet_nodes):
+        lines = numpy.array(traverse_network_lines(node_id, start_list,
+                                                   end_list, indptr,
+                                                   node_lines),
+                            dtype=numpy.int64)
+        upstream, reverse, parent = \
+            traverse_network_upstream(edge_id, start_list, end_list,
+                                      indptr, node_lines)
+        orders = compute_stream_orders(parent.tolist(), order_types)
+
+        # Lines in downstream direction of the outflow edge
+        # are not reversed and have no stream order
+        position[upstream] = numpy.arange(len(upstream))
+        index = position[lines]
+        position[upstream] = -1
+        found = index >= 0
+        graph = {"lines": lines,
+                 "reversed": numpy.zeros(len(lines), dtype=bool),
+                 "orders": {}}
+        graph["reversed"][found] = reverse[index[found]]
+        for order in order_types:
+            graph["orders"][order] = numpy.zeros(len(lines), dtype=numpy.int64)
+            graph["orders"][order][found] = orders[order][index[found]]
+        graphs.append(graph)
 
     # Write the graphs as vector map
     graph_to_vector(vname, vmapset, graphs,
@@ -559,15 +579,9 @@ def main():
     order = options["order"]
     threshold = options["threshold"]
     columns = options["columns"]
-    recursionlimit = options["recursionlimit"]
-
-    # We are using a recursive tree traversing algorithm, that may exceed
-    # the 1000 recursion length for huge networks.
-    # The default is 10000 in the option section
-    if int(recursionlimit) < 1000:
-        grass.fatal(_("The Python recursion limit should be equal or larger than 1000"))
-
-    sys.setrecursionlimit(int(recursionlimit))
+    if options["recursionlimit"]:
+        grass.warning(_("The option recursionlimit is deprecated, "
+                        "the networks are traversed iteratively"))
 
     # Check map names for mapsets
     vname = input